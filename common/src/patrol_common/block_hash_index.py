@@ -0,0 +1,167 @@
+import fcntl
+import mmap
+import os
+from typing import Iterable, Optional
+
+from patrol_common.paths import prepare_path
+
+HASH_SIZE = 32
+# The file starts with a marker of its format, then the genesis hash of the chain its block hashes are of.
+MAGIC = b"patrol block hash index v1".ljust(HASH_SIZE, b"\0")
+HEADER_SIZE = 2 * HASH_SIZE
+
+
+class ChainMismatchError(Exception):
+    pass
+
+
+class BlockHashIndex:
+    def __init__(self, path: str, growth_blocks: int = 2**16):
+        """
+        A persistent, append-only index of block number to block hash, stored as a memory-mapped file of
+        fixed-width 32 byte hashes at offset `block_number * 32` after a header. Lookups are O(1), and
+        unwritten slots read back as zeros.
+
+        Only hashes of finalized blocks may be stored, as they never change. Several processes may share
+        the same file: slots are written independently and the mapping is refreshed when another process
+        has grown the file.
+
+        The header records the genesis hash of the chain the hashes are of, set by `bind`, which callers
+        use before reading from the index so that a file written for another network is never used.
+        A file without a header, written before it was added, is cleared as its chain is unknown.
+
+        Args:
+            path: Location of the index file, created if missing.
+            growth_blocks: Number of slots the file is grown by at a time.
+        """
+        self.path = prepare_path(path)
+        self.growth_blocks = growth_blocks
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._mmap: Optional[mmap.mmap] = None
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.pread(self._fd, HASH_SIZE, 0) != MAGIC:
+                os.ftruncate(self._fd, 0)
+                os.pwrite(self._fd, MAGIC + bytes(HASH_SIZE), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._remap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def capacity(self) -> int:
+        return (len(self._mmap) - HEADER_SIZE) // HASH_SIZE if self._mmap is not None else 0
+
+    @property
+    def genesis_hash(self) -> Optional[str]:
+        """
+        The genesis hash of the chain the index is bound to, or None if it is not bound yet.
+        """
+        value = os.pread(self._fd, HASH_SIZE, HASH_SIZE)
+        return "0x" + value.hex() if any(value) else None
+
+    def bind(self, genesis_hash: str):
+        """
+        Binds the index to the chain with the given genesis hash, unless it is bound already.
+
+        Raises:
+            ChainMismatchError: If the index holds block hashes of another chain.
+        """
+        value = bytes.fromhex(genesis_hash[2:] if genesis_hash.startswith("0x") else genesis_hash)
+        if len(value) != HASH_SIZE:
+            raise ValueError(f"Genesis hash must be {HASH_SIZE} bytes, got {len(value)}")
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            stored = os.pread(self._fd, HASH_SIZE, HASH_SIZE)
+            if not any(stored):
+                os.pwrite(self._fd, value, HASH_SIZE)
+            elif stored != value:
+                raise ChainMismatchError(
+                    f"{self.path} holds block hashes of the chain with genesis hash 0x{stored.hex()}, not {genesis_hash}"
+                )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _remap(self):
+        size = os.fstat(self._fd).st_size
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if size > 0:
+            self._mmap = mmap.mmap(self._fd, size)
+
+    def _ensure_capacity(self, block_number: int):
+        if block_number < self.capacity:
+            return
+        self._remap()
+        if block_number < self.capacity:
+            return
+        blocks = (block_number // self.growth_blocks + 1) * self.growth_blocks
+        # Only ever grow the file, under a lock, as shrinking it would pull pages out from under the mappings
+        # of processes that grew it further in the meantime.
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size < HEADER_SIZE + blocks * HASH_SIZE:
+                os.ftruncate(self._fd, HEADER_SIZE + blocks * HASH_SIZE)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._remap()
+
+    def get(self, block_number: int) -> Optional[str]:
+        """
+        Returns the hash of the block as a 0x-prefixed hex string, or None if it is not indexed.
+        """
+        if block_number < 0:
+            return None
+        if block_number >= self.capacity:
+            # Another process may have grown the file since it was mapped.
+            self._remap()
+            if block_number >= self.capacity:
+                return None
+        offset = HEADER_SIZE + block_number * HASH_SIZE
+        value = self._mmap[offset:offset + HASH_SIZE]
+        if not any(value):
+            return None
+        return "0x" + value.hex()
+
+    def get_many(self, block_numbers: Iterable[int]) -> dict[int, str]:
+        """
+        Returns the hashes of the indexed blocks among `block_numbers`, leaving out those not indexed.
+        """
+        found = {}
+        for block_number in block_numbers:
+            block_hash = self.get(block_number)
+            if block_hash is not None:
+                found[block_number] = block_hash
+        return found
+
+    def put(self, block_number: int, block_hash: str):
+        value = bytes.fromhex(block_hash[2:] if block_hash.startswith("0x") else block_hash)
+        if len(value) != HASH_SIZE:
+            raise ValueError(f"Block hash must be {HASH_SIZE} bytes, got {len(value)} for block {block_number}")
+        if block_number < 0:
+            raise ValueError(f"Block number must not be negative, got {block_number}")
+        self._ensure_capacity(block_number)
+        offset = HEADER_SIZE + block_number * HASH_SIZE
+        self._mmap[offset:offset + HASH_SIZE] = value
+
+    def put_many(self, block_hashes: dict[int, str]):
+        if not block_hashes:
+            return
+        self._ensure_capacity(max(block_hashes))
+        for block_number, block_hash in block_hashes.items():
+            self.put(block_number, block_hash)
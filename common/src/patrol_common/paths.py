@@ -0,0 +1,15 @@
+import os
+
+
+def prepare_path(path: str) -> str:
+    """
+    Expands `~` in the location of a file kept on disk, and creates the directory it goes in.
+
+    Returns:
+        The expanded path.
+    """
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return path
@@ -0,0 +1,87 @@
+import pytest
+
+from patrol_common.block_hash_index import BlockHashIndex, ChainMismatchError
+
+HASH_A = "0x" + "ab" * 32
+HASH_B = "0x" + "cd" * 32
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "index" / "block_hashes.bin")
+
+
+def test_put_and_get(index_path):
+    with BlockHashIndex(index_path, growth_blocks=16) as index:
+        index.put(5, HASH_A)
+        index.put(40, HASH_B)
+
+        assert index.get(5) == HASH_A
+        assert index.get(40) == HASH_B
+        assert index.get(6) is None
+        assert index.get(10_000) is None
+        assert index.capacity == 48
+
+
+def test_index_persists_across_instances(index_path):
+    with BlockHashIndex(index_path) as index:
+        index.put_many({1: HASH_A, 2: HASH_B})
+
+    with BlockHashIndex(index_path) as index:
+        assert index.get_many([1, 2, 3]) == {1: HASH_A, 2: HASH_B}
+
+
+def test_sees_blocks_written_by_another_instance(index_path):
+    with BlockHashIndex(index_path, growth_blocks=16) as reader, BlockHashIndex(index_path, growth_blocks=16) as writer:
+        assert reader.get(100) is None
+        writer.put(100, HASH_A)
+        assert reader.get(100) == HASH_A
+
+
+def test_refuses_to_bind_to_another_chain(index_path):
+    with BlockHashIndex(index_path) as index:
+        assert index.genesis_hash is None
+        index.bind(HASH_A)
+        index.put(1, HASH_B)
+
+    with BlockHashIndex(index_path) as index:
+        index.bind(HASH_A)
+        assert index.genesis_hash == HASH_A
+        with pytest.raises(ChainMismatchError):
+            index.bind(HASH_B)
+
+
+def test_clears_a_file_without_header(index_path):
+    with BlockHashIndex(index_path) as index:
+        index.put(1, HASH_B)
+    # A file of bare hashes, as written before the header was added
+    with open(index_path, "r+b") as f:
+        f.write(bytes.fromhex(HASH_A[2:]))
+
+    with BlockHashIndex(index_path) as index:
+        assert index.genesis_hash is None
+        assert index.get(1) is None
+
+
+def test_rejects_malformed_hashes(index_path):
+    with BlockHashIndex(index_path) as index:
+        with pytest.raises(ValueError):
+            index.put(1, "0x1234")
+
+
+def test_growing_never_shrinks_a_file_grown_by_another_instance(index_path, monkeypatch):
+    with BlockHashIndex(index_path, growth_blocks=16) as index, BlockHashIndex(index_path, growth_blocks=1024) as other:
+        remap = index._remap
+
+        def remap_then_race():
+            remap()
+            # The other instance grows the file between this instance's capacity check and its own growth.
+            if other.get(500) is None:
+                other.put(500, HASH_B)
+
+        monkeypatch.setattr(index, "_remap", remap_then_race)
+        index.put(20, HASH_A)
+
+        assert index.capacity == 1024
+        assert index.get_many([20, 500]) == {20: HASH_A, 500: HASH_B}
+        assert other.get(500) == HASH_B
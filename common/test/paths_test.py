@@ -0,0 +1,18 @@
+import os
+
+from patrol_common.paths import prepare_path
+
+
+def test_creates_the_directory_of_the_file(tmp_path):
+    path = prepare_path(str(tmp_path / "a" / "b" / "store.sqlite"))
+
+    assert path == str(tmp_path / "a" / "b" / "store.sqlite")
+    assert os.path.isdir(tmp_path / "a" / "b")
+    assert not os.path.exists(path)
+
+
+def test_expands_home_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+
+    assert prepare_path("~/.patrol/store.sqlite") == str(tmp_path / ".patrol" / "store.sqlite")
+    assert os.path.isdir(tmp_path / ".patrol")
@@ -0,0 +1,90 @@
+"""
+Compares parsing decoded block events on the event loop against sharding them across worker processes
+(EventProcessor `workers`), for 1k and 10k block windows of synthetic transfer and staking events.
+
+Besides the total time, it reports the longest stall of a task ticking on the event loop alongside the
+parsing, which stands in for the websocket receive task that parsing on the loop holds up.
+
+Run from the miner directory with:
+
+    PYTHONPATH=src python local_dev/benchmarks/event_processor_benchmark.py
+"""
+import asyncio
+import os
+import random
+import time
+
+from patrol_mining.chain_data.event_processor import EventProcessor
+
+WINDOWS = [1_000, 10_000]
+EVENTS_PER_BLOCK = 20
+WORKERS = max(2, min(8, os.cpu_count() or 1))
+TICK_SECONDS = 0.001
+
+
+class StaticColdkeyFinder:
+    async def find_many(self, hotkeys):
+        return {hotkey: f"owner-{hotkey[:8]}" for hotkey in hotkeys}
+
+
+def account(rng: random.Random) -> tuple:
+    return (tuple(rng.randrange(256) for _ in range(32)),)
+
+
+def make_event_data(blocks: int) -> dict:
+    rng = random.Random(blocks)
+    hotkeys = [account(rng) for _ in range(64)]
+    event_data = {}
+    for block_number in range(5_000_000, 5_000_000 + blocks):
+        events = []
+        for _ in range(EVENTS_PER_BLOCK // 2):
+            events.append({"event": {"Balances": [{"Transfer": {"from": account(rng), "to": account(rng), "amount": rng.randrange(1, 10**12)}}]}})
+            amount = rng.randrange(1, 10**12)
+            events.append({"event": {"SubtensorModule": [{"StakeAdded": (account(rng), rng.choice(hotkeys), amount, amount, 1)}]}})
+        event_data[block_number] = events
+    return event_data
+
+
+async def measure(processor: EventProcessor, event_data: dict) -> tuple[float, float, int]:
+    longest_stall = 0.0
+    running = True
+
+    async def tick():
+        nonlocal longest_stall
+        while running:
+            before = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            longest_stall = max(longest_stall, time.perf_counter() - before - TICK_SECONDS)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    start_time = time.perf_counter()
+    events = await processor.process_event_data(event_data)
+    elapsed = time.perf_counter() - start_time
+    running = False
+    await ticker
+    return elapsed, longest_stall, len(events)
+
+
+async def main():
+    serial = EventProcessor(StaticColdkeyFinder())
+    parallel = EventProcessor(StaticColdkeyFinder(), workers=WORKERS)
+    # Start the worker processes up front, so their startup is not counted.
+    await parallel.process_event_data(make_event_data(parallel.min_parallel_blocks))
+
+    for blocks in WINDOWS:
+        event_data = make_event_data(blocks)
+        print(f"{blocks} blocks, {blocks * EVENTS_PER_BLOCK} events:")
+        results = {}
+        for name, processor in (("event loop", serial), (f"{WORKERS} workers", parallel)):
+            elapsed, stall, count = await measure(processor, event_data)
+            results[name] = elapsed
+            print(f"  {name:>10}: {elapsed:7.3f}s | {count} edges | longest event loop stall {stall * 1000:8.1f} ms")
+        speedup = results["event loop"] / results[f"{WORKERS} workers"]
+        print(f"  speedup: {speedup:.2f}x")
+
+    parallel.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Compares matching legacy (old format) stake events to withdraw/deposit operations by scanning every operation
+for each event, as EventProcessor used to, against the amount-indexed EventProcessor.match_old_stake_events,
+on synthetic worst-case blocks with thousands of legacy stake events.
+
+Run from the miner directory with:
+
+    PYTHONPATH=src python local_dev/benchmarks/legacy_stake_matching_benchmark.py
+"""
+import copy
+import random
+import time
+
+from patrol_mining.chain_data.event_processor import EventProcessor
+
+# Legacy stake events in a single block
+BLOCK_SIZES = [1_000, 5_000, 10_000]
+
+
+def match_by_scanning(old_stake_events, chain_operations):
+    matched = []
+    for entry in old_stake_events:
+        if entry["type"] == "add":
+            matches = [x for x in chain_operations["withdrawal"] if x["rao_amount"] == entry["evidence"]["rao_amount"]]
+            if len(matches) == 1:
+                entry["coldkey_source"] = matches[0]["coldkey_source"]
+                matched.append(entry)
+        elif entry["type"] == "remove":
+            matches = [x for x in chain_operations["deposit"] if x["rao_amount"] == entry["evidence"]["rao_amount"]]
+            if len(matches) == 1:
+                entry["coldkey_destination"] = matches[0]["coldkey_destination"]
+                matched.append(entry)
+    return matched
+
+
+def make_block(size: int):
+    """
+    Half adds and half removes, each with a balance operation of the same amount. A few amounts repeat,
+    so the uniqueness rule rejects some matches.
+    """
+    rng = random.Random(size)
+    old_stake_events = []
+    chain_operations = {"withdrawal": [], "deposit": []}
+    for i in range(size):
+        amount = rng.randrange(size * 10)
+        if i % 2 == 0:
+            old_stake_events.append({"type": "add", "coldkey_source": None, "coldkey_destination": f"owner{i}", "evidence": {"rao_amount": amount}})
+            chain_operations["withdrawal"].append({"coldkey_source": f"cold{i}", "rao_amount": amount})
+        else:
+            old_stake_events.append({"type": "remove", "coldkey_source": f"owner{i}", "coldkey_destination": None, "evidence": {"rao_amount": amount}})
+            chain_operations["deposit"].append({"coldkey_destination": f"cold{i}", "rao_amount": amount})
+    return old_stake_events, chain_operations
+
+
+def measure(match, old_stake_events, chain_operations):
+    events = copy.deepcopy(old_stake_events)
+    start_time = time.perf_counter()
+    matched = match(events, chain_operations)
+    return time.perf_counter() - start_time, matched
+
+
+if __name__ == "__main__":
+    for size in BLOCK_SIZES:
+        old_stake_events, chain_operations = make_block(size)
+
+        scan_time, scan_matched = measure(match_by_scanning, old_stake_events, chain_operations)
+        index_time, index_matched = measure(EventProcessor.match_old_stake_events, old_stake_events, chain_operations)
+        assert scan_matched == index_matched
+
+        print(f"{size} legacy stake events in one block, {len(index_matched)} matched:")
+        print(f"     scan: {scan_time * 1000:10.2f} ms")
+        print(f"  indexed: {index_time * 1000:10.2f} ms | speedup {scan_time / index_time:.0f}x")
@@ -0,0 +1,69 @@
+"""
+Compares building and searching the transaction graph as dicts of adjacency lists, as SubgraphGenerator used
+to, against the integer-interned CSR TransactionGraph, on random graphs of transfer events.
+
+Run from the miner directory with:
+
+    PYTHONPATH=src python local_dev/benchmarks/subgraph_benchmark.py
+"""
+import random
+import time
+
+from patrol_mining.transaction_graph import TransactionGraph
+
+# (wallets, transfer events)
+GRAPH_SIZES = [(2_000, 10_000), (10_000, 50_000), (40_000, 200_000)]
+
+
+def make_events(wallets: int, events: int) -> list[dict]:
+    rng = random.Random(events)
+    return [
+        {
+            "coldkey_source": f"wallet{rng.randrange(wallets)}",
+            "coldkey_destination": f"wallet{rng.randrange(wallets)}",
+            "category": "balance",
+            "type": "transfer",
+            "evidence": {"rao_amount": rng.randrange(1, 10**9), "block_number": 5_000_000 + n // 20},
+        }
+        for n in range(events)
+    ]
+
+
+def adjacency_list_subgraph(events: list[dict], target: str) -> tuple[int, int]:
+    graph = {}
+    for event in events:
+        src, dst = event["coldkey_source"], event["coldkey_destination"]
+        graph.setdefault(src, []).append({"neighbor": dst, "event": event})
+        graph.setdefault(dst, []).append({"neighbor": src, "event": event})
+
+    nodes, seen_nodes, seen_edges, queue = 0, set(), set(), [target]
+    while queue:
+        current = queue.pop(0)
+        if current not in seen_nodes:
+            nodes += 1
+            seen_nodes.add(current)
+        for conn in graph.get(current, []):
+            seen_edges.add(TransactionGraph.edge_key(conn["event"]))
+            if conn["neighbor"] not in seen_nodes and conn["neighbor"] not in queue:
+                queue.append(conn["neighbor"])
+    return nodes, len(seen_edges)
+
+
+def csr_subgraph(events: list[dict], target: str) -> tuple[int, int]:
+    graph = TransactionGraph()
+    graph.add_events(events)
+    subgraph = graph.subgraph(target)
+    return len(subgraph.nodes), len(subgraph.edges)
+
+
+if __name__ == "__main__":
+    for wallets, count in GRAPH_SIZES:
+        events = make_events(wallets, count)
+        print(f"{wallets} wallets, {count} transfers:")
+        results = {}
+        for name, search in (("adjacency lists", adjacency_list_subgraph), ("CSR", csr_subgraph)):
+            start_time = time.perf_counter()
+            results[name] = search(events, "wallet0")
+            elapsed = time.perf_counter() - start_time
+            print(f"  {name:>15}: {elapsed:8.3f}s | {results[name][0]} nodes, {results[name][1]} edges", flush=True)
+        assert results["adjacency lists"] == results["CSR"]
@@ -0,0 +1,61 @@
+"""
+Compares the standard json codec against the orjson + bytes-native path used by PatrolWebsocket when decoding
+System.Events storage responses, reporting throughput and peak memory for each.
+
+Run from the miner directory with:
+
+    PYTHONPATH=src python local_dev/benchmarks/websocket_codec_benchmark.py
+"""
+import json
+import os
+import time
+import tracemalloc
+
+import orjson
+
+from patrol_mining.chain_data.patrol_websocket import hex_result_to_bytes
+
+# Events payload sizes in bytes, roughly quiet, busy and very high volume blocks.
+PAYLOAD_SIZES = [64 * 1024, 1024 * 1024, 8 * 1024 * 1024]
+ITERATIONS = 20
+
+
+def make_frame(size: int) -> bytes:
+    result = "0x" + os.urandom(size).hex()
+    return json.dumps({"jsonrpc": "2.0", "result": result, "id": "00002a"}, separators=(",", ":")).encode()
+
+
+def decode_standard(frame: bytes) -> bytes:
+    response = json.loads(frame)
+    return bytes.fromhex(response["result"][2:])
+
+
+def decode_fast(frame: bytes) -> bytes:
+    response = orjson.loads(frame)
+    return hex_result_to_bytes(frame, response["result"])
+
+
+def measure(decode, frame: bytes) -> tuple[float, int]:
+    start_time = time.perf_counter()
+    for _ in range(ITERATIONS):
+        decode(frame)
+    elapsed = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    decode(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    throughput = len(frame) * ITERATIONS / elapsed / 2**20
+    return throughput, peak
+
+
+if __name__ == "__main__":
+    for size in PAYLOAD_SIZES:
+        frame = make_frame(size)
+        assert decode_standard(frame) == decode_fast(frame)
+
+        print(f"Frame of {len(frame) / 2**20:.2f} MiB ({size / 2**10:.0f} KiB of SCALE data):")
+        for name, decode in (("json", decode_standard), ("orjson", decode_fast)):
+            throughput, peak = measure(decode, frame)
+            print(f"  {name:>7}: {throughput:8.1f} MiB/s | peak memory {peak / 2**20:6.2f} MiB")
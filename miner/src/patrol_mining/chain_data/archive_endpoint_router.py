@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from patrol_mining.chain_data.patrol_websocket import get_next_id
+from patrol_mining.chain_data.patrol_websocket_pool import PatrolWebsocketPool
+
+logger = logging.getLogger(__name__)
+
+
+def _is_rate_limited(response: Any) -> bool:
+    if not isinstance(response, dict) or "error" not in response:
+        return False
+    error = str(response["error"]).lower()
+    return "429" in error or "too many requests" in error or "rate limit" in error
+
+
+class RateLimitedError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout_seconds: float = 30):
+        """
+        Stops routing to an endpoint after `failure_threshold` consecutive failures. Once
+        `reset_timeout_seconds` have passed, a single trial request is let through (half-open):
+        success closes the breaker again, failure re-opens it.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout_seconds:
+            return "half-open"
+        return "open"
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether a request would be let through, without claiming the half-open trial.
+        """
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self._trial_in_flight)
+
+    def allow_request(self) -> bool:
+        """
+        Whether to send a request, claiming the half-open trial if it is let through.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class ArchiveEndpoint:
+    def __init__(self, websocket: PatrolWebsocketPool, breaker: CircuitBreaker, latency_window: int = 200):
+        """
+        An archive node endpoint with its connection pool, circuit breaker and recent latency and
+        success statistics used to score it.
+        """
+        self.websocket = websocket
+        self.breaker = breaker
+        self.latencies = deque(maxlen=latency_window)
+        # Exponentially weighted success rate, 1.0 for an endpoint with no failures
+        self.health = 1.0
+
+    @property
+    def url(self) -> str:
+        return self.websocket.ws_url
+
+    def p95_latency(self) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.health = 0.8 * self.health + 0.2
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.health = 0.8 * self.health
+        self.breaker.record_failure()
+        if self.breaker.state != "closed":
+            logger.warning("Circuit breaker for %s is %s after %s consecutive failures.", self.url, self.breaker.state, self.breaker.consecutive_failures)
+
+    def score(self) -> tuple:
+        p95 = self.p95_latency()
+        return -round(self.health, 1), p95 if p95 is not None else 0, self.websocket.pending_requests
+
+
+class ArchiveEndpointRouter:
+    def __init__(
+            self,
+            websockets: list[PatrolWebsocketPool],
+            hedge_requests: bool = False,
+            default_hedge_delay_seconds: float = 1,
+            min_hedge_delay_seconds: float = 0.05,
+            failure_threshold: int = 5,
+            reset_timeout_seconds: float = 30,
+            request_timeout_seconds: float = 60,
+    ):
+        """
+        Routes requests across several archive node endpoints, exposing the same interface as PatrolWebsocket.
+
+        Endpoints are ranked by health score and latency, and skipped while their circuit breaker is open.
+        A failed request fails over to the next endpoint. With hedging enabled, a request the primary
+        endpoint has not answered within its p95 latency is duplicated to a second endpoint, and the first
+        answer wins.
+
+        Args:
+            websockets: One connection pool per archive node endpoint, in order of preference.
+            hedge_requests: Whether to duplicate slow requests to a second endpoint.
+            default_hedge_delay_seconds: Hedge delay used until an endpoint has latency samples.
+            min_hedge_delay_seconds: Lower bound on the hedge delay.
+            failure_threshold: Consecutive failures (including 429s) after which an endpoint's breaker opens.
+            reset_timeout_seconds: Time an open breaker waits before letting a trial request through.
+            request_timeout_seconds: Time a request sent without a timeout may take before it is cancelled.
+                Its response, or a TimeoutError once cancelled, is kept until collected with `retrieve`.
+        """
+        self.endpoints = [
+            ArchiveEndpoint(ws, CircuitBreaker(failure_threshold, reset_timeout_seconds))
+            for ws in websockets
+        ]
+        self.hedge_requests = hedge_requests
+        self.default_hedge_delay_seconds = default_hedge_delay_seconds
+        self.min_hedge_delay_seconds = min_hedge_delay_seconds
+        self._request_timeout_seconds = request_timeout_seconds
+        self._requests: dict[str, asyncio.Task] = {}
+        self._entered: dict[asyncio.Task, list[list[ArchiveEndpoint]]] = {}
+
+    async def __aenter__(self):
+        """
+        Enters the endpoints requests are routed to: those connected and not cut off by their breaker, or the
+        best of them when none is connected yet. Endpoints that are down are left to connect when a request is
+        routed to them, so an unreachable fallback does not hold up or fail every call made within the context.
+        """
+        ranked = self._ranked()
+        usable = [e for e in ranked if e.breaker.available]
+        endpoints = [e for e in usable if e.websocket.connected] or (usable or ranked)[:1]
+
+        results = await asyncio.gather(*(e.websocket.__aenter__() for e in endpoints), return_exceptions=True)
+        entered = []
+        for endpoint, result in zip(endpoints, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to connect to archive endpoint %s: %s", endpoint.url, result)
+                endpoint.record_failure()
+            else:
+                entered.append(endpoint)
+        # Contexts of concurrent tasks overlap, so each task exits the endpoints it entered itself.
+        self._entered.setdefault(asyncio.current_task(), []).append(entered)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        task = asyncio.current_task()
+        stack = self._entered.get(task)
+        entered = stack.pop() if stack else []
+        if not stack:
+            self._entered.pop(task, None)
+        await asyncio.gather(*(e.websocket.__aexit__(exc_type, exc_val, exc_tb) for e in entered))
+
+    async def connect(self, force=False):
+        results = await asyncio.gather(*(e.websocket.connect(force=force) for e in self.endpoints), return_exceptions=True)
+        for endpoint, result in zip(self.endpoints, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to connect to archive endpoint %s: %s", endpoint.url, result)
+                endpoint.record_failure()
+        if all(isinstance(r, Exception) for r in results):
+            raise results[0]
+
+    async def shutdown(self):
+        await asyncio.gather(*(e.websocket.shutdown() for e in self.endpoints))
+
+    @property
+    def last_received(self) -> float:
+        return max(e.websocket.last_received for e in self.endpoints)
+
+    @last_received.setter
+    def last_received(self, value: float):
+        for e in self.endpoints:
+            e.websocket.last_received = value
+
+    @property
+    def pending_requests(self) -> int:
+        return sum(e.websocket.pending_requests for e in self.endpoints)
+
+    def owns(self, item_id: str) -> bool:
+        return item_id in self._requests
+
+    def _ranked(self) -> list[ArchiveEndpoint]:
+        ranked = sorted(self.endpoints, key=lambda e: e.score())
+        available = [e for e in ranked if e.breaker.available]
+        # With every breaker open, keep trying the best endpoints rather than failing outright.
+        return available or ranked
+
+    def _hedge_delay(self, endpoint: ArchiveEndpoint) -> float:
+        p95 = endpoint.p95_latency()
+        if p95 is None:
+            return self.default_hedge_delay_seconds
+        return max(p95, self.min_hedge_delay_seconds)
+
+    async def _timed(self, endpoint: ArchiveEndpoint, call: Callable[[PatrolWebsocketPool], Awaitable[Any]]) -> Any:
+        start_time = time.monotonic()
+        try:
+            result = await call(endpoint.websocket)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            endpoint.record_failure()
+            raise
+        responses = result if isinstance(result, list) else [result]
+        if any(_is_rate_limited(r) for r in responses):
+            endpoint.record_failure()
+            raise RateLimitedError(f"Rate limited by {endpoint.url}")
+        endpoint.record_success(time.monotonic() - start_time)
+        return result
+
+    async def _route(self, call: Callable[[PatrolWebsocketPool], Awaitable[Any]]) -> Any:
+        remaining = self._ranked()
+        # With every breaker open, the ranked endpoints are tried regardless of their breakers.
+        forced = not any(e.breaker.available for e in remaining)
+        tasks: dict[asyncio.Task, ArchiveEndpoint] = {}
+        errors = []
+
+        def launch():
+            while remaining:
+                endpoint = remaining.pop(0)
+                # Only the endpoint actually used claims a half-open trial. One whose trial a concurrent
+                # request claimed in the meantime is skipped.
+                if endpoint.breaker.allow_request() or forced:
+                    tasks[asyncio.create_task(self._timed(endpoint, call))] = endpoint
+                    return
+
+        launch()
+        hedged = False
+        try:
+            while tasks:
+                timeout = None
+                if self.hedge_requests and not hedged and remaining:
+                    timeout = self._hedge_delay(next(iter(tasks.values())))
+
+                done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.debug("Hedging request to %s", remaining[0].url)
+                    hedged = True
+                    launch()
+                    continue
+
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    logger.debug("Request to %s failed: %s", endpoint.url, task.exception())
+                    errors.append(task.exception())
+
+                # Fail over once every in-flight attempt has failed
+                if not tasks and remaining:
+                    launch()
+
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def request(self, payload: dict, timeout: Optional[float] = None) -> dict:
+        return await self._route(lambda ws: ws.request(payload, timeout))
+
+    async def request_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[dict | Exception]:
+        async def call(ws):
+            responses = await ws.request_batch(payloads, timeout)
+            # Transport failures of any item in the batch count against the endpoint.
+            for response in responses:
+                if isinstance(response, Exception):
+                    raise response
+            return responses
+
+        return await self._route(call)
+
+    async def send(self, payload: dict, timeout: Optional[float] = None) -> str:
+        """
+        Starts a routed request, returning an id to collect its response with `retrieve`.
+        """
+        item_id = await get_next_id()
+        task = asyncio.create_task(self.request(payload, timeout))
+        self._requests[item_id] = task
+        # Cut the request short once its timeout has passed.
+        asyncio.get_running_loop().call_later(
+            timeout if timeout is not None else self._request_timeout_seconds,
+            self._expire,
+            item_id
+        )
+        return item_id
+
+    async def send_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[str]:
+        return [await self.send(payload, timeout) for payload in payloads]
+
+    def _expire(self, item_id: str):
+        # A request that already finished is kept until `retrieve` collects it.
+        task = self._requests.get(item_id)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def _discard(self, item_id: str):
+        task = self._requests.pop(item_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    async def retrieve(self, item_id: str) -> Optional[dict]:
+        task = self._requests.get(item_id)
+        if task is None:
+            await asyncio.sleep(0.001)
+            return None
+
+        if not task.done():
+            try:
+                await asyncio.wait((task,), timeout=1)
+            except asyncio.CancelledError:
+                self._discard(item_id)
+                raise
+            if not task.done():
+                return None
+
+        self._requests.pop(item_id, None)
+        if task.cancelled():
+            raise asyncio.TimeoutError(f"No response received for request {item_id}")
+        return task.result()
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from patrol_common.paths import prepare_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchParameters:
+    batch_size: int
+    timeout: float
+    # Exponentially weighted averages of what a single block's events cost to fetch
+    bytes_per_block: float = 0.0
+    seconds_per_block: float = 0.0
+
+
+class AdaptiveBatchController:
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            initial_batch_size: int = 25,
+            initial_timeout: float = 5,
+            min_batch_size: int = 1,
+            max_batch_size: int = 500,
+            min_timeout: float = 1,
+            max_timeout: float = 30,
+            target_batch_seconds: float = 2,
+            max_batch_bytes: int = 16 * 2**20,
+            additive_increase: int = 5,
+            multiplicative_decrease: float = 0.5,
+            timeout_margin: float = 3,
+            save_interval_seconds: float = 60,
+    ):
+        """
+        Sizes event batches per runtime version with additive-increase / multiplicative-decrease (AIMD).
+
+        Each successful batch that stays under `target_batch_seconds` and `max_batch_bytes` grows the batch
+        size by `additive_increase`; a failed or timed out batch multiplies it by `multiplicative_decrease`.
+        The timeout follows the batch size, as `timeout_margin` times the expected time for a batch of that
+        size, so larger batches of busy blocks are given longer to complete.
+
+        Learned parameters are saved as JSON to `path`, if given, and loaded again on startup.
+        """
+        self.path = os.path.expanduser(path) if path else None
+        self.initial_batch_size = initial_batch_size
+        self.initial_timeout = initial_timeout
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.target_batch_seconds = target_batch_seconds
+        self.max_batch_bytes = max_batch_bytes
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.timeout_margin = timeout_margin
+        self.save_interval_seconds = save_interval_seconds
+        self._parameters: dict[int, BatchParameters] = {}
+        self._last_saved = 0.0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+            self._parameters = {int(version): BatchParameters(**params) for version, params in saved.items()}
+            logger.info(f"Loaded batch parameters for {len(self._parameters)} runtime versions from {self.path}.")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable batch parameters in {self.path}: {e}")
+
+    def save(self, force: bool = False):
+        """
+        Writes the learned parameters to `path`, at most once every `save_interval_seconds` unless forced.
+        """
+        if self.path is None or not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_saved < self.save_interval_seconds:
+            return
+
+        prepare_path(self.path)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({str(version): asdict(params) for version, params in self._parameters.items()}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._last_saved = time.monotonic()
+        self._dirty = False
+
+    def parameters(self, runtime_version: int) -> BatchParameters:
+        if runtime_version not in self._parameters:
+            self._parameters[runtime_version] = BatchParameters(self.initial_batch_size, self.initial_timeout)
+        return self._parameters[runtime_version]
+
+    def batch_size(self, runtime_version: int) -> int:
+        return self.parameters(runtime_version).batch_size
+
+    def timeout(self, runtime_version: int) -> float:
+        return self.parameters(runtime_version).timeout
+
+    def _retime(self, params: BatchParameters):
+        if params.seconds_per_block > 0:
+            expected = params.seconds_per_block * params.batch_size * self.timeout_margin
+            params.timeout = min(self.max_timeout, max(self.min_timeout, expected))
+
+    def record_success(self, runtime_version: int, blocks: int, response_bytes: int, seconds: float):
+        if blocks <= 0:
+            return
+        params = self.parameters(runtime_version)
+
+        bytes_per_block = response_bytes / blocks
+        seconds_per_block = seconds / blocks
+        if params.seconds_per_block == 0:
+            params.bytes_per_block, params.seconds_per_block = bytes_per_block, seconds_per_block
+        else:
+            params.bytes_per_block = 0.8 * params.bytes_per_block + 0.2 * bytes_per_block
+            params.seconds_per_block = 0.8 * params.seconds_per_block + 0.2 * seconds_per_block
+
+        # Only grow from batches that filled the current size, as small batches say little about larger ones.
+        if blocks >= params.batch_size and seconds < self.target_batch_seconds and response_bytes < self.max_batch_bytes:
+            limit = self.max_batch_size
+            if params.bytes_per_block > 0:
+                limit = min(limit, max(self.min_batch_size, int(self.max_batch_bytes / params.bytes_per_block)))
+            params.batch_size = min(limit, params.batch_size + self.additive_increase)
+
+        self._retime(params)
+        self._dirty = True
+
+    def record_failure(self, runtime_version: int, timed_out: bool = False):
+        params = self.parameters(runtime_version)
+        params.batch_size = max(self.min_batch_size, int(params.batch_size * self.multiplicative_decrease))
+        if timed_out:
+            # The per-block estimate was too optimistic, so give the smaller batch more room as well.
+            params.seconds_per_block *= 1.5
+            params.timeout = min(self.max_timeout, params.timeout * 1.5)
+        self._dirty = True
+        logger.info(f"Reduced batch size for runtime version {runtime_version} to {params.batch_size} (timeout {params.timeout:.1f}s).")
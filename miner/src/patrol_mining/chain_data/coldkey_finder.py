@@ -1,31 +1,87 @@
 import logging
-from async_lru import alru_cache
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from patrol_mining.chain_data.owner_cache import OwnerCache
 
 logger = logging.getLogger(__name__)
 
 
 class ColdkeyFinder:
-    def __init__(self, substrate_client):
+    def __init__(self, substrate_client, maxsize: int = 10000, owner_cache: Optional[OwnerCache] = None):
+        """
+        Resolves the coldkey owning a hotkey, keeping the most recently used owners cached.
+
+        Args:
+            substrate_client: The SubstrateClient used to read SubtensorModule.Owner.
+            maxsize: Number of hotkey owners kept in the cache.
+            owner_cache: Optional persistent cache of owners, consulted first and kept filled with the owners
+                read from the chain.
+        """
         self.substrate_client = substrate_client
-        self._cached_lookup = self._create_cached_lookup()
-
-    def _create_cached_lookup(self):
-
-        @alru_cache(maxsize=10000)
-        async def lookup(hotkey: str) -> str:
-            logger.debug("Cache miss for hotkey: %s", hotkey)
-            result = await self.substrate_client.query(
-                "query",
-                None,
-                "SubtensorModule",
-                "Owner",
-                [hotkey]
-            )
-            return result
-        return lookup
+        self.maxsize = maxsize
+        self.owner_cache = owner_cache
+        self._owners: OrderedDict[str, str] = OrderedDict()
+
+    def _remember(self, hotkey: str, owner: str):
+        self._owners[hotkey] = owner
+        self._owners.move_to_end(hotkey)
+        while len(self._owners) > self.maxsize:
+            self._owners.popitem(last=False)
+
+    async def find_many(self, hotkeys: Iterable[str]) -> dict[str, str]:
+        """
+        Resolves the owners of many hotkeys, reading all cache misses with a single batched storage read.
+        Hotkeys whose owner could not be read are left out of the result.
+        """
+        hotkeys = list(dict.fromkeys(hotkeys))
+        owners = self.owner_cache.get_many(hotkeys) if self.owner_cache is not None else {}
+        misses = []
+        for hotkey in hotkeys:
+            if hotkey in owners:
+                continue
+            if hotkey in self._owners:
+                self._owners.move_to_end(hotkey)
+                owners[hotkey] = self._owners[hotkey]
+            else:
+                misses.append(hotkey)
+
+        if not misses:
+            return owners
+
+        logger.debug("Cache miss for %d hotkeys.", len(misses))
+        block_number, block_hash = None, None
+        if self.owner_cache is not None:
+            # Owners kept in the owner cache are read at the finalized head, to record the block they are of.
+            try:
+                block_number, block_hash = await self.substrate_client.get_finalized_head()
+            except Exception as e:
+                logger.warning(f"Unable to read the finalized head, reading {len(misses)} hotkey owners at the chain head: {e}")
+        results = await self.substrate_client.query_batch(
+            "SubtensorModule",
+            "Owner",
+            [[hotkey] for hotkey in misses],
+            [block_hash] * len(misses)
+        )
+        resolved = {}
+        for hotkey, result in zip(misses, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Unable to resolve owner of hotkey {hotkey}: {result}")
+                continue
+            self._remember(hotkey, result)
+            resolved[hotkey] = result
+
+        if block_number is not None and resolved:
+            self.owner_cache.put_many(resolved, block_number)
+
+        owners.update(resolved)
+        return owners
 
     async def find(self, hotkey: str) -> str:
-        return await self._cached_lookup(hotkey)
+        owners = await self.find_many([hotkey])
+        if hotkey not in owners:
+            raise Exception(f"Unable to resolve owner of hotkey {hotkey}")
+        return owners[hotkey]
     
 if __name__ == "__main__":
     import asyncio
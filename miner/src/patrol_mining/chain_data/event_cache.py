@@ -0,0 +1,199 @@
+import logging
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+import msgpack
+
+from patrol_common.paths import prepare_path
+
+logger = logging.getLogger(__name__)
+
+# Decoded events distinguish tuples from lists (e.g. account ids are tuples of byte tuples), so
+# tuples are packed as an extension type to round-trip unchanged.
+_TUPLE_EXT = 1
+
+
+def _default(obj):
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(_TUPLE_EXT, _pack(list(obj)))
+    raise TypeError(f"Cannot serialize {type(obj)}")
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == _TUPLE_EXT:
+        return tuple(_unpack(data))
+    return msgpack.ExtType(code, data)
+
+
+def _pack(obj) -> bytes:
+    return msgpack.packb(obj, default=_default, strict_types=True, use_bin_type=True)
+
+
+def _unpack(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def encode_events(events: Any) -> bytes:
+    return zlib.compress(_pack(events), 6)
+
+
+def decode_events(data: bytes) -> Any:
+    return _unpack(zlib.decompress(data))
+
+
+class EventCache:
+    def __init__(self, path: Optional[str] = None, memory_entries: int = 2048, max_disk_bytes: int = 2**30):
+        """
+        A cache of decoded block events keyed by block hash. A block hash always identifies the same events,
+        so entries never need invalidating.
+
+        Recently used blocks are kept in an in-memory LRU, in front of an sqlite store of msgpack + zlib
+        encoded events. Once the store exceeds `max_disk_bytes`, the least recently used blocks are evicted.
+
+        Args:
+            path: Location of the sqlite store, or None for a memory only cache.
+            memory_entries: Number of blocks kept in memory.
+            max_disk_bytes: Size of the encoded events kept on disk before eviction.
+        """
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, Any] = OrderedDict()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        self._disk_bytes = 0
+        if path is not None:
+            path = prepare_path(path)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS block_events ("
+                "block_hash TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS block_events_accessed ON block_events (accessed)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM block_events").fetchone()[0]
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @property
+    def disk_bytes(self) -> int:
+        return self._disk_bytes
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _remember(self, block_hash: str, events: Any):
+        self._memory[block_hash] = events
+        self._memory.move_to_end(block_hash)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, block_hashes: Iterable[str]) -> dict[str, Any]:
+        """
+        Returns the cached events of each of `block_hashes` found in the cache, leaving out the others.
+        """
+        found = {}
+        on_disk = []
+        for block_hash in block_hashes:
+            if block_hash in self._memory:
+                self._memory.move_to_end(block_hash)
+                found[block_hash] = self._memory[block_hash]
+                self.memory_hits += 1
+            else:
+                on_disk.append(block_hash)
+
+        if on_disk and self._db is not None:
+            placeholders = ",".join("?" * len(on_disk))
+            rows = self._db.execute(
+                f"SELECT block_hash, data FROM block_events WHERE block_hash IN ({placeholders})", on_disk
+            ).fetchall()
+            for block_hash, data in rows:
+                try:
+                    events = decode_events(data)
+                except Exception as e:
+                    logger.warning(f"Discarding unreadable cached events for block {block_hash}: {e}")
+                    continue
+                found[block_hash] = events
+                self._remember(block_hash, events)
+                self.disk_hits += 1
+            if rows:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE block_events SET accessed = ? WHERE block_hash = ?",
+                    [(now, block_hash) for block_hash, _ in rows]
+                )
+                self._db.commit()
+
+        self.misses += sum(1 for block_hash in on_disk if block_hash not in found)
+        return found
+
+    def get(self, block_hash: str) -> Optional[Any]:
+        return self.get_many([block_hash]).get(block_hash)
+
+    def put_many(self, events_by_hash: dict[str, Any]):
+        rows = []
+        now = time.time()
+        for block_hash, events in events_by_hash.items():
+            self._remember(block_hash, events)
+            if self._db is None:
+                continue
+            try:
+                data = encode_events(events)
+            except Exception as e:
+                logger.debug(f"Not caching events for block {block_hash} on disk: {e}")
+                continue
+            rows.append((block_hash, data, len(data), now))
+
+        if not rows:
+            return
+
+        existing = self._db.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM block_events WHERE block_hash IN ({','.join('?' * len(rows))})",
+            [row[0] for row in rows]
+        ).fetchone()[0]
+        self._db.executemany("INSERT OR REPLACE INTO block_events VALUES (?, ?, ?, ?)", rows)
+        self._disk_bytes += sum(row[2] for row in rows) - existing
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict()
+        self._db.commit()
+
+    def put(self, block_hash: str, events: Any):
+        self.put_many({block_hash: events})
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so eviction does not run on every insert once full.
+        target = self.max_disk_bytes * 0.9
+        while self._disk_bytes > target:
+            rows = self._db.execute(
+                "SELECT block_hash, size FROM block_events ORDER BY accessed LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            evicted = []
+            for block_hash, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                evicted.append(block_hash)
+                self._disk_bytes -= size
+            self._db.executemany("DELETE FROM block_events WHERE block_hash = ?", [(h,) for h in evicted])
+        logger.debug(f"Evicted cached events down to {self._disk_bytes} bytes.")
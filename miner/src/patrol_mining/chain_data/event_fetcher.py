@@ -3,15 +3,28 @@ import logging
 import time
 from typing import Dict, Iterable, List, Tuple, Any
 
-from async_substrate_interface import AsyncSubstrateInterface
-from patrol_mining.chain_data.runtime_groupings import group_blocks
+from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+from patrol_mining.chain_data.event_cache import EventCache
 
 logger = logging.getLogger(__name__)
 
+
+class BlockEventsError(Exception):
+    def __init__(self, events: Dict[int, Any], errors: Dict[int, Exception]):
+        """
+        Raised when the events of some blocks in a batch could not be fetched, carrying the events of
+        the blocks that were, so only the failed blocks need fetching again.
+        """
+        super().__init__(f"Fetching events failed for blocks {list(errors.keys())}: {list(errors.values())}")
+        self.events = events
+        self.errors = errors
+
+
 class EventFetcher:
-    def __init__(self, substrate_client):
+    def __init__(self, substrate_client, event_cache: EventCache = None, batch_controller: AdaptiveBatchController = None):
         self.substrate_client = substrate_client
-        self.hash_semaphore = asyncio.Semaphore(20)
+        self.event_cache = event_cache
+        self.batch_controller = batch_controller
         self.event_semaphore = asyncio.Semaphore(1)
   
     async def get_current_block(self) -> int:
@@ -22,57 +35,128 @@ class EventFetcher:
         self,
         runtime_version: int,
         block_info: List[Tuple[int, str]],
-        max_concurrent: int = 10
+        record: bool = True
     ) -> Dict[int, Any]:
         """
-        Fetch events for a batch of blocks for a specific runtime_version using the substrate client's query method.
+        Fetch events for a batch of blocks for a specific runtime_version, serving blocks from the event cache
+        when possible and fetching the rest as a single JSON-RPC batch request. Raises BlockEventsError when
+        only some of the blocks failed.
+
+        `record` reports the request to the batch controller, which retries of parts of a batch leave out,
+        as their size and outcome say nothing about the batch size the controller chose.
         """
-        block_hashes = [block_hash for (_, block_hash) in block_info]
-        semaphore = asyncio.Semaphore(max_concurrent)
-
-        async def preprocess_with_semaphore(block_hash):
-            async with semaphore:
-                # Use the query method to call the substrate's _preprocess method.
-                return await self.substrate_client.query(
-                    "_preprocess",
-                    runtime_version,
-                    None,
-                    block_hash,
-                    module="System",
-                    storage_function="Events"
+        cached = self.event_cache.get_many(block_hash for (_, block_hash) in block_info) if self.event_cache else {}
+        to_fetch = [(block_number, block_hash) for (block_number, block_hash) in block_info if block_hash not in cached]
+
+        responses = []
+        if to_fetch:
+            # A runtime version used for the first time is initialized (reading its metadata) before the
+            # timed request, so only the request itself counts against the timeout.
+            await self.substrate_client.get_substrate(runtime_version)
+            response_sizes = []
+            start_time = time.monotonic()
+            try:
+                responses = await asyncio.wait_for(
+                    self.substrate_client.query_batch(
+                        "System",
+                        "Events",
+                        [None] * len(to_fetch),
+                        [block_hash for (_, block_hash) in to_fetch],
+                        runtime_version,
+                        response_sizes=response_sizes
+                    ),
+                    timeout=self._batch_timeout(runtime_version, 5)
                 )
+            except Exception as e:
+                if self.batch_controller is not None and record:
+                    self.batch_controller.record_failure(runtime_version, timed_out=isinstance(e, asyncio.TimeoutError))
+                raise
+            if self.batch_controller is not None and record:
+                self.batch_controller.record_success(runtime_version, len(to_fetch), sum(response_sizes), time.monotonic() - start_time)
+
+        errors = {
+            block_number: response
+            for (block_number, _), response in zip(to_fetch, responses)
+            if isinstance(response, Exception)
+        }
 
-        tasks = [preprocess_with_semaphore(h) for h in block_hashes]
-        preprocessed_lst = await asyncio.gather(*tasks)
-        errors = [r for r in preprocessed_lst if isinstance(r, Exception)]
+        fetched = {
+            block_hash: response
+            for (block_number, block_hash), response in zip(to_fetch, responses)
+            if block_number not in errors
+        }
+        if self.event_cache is not None and fetched:
+            # Blocks past the known runtime ranges are decoded with the latest known runtime, which an
+            # undiscovered upgrade would make wrong, so only blocks within known ranges are cached.
+            highest_known = self.substrate_client.runtime_index.highest_max
+            self.event_cache.put_many({
+                block_hash: fetched[block_hash]
+                for (block_number, block_hash) in to_fetch
+                if block_hash in fetched and block_number <= highest_known
+            })
+
+        events = {
+            block_number: cached[block_hash] if block_hash in cached else fetched[block_hash]
+            for (block_number, block_hash) in block_info
+            if block_number not in errors
+        }
         if errors:
-            raise Exception(f"Preprocessing failed: {errors}")
-
-        payloads = [
-            AsyncSubstrateInterface.make_payload(
-                str(block_hash),
-                preprocessed.method,
-                [preprocessed.params[0], block_hash]
-            )
-            for block_hash, preprocessed in zip(block_hashes, preprocessed_lst)
-        ]
-
-        responses = await asyncio.wait_for(
-            self.substrate_client.query(
-                "_make_rpc_request",
-                runtime_version,
-                payloads,
-                preprocessed_lst[0].value_scale_type,
-                preprocessed_lst[0].storage_item
-            ),
-            timeout=5
+            raise BlockEventsError(events, errors)
+        return events
+
+    def _batch_timeout(self, runtime_version: int, default: float) -> float:
+        if self.batch_controller is None:
+            return default
+        return self.batch_controller.timeout(runtime_version)
+
+    def _group_blocks(self, block_hashes: Dict[int, str], current_block: int, batch_size: int):
+        batch_size_for = self.batch_controller.batch_size if self.batch_controller is not None else None
+        return self.substrate_client.runtime_index.group_blocks(block_hashes, current_block, batch_size, batch_size_for=batch_size_for)
+
+    async def _fetch_bisecting(
+        self,
+        runtime_version: int,
+        batch: List[Tuple[int, str]],
+        timeout: float = None,
+        retries: int = 2,
+        record: bool = True
+    ) -> Tuple[Dict[int, Any], List[int]]:
+        """
+        Fetches events for a batch, keeping the blocks that were fetched and retrying only those that failed.
+        A batch that failed as a whole is split in half and both halves are retried concurrently, down to
+        single blocks, which are retried up to `retries` times. Only the first attempt at the batch is
+        reported to the batch controller.
+
+        Returns:
+            The events of each block that could be fetched, and the block numbers that could not.
+        """
+        events = {}
+        try:
+            return await asyncio.wait_for(self.get_block_events(runtime_version, batch, record), timeout=timeout), []
+        except BlockEventsError as e:
+            events = e.events
+            batch = [(block_number, block_hash) for (block_number, block_hash) in batch if block_number in e.errors]
+            error = e
+        except Exception as e:
+            error = e
+
+        if len(batch) == 1:
+            block_number = batch[0][0]
+            if retries > 0:
+                logger.debug(f"Retrying block {block_number} after error: {error!r}")
+                retried, failed = await self._fetch_bisecting(runtime_version, batch, timeout, retries - 1, record=False)
+                return {**events, **retried}, failed
+            logger.warning(f"Unable to fetch events for block {block_number}: {error!r}")
+            return events, [block_number]
+
+        logger.debug(f"Splitting failed batch of {len(batch)} blocks for runtime version {runtime_version}: {error!r}")
+        middle = len(batch) // 2
+        (left, left_failed), (right, right_failed) = await asyncio.gather(
+            self._fetch_bisecting(runtime_version, batch[:middle], timeout, retries, record=False),
+            self._fetch_bisecting(runtime_version, batch[middle:], timeout, retries, record=False),
         )
+        return {**events, **left, **right}, left_failed + right_failed
 
-        return {
-            block_number: responses[block_hash][0]
-            for (block_number, block_hash) in block_info
-        }
-    
     async def fetch_all_events(self, block_numbers: List[int], batch_size: int = 25) -> Dict[int, Any]:
         """
         Retrieve events for all given block numbers.
@@ -92,32 +176,30 @@ class EventFetcher:
         async with self.event_semaphore:
             logger.info(f"Attempting to fetch event data for {len(block_numbers)} blocks...")
 
-            block_hash_tasks = [
-                self._get_block_hash(n)
-                for n in block_numbers
-            ]
-            block_hashes = {k: v for k, v in await asyncio.gather(*block_hash_tasks)}
+            block_hashes = await self._get_block_hashes(block_numbers)
 
             current_block = await self.get_current_block()
 
-            versions = self.substrate_client.return_runtime_versions()
-            grouped = group_blocks(block_hashes, current_block, versions, batch_size)
+            grouped = self._group_blocks(block_hashes, current_block, batch_size)
 
             all_events: Dict[int, Any] = {}
             for runtime_version, batches in grouped.items():
                 for batch in batches:
                     logger.info(f"Fetching events for runtime version {runtime_version} (batch of {len(batch)} blocks)...")
-                    try:
-                        events = await self.get_block_events(runtime_version, batch)
-                        logger.info(f"Successfully fetched events for runtime version {runtime_version}. Updating...")
-                        all_events.update(events)
-                        logger.info(f"Updated events for runtime version {runtime_version}.")
-                    except Exception as e:
+                    events, failed = await self._fetch_bisecting(runtime_version, batch)
+                    all_events.update(events)
+                    if failed:
                         logger.warning(
-                            f"Unable to fetch events for runtime version {runtime_version} batch on final attempt: {e}. Continuing..."
+                            f"Unable to fetch events for blocks {failed} of runtime version {runtime_version} on final attempt. Continuing..."
                         )
+                    else:
+                        logger.info(f"Successfully fetched events for runtime version {runtime_version}.")
         # Continue to next version even if the current one fails.
         logger.info(f"All events collected in {time.time() - start_time} seconds.")
+        if self.batch_controller is not None:
+            self.batch_controller.save()
+        if self.event_cache is not None:
+            logger.info(f"Event cache stats: {self.event_cache.stats}")
         return all_events
 
     async def stream_all_events(
@@ -126,9 +208,11 @@ class EventFetcher:
         queue: asyncio.Queue,
         missed_blocks: List[int] = None,
         batch_size: int = 25,
+        target_block: int = None,
     ) -> None:
         """
         Streams events into a queue. Each batch of events is put into the queue as it's fetched.
+        With `target_block`, the batches nearest to it are fetched first.
         """
         if not block_numbers:
             logger.warning("No block numbers provided. Nothing to yield.")
@@ -143,64 +227,64 @@ class EventFetcher:
         block_numbers = set(block_numbers)
         logger.info(f"Attempting to stream event data for {len(block_numbers)} blocks...")
 
-        async def safe_get_block_hash(n: int) -> tuple[int, str] | None:
-            try:
-                async with self.hash_semaphore:
-                    return await self._get_block_hash(n)
-            except Exception as e:
-                logger.warning(f"Failed to retrieve block hash for block {n}: {e}")
-                # Track block hash retrieval failures
-                if missed_blocks is not None:
-                    missed_blocks.append(n)
-                return None
-
-        tasks = [safe_get_block_hash(n) for n in block_numbers]
-        block_hashes = {it[0]: it[1] for it in await asyncio.gather(*tasks) if it is not None}
+        try:
+            block_hashes = await self._get_block_hashes(block_numbers, missed_blocks)
+        except Exception as e:
+            logger.warning(f"Failed to retrieve block hashes: {e}")
+            # Track block hash retrieval failures
+            if missed_blocks is not None:
+                missed_blocks.extend(block_numbers)
+            await queue.put(None)
+            return
 
         current_block = await self.get_current_block()
-        versions = self.substrate_client.return_runtime_versions()
-        grouped = group_blocks(block_hashes, current_block, versions, batch_size)
+        grouped = self._group_blocks(block_hashes, current_block, batch_size)
 
-        async def fetch_and_return_events(runtime_version, batch, timeout=2):
+        async def fetch_and_return_events(runtime_version, batch):
             async with self.event_semaphore:
-                try:
-                    logger.debug(f"Fetching events for runtime version {runtime_version} (batch of {len(batch)} blocks)...")
-                    events = await asyncio.wait_for(
-                        self.get_block_events(runtime_version, batch),
-                        timeout=timeout
-                    )
-                    logger.debug(f"Yielding {len(events)} events from batch.")
-                    if events is not None:
-                        await queue.put(events)
-                except asyncio.TimeoutError:
-                    logger.warning(f"Timeout while fetching events for runtime version {runtime_version}, batch of size {len(batch)}")
-                    blocks_in_batch =  [block_number for (block_number, block_hash) in batch]
-                    logger.warning(f"Blocks in batch: {blocks_in_batch}")
-
-                     # Track timeout failures
-                    if missed_blocks is not None:
-                        missed_blocks.extend(blocks_in_batch)
-                except Exception as e:
-                    logger.warning(f"Skipping failed batch due to error: {e}")
-                    blocks_in_batch = [block_number for (block_number, block_hash) in batch]
-                    logger.warning(f"Blocks in batch: {blocks_in_batch}")
-
-                    # Track other failures
-                    if missed_blocks is not None:
-                        missed_blocks.extend(blocks_in_batch)
-
-        # Launch all batch tasks
-        tasks = [
-            fetch_and_return_events(runtime_version, batch)
-            for runtime_version, batches in grouped.items()
-            for batch in batches
-        ]
+                logger.debug(f"Fetching events for runtime version {runtime_version} (batch of {len(batch)} blocks)...")
+                # With a batch controller, get_block_events applies (and learns from) the timeout itself.
+                events, failed = await self._fetch_bisecting(
+                    runtime_version,
+                    batch,
+                    timeout=None if self.batch_controller is not None else 2
+                )
+            if failed:
+                logger.warning(f"Failed to fetch events for blocks {failed} of runtime version {runtime_version}")
+                # Track blocks that still failed after splitting and retrying
+                if missed_blocks is not None:
+                    missed_blocks.extend(failed)
+            # Put outside the semaphore, so a full queue waiting on a slow consumer does not hold up
+            # the event fetches of other requests.
+            if events:
+                logger.debug(f"Yielding {len(events)} events from batch.")
+                await queue.put(events)
+
+        batches = [(runtime_version, batch) for runtime_version, version_batches in grouped.items() for batch in version_batches]
+        if target_block is not None:
+            batches.sort(key=lambda item: min(abs(block_number - target_block) for block_number, _ in item[1]))
+
+        # Launch all batch tasks, which take their turn at the semaphore in this order
+        tasks = [fetch_and_return_events(runtime_version, batch) for runtime_version, batch in batches]
         await asyncio.gather(*tasks)
 
+        if self.batch_controller is not None:
+            self.batch_controller.save()
         await queue.put(None)
 
-    async def _get_block_hash(self, block_number: int) -> tuple[int, str]:
-        return block_number, await self.substrate_client.query("get_block_hash", None, block_number)
+    async def _get_block_hashes(self, block_numbers: Iterable[int], missed_blocks: List[int] = None) -> Dict[int, str]:
+        """
+        Looks up block hashes with batched RPC calls, leaving out (and tracking) blocks whose lookup failed.
+        """
+        block_hashes = {}
+        for block_number, block_hash in (await self.substrate_client.get_block_hashes(block_numbers)).items():
+            if isinstance(block_hash, Exception):
+                logger.warning(f"Failed to retrieve block hash for block {block_number}: {block_hash}")
+                if missed_blocks is not None:
+                    missed_blocks.append(block_number)
+            else:
+                block_hashes[block_number] = block_hash
+        return block_hashes
 
 
 async def example():
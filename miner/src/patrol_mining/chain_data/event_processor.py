@@ -1,6 +1,11 @@
+import atexit
 import logging
+import multiprocessing
+import multiprocessing.util
+import sys
 import time
-from typing import List, Dict, Tuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Optional, Set, Tuple
 import asyncio
 
 from bittensor.core.chain_data.utils import decode_account_id
@@ -8,14 +13,41 @@ from patrol_mining.chain_data.coldkey_finder import ColdkeyFinder
 
 logger = logging.getLogger(__name__)
 
+# (coldkey_source, coldkey_destination, coldkey_owner, category, type, evidence items), the compact form
+# in which events parsed by worker processes are sent back.
+EdgeTuple = Tuple[Optional[str], Optional[str], Optional[str], str, str, tuple]
+
+# The fields of each type of staking event that hold the owner of a delegate hotkey, with the evidence
+# key of that hotkey.
+_OWNER_FIELDS = {
+    "add": (("coldkey_destination", "delegate_hotkey_destination"),),
+    "remove": (("coldkey_source", "delegate_hotkey_source"),),
+    "move": (("coldkey_source", "delegate_hotkey_source"), ("coldkey_destination", "delegate_hotkey_destination")),
+}
+
+class _UnresolvedOwners(dict):
+    """
+    Stands in for the resolved owners when parsing in a worker: each delegate hotkey is recorded as its own
+    owner until the results are merged and the real owners are filled in.
+    """
+    def __missing__(self, hotkey: str) -> str:
+        self[hotkey] = hotkey
+        return hotkey
+
 class EventProcessor:
-    def __init__(self, coldkey_finder: ColdkeyFinder):
+    def __init__(self, coldkey_finder: ColdkeyFinder, workers: int = 0, min_parallel_blocks: int = 200):
         """
         Args:
             coldkey_finder: An instance of ColdkeyFinder to resolve coldkey owners.
+            workers: Number of worker processes parsing events, off the event loop, for windows of at least
+                `min_parallel_blocks` blocks. Worker threads are used instead on free-threaded builds.
+                With 0, events are parsed on the event loop.
+            min_parallel_blocks: Smallest number of blocks worth sending to the workers.
         """
         self.coldkey_finder = coldkey_finder
-        self.semaphore = asyncio.Semaphore(25)
+        self.workers = workers
+        self.min_parallel_blocks = min_parallel_blocks
+        self._executor: Optional[Executor] = None
 
     @staticmethod
     def format_address(addr: List) -> str:
@@ -65,9 +97,33 @@ class EventProcessor:
                         })
         return formatted
 
-    async def process_staking_events(self, event: Dict, block_number: int) -> Tuple[List[Dict], List[Dict]]:
+    def collect_delegate_hotkeys(self, event: Dict, hotkeys: Set[str]) -> None:
+        """
+        Adds the delegate hotkeys of the staking events in a block event to `hotkeys`, so their owners can be
+        resolved together before the events are processed.
+        """
+        if "event" not in event:
+            return
+
+        for module, event_list in event["event"].items():
+            if module != "SubtensorModule":
+                continue
+            for item in event_list:
+                for event_type, details in item.items():
+                    if event_type in ("StakeAdded", "StakeRemoved"):
+                        if len(details) == 2:
+                            hotkeys.add(self.format_address(details[0]))
+                        elif len(details) >= 5:
+                            hotkeys.add(self.format_address(details[1]))
+                    elif event_type == "StakeMoved" and len(details) == 6:
+                        hotkeys.add(self.format_address(details[1]))
+                        hotkeys.add(self.format_address(details[3]))
+
+    def process_staking_events(self, event: Dict, block_number: int, owners: Dict[str, str]) -> Tuple[List[Dict], List[Dict]]:
         """
-        Process staking events from a block event. Returns two formats:
+        Process staking events from a block event, looking up delegate hotkey owners in `owners`. Events with
+        an owner missing from `owners` are skipped.
+        Returns two formats:
           - new_format: Detailed staking events.
           - old_format: Events in an older format.
         """
@@ -81,108 +137,128 @@ class EventProcessor:
                 continue
             for item in event_list:
                 for event_type, details in item.items():
-                    if event_type == "StakeAdded":
-                        if len(details) == 2:
-                            delegate_hotkey = self.format_address(details[0])
-                            old_format.append({
-                                "coldkey_source": None,
-                                "coldkey_destination": await self.coldkey_finder.find(delegate_hotkey),
-                                "category": "staking",
-                                "type": "add",
-                                "evidence": {
-                                    "rao_amount": details[1],
-                                    "delegate_hotkey_destination": delegate_hotkey,
-                                    "block_number": block_number
-                                }
-                            })
-                        elif len(details) >= 5:
-                            delegate_hotkey = self.format_address(details[1])
+                    try:
+                        if event_type == "StakeAdded":
+                            if len(details) == 2:
+                                delegate_hotkey = self.format_address(details[0])
+                                old_format.append({
+                                    "coldkey_source": None,
+                                    "coldkey_destination": owners[delegate_hotkey],
+                                    "category": "staking",
+                                    "type": "add",
+                                    "evidence": {
+                                        "rao_amount": details[1],
+                                        "delegate_hotkey_destination": delegate_hotkey,
+                                        "block_number": block_number
+                                    }
+                                })
+                            elif len(details) >= 5:
+                                delegate_hotkey = self.format_address(details[1])
+                                new_format.append({
+                                    "coldkey_source": self.format_address(details[0]),
+                                    "coldkey_destination": owners[delegate_hotkey],
+                                    "category": "staking",
+                                    "type": "add",
+                                    "evidence": {
+                                        "rao_amount": details[2],
+                                        "delegate_hotkey_destination": delegate_hotkey,
+                                        "alpha_amount": details[3],
+                                        "destination_net_uid": details[4],
+                                        "block_number": block_number
+                                    }
+                                })
+                        elif event_type == "StakeRemoved":
+                            if len(details) == 2:
+                                delegate_hotkey = self.format_address(details[0])
+                                old_format.append({
+                                    "coldkey_destination": None,
+                                    "coldkey_source": owners[delegate_hotkey],
+                                    "category": "staking",
+                                    "type": "remove",
+                                    "evidence": {
+                                        "rao_amount": details[1],
+                                        "delegate_hotkey_source": delegate_hotkey,
+                                        "block_number": block_number
+                                    }
+                                })
+                            elif len(details) >= 5:
+                                delegate_hotkey = self.format_address(details[1])
+                                new_format.append({
+                                    "coldkey_destination": self.format_address(details[0]),
+                                    "coldkey_source": owners[delegate_hotkey],
+                                    "category": "staking",
+                                    "type": "remove",
+                                    "evidence": {
+                                        "rao_amount": details[2],
+                                        "delegate_hotkey_source": delegate_hotkey,
+                                        "alpha_amount": details[3],
+                                        "source_net_uid": details[4],
+                                        "block_number": block_number
+                                    }
+                                })
+                        elif event_type == "StakeMoved" and len(details) == 6:
+                            source_delegate_hotkey = self.format_address(details[1])
+                            destination_delegate_hotkey = self.format_address(details[3])
                             new_format.append({
-                                "coldkey_source": self.format_address(details[0]),
-                                "coldkey_destination": await self.coldkey_finder.find(delegate_hotkey),
+                                "coldkey_owner": self.format_address(details[0]),
+                                "coldkey_source": owners[source_delegate_hotkey],
+                                "coldkey_destination": owners[destination_delegate_hotkey],
                                 "category": "staking",
-                                "type": "add",
+                                "type": "move",
                                 "evidence": {
-                                    "rao_amount": details[2],
-                                    "delegate_hotkey_destination": delegate_hotkey,
-                                    "alpha_amount": details[3],
+                                    "rao_amount": details[5],
+                                    "delegate_hotkey_source": source_delegate_hotkey,
+                                    "delegate_hotkey_destination": destination_delegate_hotkey,
+                                    "source_net_uid": details[2],
                                     "destination_net_uid": details[4],
                                     "block_number": block_number
                                 }
                             })
-                    elif event_type == "StakeRemoved":
-                        if len(details) == 2:
-                            delegate_hotkey = self.format_address(details[0])
-                            old_format.append({
-                                "coldkey_destination": None,
-                                "coldkey_source": await self.coldkey_finder.find(delegate_hotkey),
-                                "category": "staking",
-                                "type": "remove",
-                                "evidence": {
-                                    "rao_amount": details[1],
-                                    "delegate_hotkey_source": delegate_hotkey,
-                                    "block_number": block_number
-                                }
-                            })
-                        elif len(details) >= 5:
-                            delegate_hotkey = self.format_address(details[1])
-                            new_format.append({
-                                "coldkey_destination": self.format_address(details[0]),
-                                "coldkey_source": await self.coldkey_finder.find(delegate_hotkey),
-                                "category": "staking",
-                                "type": "remove",
-                                "evidence": {
-                                    "rao_amount": details[2],
-                                    "delegate_hotkey_source": delegate_hotkey,
-                                    "alpha_amount": details[3],
-                                    "source_net_uid": details[4],
-                                    "block_number": block_number
-                                }
-                            })
-                    elif event_type == "StakeMoved" and len(details) == 6:
-                        source_delegate_hotkey = self.format_address(details[1])
-                        destination_delegate_hotkey = self.format_address(details[3])
-                        new_format.append({
-                            "coldkey_owner": self.format_address(details[0]),
-                            "coldkey_source": await self.coldkey_finder.find(source_delegate_hotkey),
-                            "coldkey_destination": await self.coldkey_finder.find(destination_delegate_hotkey),
-                            "category": "staking",
-                            "type": "move",
-                            "evidence": {
-                                "rao_amount": details[5],
-                                "delegate_hotkey_source": source_delegate_hotkey,
-                                "delegate_hotkey_destination": destination_delegate_hotkey,
-                                "source_net_uid": details[2],
-                                "destination_net_uid": details[4],
-                                "block_number": block_number
-                            }
-                        })
+                    except KeyError as e:
+                        # The owner of a delegate hotkey is unresolved: skip only this event, as edge_from_tuple
+                        # does for events parsed in the workers.
+                        logger.debug(f"Skipping {event_type} event in block {block_number} with unresolved owner of {e}")
         return new_format, old_format
 
+    @staticmethod
+    def index_operations(operations: List[Dict]) -> Dict[int, List[Dict]]:
+        """
+        Groups withdrawal or deposit operations by their rao amount.
+        """
+        by_amount = {}
+        for operation in operations:
+            by_amount.setdefault(operation["rao_amount"], []).append(operation)
+        return by_amount
+
     @staticmethod
     def match_old_stake_events(old_stake_events: List[Dict], chain_operations: Dict) -> List[Dict]:
         """
-        Matches old-format staking events with corresponding balance events.
+        Matches old-format staking events with corresponding balance events: an event is matched when
+        exactly one withdrawal (for adds) or deposit (for removes) in the block has the same rao amount.
         """
         matched = []
+        if not old_stake_events:
+            return matched
+
+        withdrawals = EventProcessor.index_operations(chain_operations["withdrawal"])
+        deposits = EventProcessor.index_operations(chain_operations["deposit"])
         for entry in old_stake_events:
             if entry["type"] == "add":
-                matches = [x for x in chain_operations["withdrawal"] 
-                           if x["rao_amount"] == entry["evidence"]["rao_amount"]]
+                matches = withdrawals.get(entry["evidence"]["rao_amount"], ())
                 if len(matches) == 1:
                     entry["coldkey_source"] = matches[0]["coldkey_source"]
                     matched.append(entry)
             elif entry["type"] == "remove":
-                matches = [x for x in chain_operations["deposit"] 
-                           if x["rao_amount"] == entry["evidence"]["rao_amount"]]
+                matches = deposits.get(entry["evidence"]["rao_amount"], ())
                 if len(matches) == 1:
                     entry["coldkey_destination"] = matches[0]["coldkey_destination"]
                     matched.append(entry)
         return matched
 
-    async def parse_events(self, events: List[Dict], block_number: int, semaphore: asyncio.Semaphore) -> List[Dict]:
+    def parse_events(self, events: List[Dict], block_number: int, owners: Dict[str, str], failed_blocks: Optional[List[int]] = None) -> List[Dict]:
         """
-        Parses events for a given block.
+        Parses events for a given block, with the owners of its delegate hotkeys already resolved. The block is
+        added to `failed_blocks`, when given, if any of its events could not be parsed.
         """
         formatted = []
         old_stake_format = []
@@ -192,24 +268,30 @@ class EventProcessor:
             try:
                 # Process balance events and update chain operations.
                 formatted.extend(self.process_balance_events(event, block_number, chain_operations))
-                async with semaphore:
-                    new_stake, old_stake = await self.process_staking_events(event, block_number)
+                new_stake, old_stake = self.process_staking_events(event, block_number, owners)
                 formatted.extend(new_stake)
                 old_stake_format.extend(old_stake)
             except Exception as e:
                 logger.exception(f"Error processing event in block {block_number}: {e}")
+                if failed_blocks is not None:
+                    failed_blocks.append(block_number)
                 continue
 
         try:
             formatted.extend(self.match_old_stake_events(old_stake_format, chain_operations))
         except Exception as e:
             logger.error(f"Error matching old stake events in block {block_number}: {e}")
+            if failed_blocks is not None:
+                failed_blocks.append(block_number)
 
         return formatted
 
-    async def process_event_data(self, event_data: dict) -> List[Dict]:
+    async def process_event_data(self, event_data: dict, failed_blocks: Optional[List[int]] = None) -> List[Dict]:
         """
         Processes event data across multiple blocks.
+
+        Blocks whose events were not all processed, because an event could not be parsed or the owner of a
+        delegate hotkey could not be resolved, are added to `failed_blocks` when given.
         """
         if not isinstance(event_data, dict):
             logger.error(f"Expected event_data to be a dict, got: {type(event_data)}")
@@ -221,7 +303,7 @@ class EventProcessor:
         logger.debug(f"Parsing event data from {len(event_data)} blocks.")
         start_time = time.time()
 
-        tasks = []
+        blocks = []
         for block_key, block_events in event_data.items():
             try:
                 bn = int(block_key)
@@ -233,19 +315,168 @@ class EventProcessor:
                 logger.error(f"Block {bn} events are not in a tuple or list. Skipping...")
                 continue
 
-            tasks.append(self.parse_events(block_events, bn, self.semaphore))
+            blocks.append((bn, block_events))
+
+        if self.workers > 0 and len(blocks) >= self.min_parallel_blocks:
+            all_parsed_events = await self._process_in_workers(blocks, failed_blocks)
+        else:
+            all_parsed_events = await self._process(blocks, failed_blocks)
+
+        logger.debug(f"Returning {len(all_parsed_events)} parsed events in {round(time.time() - start_time, 4)} seconds.")
+        return all_parsed_events
+
+    async def _process(self, blocks: List[Tuple[int, List[Dict]]], failed_blocks: Optional[List[int]] = None) -> List[Dict]:
+        # First pass: collect the delegate hotkeys of every staking event, so all owners missing from the
+        # cache are read in a single batched request rather than one request per event.
+        hotkeys_by_block = {}
+        for bn, block_events in blocks:
+            block_hotkeys = hotkeys_by_block.setdefault(bn, set())
+            for event in block_events:
+                try:
+                    self.collect_delegate_hotkeys(event, block_hotkeys)
+                except Exception as e:
+                    logger.warning(f"Error collecting delegate hotkeys in block {bn}: {e}")
+        hotkeys = set().union(*hotkeys_by_block.values())
+
+        owners = {}
+        if hotkeys:
+            try:
+                owners = await self.coldkey_finder.find_many(hotkeys)
+            except Exception as e:
+                logger.error(f"Error resolving owners of {len(hotkeys)} delegate hotkeys: {e}")
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        if failed_blocks is not None:
+            failed_blocks.extend(bn for bn, block_hotkeys in hotkeys_by_block.items() if not block_hotkeys <= owners.keys())
 
+        # Second pass: emit the events, staking events with unresolved owners are skipped.
         all_parsed_events = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"Error parsing block {list(event_data.keys())[i]}: {result}")
+        for bn, block_events in blocks:
+            try:
+                all_parsed_events.extend(self.parse_events(block_events, bn, owners, failed_blocks))
+            except Exception as e:
+                logger.error(f"Error parsing block {bn}: {e}")
+                if failed_blocks is not None:
+                    failed_blocks.append(bn)
+
+        return all_parsed_events
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if getattr(sys, "_is_gil_enabled", lambda: True)():
+                # Spawned rather than forked, as the miner forks from a process already running threads.
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+                )
             else:
-                all_parsed_events.extend(result)
+                self._executor = ThreadPoolExecutor(self.workers)
+        return self._executor
 
-        logger.debug(f"Returning {len(all_parsed_events)} parsed events in {round(time.time() - start_time, 4)} seconds.")
+    async def _process_in_workers(self, blocks: List[Tuple[int, List[Dict]]], failed_blocks: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Parses shards of consecutive blocks in the workers, with delegate hotkeys in place of their owners,
+        then resolves the owners in one batch and merges the events in block order.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        # A few shards per worker, so one shard of busy blocks does not hold up the rest.
+        shard_size = max(1, -(-len(blocks) // (self.workers * 4)))
+        shards = [blocks[i:i + shard_size] for i in range(0, len(blocks), shard_size)]
+        results = await asyncio.gather(*(loop.run_in_executor(executor, parse_blocks, shard) for shard in shards))
+
+        hotkeys = set()
+        for _, shard_hotkeys, shard_failed_blocks in results:
+            hotkeys.update(shard_hotkeys)
+            if failed_blocks is not None:
+                failed_blocks.extend(shard_failed_blocks)
+
+        owners = {}
+        if hotkeys:
+            try:
+                owners = await self.coldkey_finder.find_many(hotkeys)
+            except Exception as e:
+                logger.error(f"Error resolving owners of {len(hotkeys)} delegate hotkeys: {e}")
+
+        all_parsed_events = []
+        edges = [edge for shard_edges, _, _ in results for edge in shard_edges]
+        for i in range(0, len(edges), 1000):
+            for edge in edges[i:i + 1000]:
+                event = edge_from_tuple(edge, owners)
+                if event is not None:
+                    all_parsed_events.append(event)
+                elif failed_blocks is not None:
+                    failed_blocks.append(dict(edge[5])["block_number"])
+            # Merging runs on the event loop, so give other tasks a turn every thousand events.
+            await asyncio.sleep(0)
         return all_parsed_events
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+def _init_worker():
+    """
+    Importing bittensor in a worker process starts its logging queue listener, stopped by an atexit handler,
+    which only runs after multiprocessing has closed the queue the listener reads. Stop it before that instead,
+    so the listener does not die with an EOFError when the worker exits.
+    """
+    import bittensor
+
+    listener = getattr(bittensor.logging, "_listener", None)
+    if listener is not None:
+        atexit.unregister(listener.stop)
+        multiprocessing.util.Finalize(None, listener.stop, exitpriority=100)
+
+def edge_to_tuple(event: Dict) -> EdgeTuple:
+    return (
+        event["coldkey_source"],
+        event["coldkey_destination"],
+        event.get("coldkey_owner"),
+        event["category"],
+        event["type"],
+        tuple(event["evidence"].items()),
+    )
+
+def edge_from_tuple(edge: EdgeTuple, owners: Dict[str, str]) -> Optional[Dict]:
+    """
+    Rebuilds an event from its tuple form, filling in the owners of its delegate hotkeys.
+    Returns None for staking events with an owner missing from `owners`.
+    """
+    source, destination, coldkey_owner, category, event_type, evidence = edge
+    event = {"coldkey_source": source, "coldkey_destination": destination}
+    if coldkey_owner is not None:
+        event["coldkey_owner"] = coldkey_owner
+    event.update({"category": category, "type": event_type, "evidence": dict(evidence)})
+
+    if category == "staking":
+        for field, hotkey_key in _OWNER_FIELDS.get(event_type, ()):
+            hotkey = event["evidence"][hotkey_key]
+            if hotkey not in owners:
+                return None
+            event[field] = owners[hotkey]
+    return event
+
+def parse_blocks(blocks: List[Tuple[int, List[Dict]]]) -> Tuple[List[EdgeTuple], Set[str], List[int]]:
+    """
+    Parses the events of blocks in a worker, leaving the owners of delegate hotkeys to be resolved by the
+    caller, see `edge_from_tuple`.
+
+    Returns:
+        The events as tuples, the delegate hotkeys whose owners are needed, and the blocks with events that
+        could not be parsed.
+    """
+    processor = EventProcessor(coldkey_finder=None)
+    owners = _UnresolvedOwners()
+    edges = []
+    failed_blocks = []
+    for block_number, events in blocks:
+        try:
+            edges.extend(edge_to_tuple(event) for event in processor.parse_events(events, block_number, owners, failed_blocks))
+        except Exception as e:
+            logger.error(f"Error parsing block {block_number}: {e}")
+            failed_blocks.append(block_number)
+    # Every hotkey looked up while parsing was recorded as its own placeholder owner.
+    return edges, set(owners), failed_blocks
     
 if __name__ == "__main__":
 
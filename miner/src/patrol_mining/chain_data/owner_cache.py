@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import sqlite3
+from typing import Iterable, Optional
+
+from bittensor.core.chain_data.utils import decode_account_id
+
+from patrol_common.paths import prepare_path
+from patrol_mining.chain_data.event_fetcher import EventFetcher
+
+logger = logging.getLogger(__name__)
+
+
+class OwnerCache:
+    def __init__(self, path: Optional[str] = None):
+        """
+        Hotkey owners, each with the block it was read at, kept entirely in memory and persisted to sqlite
+        so a restarted miner starts warm.
+
+        Args:
+            path: Location of the sqlite store, or None for a memory only cache.
+        """
+        self._owners: dict[str, tuple[str, int]] = {}
+        self._synced_block: Optional[int] = None
+
+        self._db = None
+        if path is not None:
+            path = prepare_path(path)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS owners ("
+                "hotkey TEXT PRIMARY KEY, coldkey TEXT NOT NULL, block_number INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS sync (id INTEGER PRIMARY KEY CHECK (id = 0), block_number INTEGER)")
+            self._db.commit()
+            for hotkey, coldkey, block_number in self._db.execute("SELECT hotkey, coldkey, block_number FROM owners"):
+                self._owners[hotkey] = (coldkey, block_number)
+            row = self._db.execute("SELECT block_number FROM sync WHERE id = 0").fetchone()
+            self._synced_block = row[0] if row else None
+            logger.info(f"Loaded {len(self._owners)} hotkey owners from {path}, last synced at block {self._synced_block}.")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    @property
+    def synced_block(self) -> Optional[int]:
+        """
+        The block the cache holds every owner as of, from a complete pass over the Owner map and the
+        ownership changes applied since.
+        """
+        return self._synced_block
+
+    def get(self, hotkey: str) -> Optional[str]:
+        entry = self._owners.get(hotkey)
+        return entry[0] if entry else None
+
+    def block_number(self, hotkey: str) -> Optional[int]:
+        """
+        The block the owner of `hotkey` was read at.
+        """
+        entry = self._owners.get(hotkey)
+        return entry[1] if entry else None
+
+    def get_many(self, hotkeys: Iterable[str]) -> dict[str, str]:
+        """
+        Returns the owner of each of `hotkeys` found in the cache, leaving out the others.
+        """
+        owners = {}
+        for hotkey in hotkeys:
+            entry = self._owners.get(hotkey)
+            if entry is not None:
+                owners[hotkey] = entry[0]
+        return owners
+
+    def put_many(self, owners: dict[str, str], block_number: int):
+        """
+        Stores owners read at `block_number`, keeping entries that were read at a later block.
+        """
+        updated = [
+            (hotkey, coldkey, block_number)
+            for hotkey, coldkey in owners.items()
+            if hotkey not in self._owners or self._owners[hotkey][1] <= block_number
+        ]
+        for hotkey, coldkey, _ in updated:
+            self._owners[hotkey] = (coldkey, block_number)
+
+        if self._db is not None and updated:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO owners (hotkey, coldkey, block_number) VALUES (?, ?, ?)", updated
+            )
+            self._db.commit()
+
+    def mark_synced(self, block_number: int):
+        """
+        Records a complete pass over the Owner map at `block_number`. Hotkeys it did not see, and that were
+        not read after it, no longer have an owner and are removed.
+        """
+        stale = [hotkey for hotkey, (_, read_at) in self._owners.items() if read_at < block_number]
+        for hotkey in stale:
+            del self._owners[hotkey]
+        self._synced_block = block_number
+
+        if self._db is not None:
+            self._db.execute("DELETE FROM owners WHERE block_number < ?", (block_number,))
+            self._db.execute("INSERT OR REPLACE INTO sync (id, block_number) VALUES (0, ?)", (block_number,))
+            self._db.commit()
+        if stale:
+            logger.info(f"Removed {len(stale)} hotkeys without an owner at block {block_number}.")
+
+    def mark_updated(self, block_number: int):
+        """
+        Records that the ownership changes up to `block_number` have been applied since the last pass.
+        """
+        self._synced_block = block_number
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO sync (id, block_number) VALUES (0, ?)", (block_number,))
+            self._db.commit()
+
+
+def to_address(value) -> str:
+    value = getattr(value, "value", value)
+    return value if isinstance(value, str) else decode_account_id(value)
+
+
+class OwnerCacheSync:
+    def __init__(
+            self,
+            substrate_client,
+            owner_cache: OwnerCache,
+            interval_seconds: float = 3600,
+            page_size: int = 1000,
+            max_update_blocks: int = 7200,
+    ):
+        """
+        Keeps an OwnerCache up to date with the finalized head, first at startup and then every `interval_seconds`.
+
+        A cache that was never filled, or that is more than `max_update_blocks` behind, is filled by streaming
+        the whole SubtensorModule.Owner map, each page written to the cache as it arrives so lookups keep being
+        served while the pass runs. Otherwise only the blocks since the cache's synced block are scanned for
+        registrations, hotkey swaps and coldkey swaps, and the owners of the hotkeys involved are read at the
+        blocks they changed at. Hotkeys that no longer have an owner are only dropped by a pass over the map.
+
+        Args:
+            substrate_client: The SubstrateClient used to read the Owner map and ownership changes.
+            owner_cache: The cache to fill.
+            interval_seconds: Time between updates when running in the background.
+            page_size: Number of owners read per request.
+            max_update_blocks: Largest number of blocks scanned for ownership changes, beyond which the whole
+                Owner map is read instead.
+        """
+        self.substrate_client = substrate_client
+        self.owner_cache = owner_cache
+        self.interval_seconds = interval_seconds
+        self.page_size = page_size
+        self.max_update_blocks = max_update_blocks
+        self._task: Optional[asyncio.Task] = None
+
+    async def sync(self) -> int:
+        """
+        Brings the cache up to date with the finalized head, with an update from ownership changes when the
+        cache is recent enough and a pass over the Owner map otherwise.
+
+        Returns:
+            The number of owners read.
+        """
+        block_number, block_hash = await self.substrate_client.get_finalized_head()
+        synced_block = self.owner_cache.synced_block
+        if synced_block is not None and block_number - synced_block <= self.max_update_blocks:
+            return await self.update(synced_block, block_number)
+        return await self.read_owner_map(block_number, block_hash)
+
+    async def read_owner_map(self, block_number: int, block_hash: str) -> int:
+        """
+        Runs a single pass over the Owner map at the given block.
+
+        Returns:
+            The number of owners read.
+        """
+        version = self.substrate_client.runtime_index.version_for_block(block_number, block_number)
+
+        result = await self.substrate_client.query(
+            "query_map",
+            version,
+            "SubtensorModule",
+            "Owner",
+            block_hash=block_hash,
+            page_size=self.page_size
+        )
+
+        count = 0
+        page = {}
+        async for hotkey, coldkey in result:
+            page[to_address(hotkey)] = to_address(coldkey)
+            if len(page) >= self.page_size:
+                self.owner_cache.put_many(page, block_number)
+                count += len(page)
+                page = {}
+        self.owner_cache.put_many(page, block_number)
+        count += len(page)
+
+        self.owner_cache.mark_synced(block_number)
+        logger.info(f"Synced {count} hotkey owners at block {block_number}.")
+        return count
+
+    async def update(self, synced_block: int, block_number: int) -> int:
+        """
+        Applies the ownership changes in (synced_block, block_number] to the cache.
+
+        Returns:
+            The number of owners read.
+        """
+        if block_number <= synced_block:
+            return 0
+        # Imported here, as the ownership index builds on the event processor, which builds on this cache.
+        from patrol_mining.hotkey_ownership_index import HotkeyOwnershipIndexer
+
+        scanner = HotkeyOwnershipIndexer(self.substrate_client, index=None)
+        observations = await scanner.scan_blocks(
+            EventFetcher(substrate_client=self.substrate_client), synced_block + 1, block_number, block_number
+        )
+        by_block: dict[int, dict[str, str]] = {}
+        for hotkey, changed_at, coldkey in observations:
+            by_block.setdefault(changed_at, {})[hotkey] = coldkey
+        # In block order, so a hotkey that changed owner more than once ends up with its latest owner.
+        for changed_at in sorted(by_block):
+            self.owner_cache.put_many(by_block[changed_at], changed_at)
+
+        self.owner_cache.mark_updated(block_number)
+        logger.info(f"Updated {len(observations)} hotkey owners from the changes in blocks {synced_block + 1} to {block_number}.")
+        return len(observations)
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Hotkey owner sync failed, retrying in {self.interval_seconds}s: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts updating the cache in the background, every `interval_seconds`.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
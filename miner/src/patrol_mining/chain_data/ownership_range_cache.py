@@ -0,0 +1,98 @@
+import bisect
+import logging
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional
+
+from patrol_common.paths import prepare_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OwnershipHistory:
+    """
+    The owners of a hotkey from `minimum_block` up to and including `verified_block`: `first_owner` at
+    `minimum_block`, then one (change_block, old_owner, new_owner) entry per change, in block order.
+    """
+    minimum_block: int
+    verified_block: int
+    first_owner: str
+    changes: list[tuple[int, str, str]] = field(default_factory=list)
+
+    def owner_at(self, block_number: int) -> str:
+        index = bisect.bisect_right([change[0] for change in self.changes], block_number)
+        return self.changes[index - 1][2] if index else self.first_owner
+
+    def changes_between(self, low: int, high: int) -> list[tuple[int, str, str]]:
+        """
+        Returns the changes in (low, high].
+        """
+        return [change for change in self.changes if low < change[0] <= high]
+
+
+class OwnershipRangeCache:
+    def __init__(self, path: Optional[str] = None):
+        """
+        The ownership history found for each searched hotkey, kept in memory and persisted to sqlite, so
+        later searches only need to cover blocks after the last verified one.
+
+        Args:
+            path: Location of the sqlite store, or None for a memory only cache.
+        """
+        self._histories: dict[str, OwnershipHistory] = {}
+
+        self._db = None
+        if path is not None:
+            path = prepare_path(path)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ownership ("
+                "hotkey TEXT PRIMARY KEY, minimum_block INTEGER NOT NULL, verified_block INTEGER NOT NULL, first_owner TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ownership_changes ("
+                "hotkey TEXT NOT NULL, change_block INTEGER NOT NULL, old_owner TEXT NOT NULL, new_owner TEXT NOT NULL, "
+                "PRIMARY KEY (hotkey, change_block))"
+            )
+            self._db.commit()
+            for hotkey, minimum_block, verified_block, first_owner in self._db.execute(
+                "SELECT hotkey, minimum_block, verified_block, first_owner FROM ownership"
+            ):
+                self._histories[hotkey] = OwnershipHistory(minimum_block, verified_block, first_owner)
+            for hotkey, change_block, old_owner, new_owner in self._db.execute(
+                "SELECT hotkey, change_block, old_owner, new_owner FROM ownership_changes ORDER BY hotkey, change_block"
+            ):
+                if hotkey in self._histories:
+                    self._histories[hotkey].changes.append((change_block, old_owner, new_owner))
+            logger.info(f"Loaded the ownership history of {len(self._histories)} hotkeys from {path}.")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._histories)
+
+    def get(self, hotkey: str) -> Optional[OwnershipHistory]:
+        return self._histories.get(hotkey)
+
+    def put(self, hotkey: str, history: OwnershipHistory):
+        """
+        Stores the ownership history of `hotkey`, replacing the one stored before.
+        """
+        self._histories[hotkey] = history
+
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ownership (hotkey, minimum_block, verified_block, first_owner) VALUES (?, ?, ?, ?)",
+                (hotkey, history.minimum_block, history.verified_block, history.first_owner)
+            )
+            self._db.execute("DELETE FROM ownership_changes WHERE hotkey = ?", (hotkey,))
+            self._db.executemany(
+                "INSERT INTO ownership_changes (hotkey, change_block, old_owner, new_owner) VALUES (?, ?, ?, ?)",
+                [(hotkey, *change) for change in history.changes]
+            )
+            self._db.commit()
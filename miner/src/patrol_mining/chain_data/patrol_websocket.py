@@ -1,16 +1,26 @@
 import asyncio
+import binascii
 import json
 import logging
 import ssl
 import time
+from collections import OrderedDict, deque
 from itertools import cycle
 from typing import Optional
 
 from websockets import ConnectionClosed
 from websockets.asyncio import client
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Methods whose hex-encoded results are SCALE data, delivered as bytes when the fast codec is enabled.
+BINARY_RESULT_METHODS = {"state_getStorageAt"}
+
 id_cycle = cycle(range(1, 0xffffff))
 
 async def get_next_id() -> str:
@@ -20,38 +30,78 @@ async def get_next_id() -> str:
     return hex(next(id_cycle))[2:].zfill(6)
 
 
+def hex_result_to_bytes(frame: bytes, result: str) -> bytes:
+    """
+    Decodes a "0x"-prefixed hex result to bytes, reading the hex digits straight out of the raw frame when
+    they can be located, so no intermediate sliced copy of the string is made.
+    """
+    marker = b'"result":"0x'
+    start = frame.find(marker)
+    if start != -1:
+        start += len(marker)
+        end = start + len(result) - 2
+        if frame[end:end + 1] == b'"':
+            return binascii.unhexlify(memoryview(frame)[start:end])
+    return bytes.fromhex(result[2:])
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Marks the exception of an abandoned future as retrieved, so expiring requests nobody waits for
+    # do not log "Future exception was never retrieved".
+    if not future.cancelled():
+        future.exception()
+
+
 class PatrolWebsocket:
     def __init__(
             self,
             ws_url: str,
             shutdown_timer=5,
             options: Optional[dict] = None,
-            cleanup_interval_seconds = 300,
+            request_timeout_seconds: float = 60,
+            max_pending_requests: int = 10000,
+            retrieve_wait_seconds: float = 1,
+            fast_codec: bool = True,
     ):
         """
         Websocket manager object. Allows for the use of a single websocket connection by multiple
         calls.
 
+        Every request sent registers a future keyed by its JSON-RPC id, which is resolved by the receiving
+        task as soon as the matching reply arrives.
+
         Args:
             ws_url: Websocket URL to connect to
-            max_subscriptions: Maximum number of subscriptions per websocket connection
-            max_connections: Maximum number of connections total
             shutdown_timer: Number of seconds to shut down websocket connection after last use
+            options: Options passed through to the websockets client connect call
+            request_timeout_seconds: Deadline after which an unanswered or uncollected request is dropped
+            max_pending_requests: Maximum number of requests awaiting a reply; further sends wait for a free slot
+            retrieve_wait_seconds: Maximum time `retrieve` waits for a pending reply before returning None
+            fast_codec: Use orjson, when installed, to encode and decode frames. Storage results are then
+                returned as bytes instead of hex strings.
         """
         self.ws_url = ws_url
         self.ws: Optional["ClientConnection"] = None
         self.shutdown_timer = shutdown_timer
-        self._received = {}
+        self._pending: dict[str, tuple[asyncio.Future, asyncio.TimerHandle, bool]] = {}
+        self._pending_slots = asyncio.Semaphore(max_pending_requests)
+        # Exceptions of requests that expired or failed before `retrieve` collected them, so it can raise them.
+        self._failed: OrderedDict[str, Exception] = OrderedDict()
+        self._max_failed = max_pending_requests
+        self._subscriptions: dict[str, deque] = {}
         self._in_use = 0
         self._receiving_task = None
-        self._expired_requests_cleanup_task = None
         self._attempts = 0
         self._initialized = False
         self._lock = asyncio.Lock()
         self._exit_task = None
         self._options = options if options else {}
         self.last_received = time.time()
-        self._cleanup_interval_seconds = cleanup_interval_seconds
+        self._request_timeout_seconds = request_timeout_seconds
+        self._retrieve_wait_seconds = retrieve_wait_seconds
+        self._fast_codec = fast_codec and orjson is not None
+        if fast_codec and orjson is None:
+            logger.info("orjson is not installed, using the standard json codec for websocket frames.")
 
     async def __aenter__(self):
         async with self._lock:
@@ -64,32 +114,30 @@ class PatrolWebsocket:
             self._exit_task.cancel()
         if not self._initialized or force:
             try:
-                self._receiving_task.cancel()
-                if self._receiving_task:
+                # When reconnecting from the receiving task itself there is nothing to cancel.
+                if self._receiving_task is not asyncio.current_task():
+                    self._receiving_task.cancel()
                     await self._receiving_task
 
-                self._expired_requests_cleanup_task.cancel()
-                await self._expired_requests_cleanup_task
-
                 if self.ws:
                     await self.ws.close()
             except (AttributeError, asyncio.CancelledError):
                 pass
 
+            # Replies to requests sent over the previous connection will never arrive.
+            self._fail_pending(ConnectionClosed(None, None))
+
             self.ws = await asyncio.wait_for(client.connect(self.ws_url, **self._options), timeout=10)
             self._receiving_task = asyncio.create_task(self._start_receiving())
             self._initialized = True
-            self._expired_requests_cleanup_task = asyncio.create_task(self._cleanup())
-
-    async def _cleanup(self):
-        while self._initialized:
-            await asyncio.sleep(self._cleanup_interval_seconds)
-            oldest = time.time() - self._cleanup_interval_seconds
-            logger.info("Expired task cleanup started for %s received responses", len(self._received))
-            expired_keys = [k for k, v in self._received.items() if v[0] < oldest]
-            for k in expired_keys:
-                del self._received[k]
-            logger.info("Cleaned up %s expired responses older than %s s", len(expired_keys), self._cleanup_interval_seconds)
+
+    async def ensure_connected(self):
+        """
+        Connects, unless connected already, waiting for a reconnect in progress to finish first.
+        """
+        async with self._lock:
+            if not self.connected:
+                await self.connect(force=True)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         async with self._lock:  # TODO is this actually what I want to happen?
@@ -120,29 +168,123 @@ class PatrolWebsocket:
                 self._receiving_task.cancel()
                 await self._receiving_task
 
-                self._expired_requests_cleanup_task.cancel()
-                await self._expired_requests_cleanup_task
-
                 await self.ws.close()
             except (AttributeError, asyncio.CancelledError):
                 pass
             finally:
+                self._fail_pending(ConnectionClosed(None, None))
                 self._initialized = False
                 self.ws = None
                 self._receiving_task = None
 
+    @property
+    def connected(self) -> bool:
+        return self._initialized and self.ws is not None
+
+    def owns(self, item_id: str) -> bool:
+        """
+        Whether a request or subscription id is being tracked by this connection.
+        """
+        return item_id in self._pending or item_id in self._subscriptions or item_id in self._failed
+
+    @property
+    def pending_requests(self) -> int:
+        """
+        Number of requests sent over this connection that have not been collected yet.
+        """
+        return len(self._pending)
+
+    def _encode(self, payload: dict) -> str | bytes:
+        if self._fast_codec:
+            return orjson.dumps(payload)
+        return json.dumps(payload)
+
+    def _decode(self, frame: bytes):
+        if self._fast_codec:
+            return orjson.loads(frame)
+        return json.loads(frame)
+
+    def _register(self, item_id: str, timeout: Optional[float], binary_result: bool = False) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_consume_exception)
+        deadline = loop.call_later(
+            timeout if timeout is not None else self._request_timeout_seconds,
+            self._expire,
+            item_id
+        )
+        self._pending[item_id] = (future, deadline, binary_result)
+        return future
+
+    def _discard(self, item_id: str) -> Optional[asyncio.Future]:
+        """
+        Removes a request from the pending table, freeing its slot. Replies arriving afterwards are dropped.
+        """
+        entry = self._pending.pop(item_id, None)
+        if entry is None:
+            return None
+        future, deadline, _ = entry
+        deadline.cancel()
+        self._pending_slots.release()
+        return future
+
+    def _fail(self, item_id: str, future: asyncio.Future, exc: Exception) -> None:
+        if not future.done():
+            future.set_exception(exc)
+        self._failed[item_id] = exc
+        while len(self._failed) > self._max_failed:
+            self._failed.popitem(last=False)
+
+    def _expire(self, item_id: str) -> None:
+        future = self._discard(item_id)
+        if future is not None:
+            logger.debug("Request %s expired after %s s without being collected", item_id, self._request_timeout_seconds)
+            self._fail(item_id, future, asyncio.TimeoutError(f"No response collected for request {item_id}"))
+
+    def _fail_pending(self, exc: Exception) -> None:
+        for item_id in list(self._pending.keys()):
+            future = self._discard(item_id)
+            if not future.done():
+                self._fail(item_id, future, exc)
+
+    def _resolve(self, item_id: str, response: dict, frame: Optional[bytes]) -> None:
+        entry = self._pending.get(item_id)
+        if entry is None:
+            logger.debug("Dropping response for unknown, expired or cancelled request %s", item_id)
+            return
+        future, _, binary_result = entry
+        if future.done():
+            return
+        if binary_result:
+            result = response.get("result")
+            if isinstance(result, str) and result.startswith("0x"):
+                # A batch frame holds several results, so only single responses are read from the frame.
+                response["result"] = hex_result_to_bytes(frame, result) if frame is not None else bytes.fromhex(result[2:])
+        future.set_result(response)
+
+    def _dispatch(self, response: dict, frame: Optional[bytes]) -> None:
+        if "id" in response:
+            if response["id"] is None and "error" in response:
+                # Errors for a batch as a whole carry no id; its requests fail at their deadline.
+                logger.warning("Request rejected by %s: %s", self.ws_url, response["error"])
+            else:
+                self._resolve(response["id"], response, frame)
+        elif "params" in response:
+            subscription_id = response["params"]["subscription"]
+            self._subscriptions.setdefault(subscription_id, deque(maxlen=1000)).append(response)
+        else:
+            raise KeyError(response)
+
     async def _recv(self) -> None:
         try:
-            # TODO consider wrapping this in asyncio.wait_for and use that for the timeout logic
-            response = json.loads(await self.ws.recv(decode=False))
-            now = time.time()
-            self.last_received = now
-            if "id" in response:
-                self._received[response["id"]] = (now, response)
-            elif "params" in response:
-                self._received[response["params"]["subscription"]] = (now, response)
+            frame = await self.ws.recv(decode=False)
+            response = self._decode(frame)
+            self.last_received = time.time()
+            if isinstance(response, list):
+                for item in response:
+                    self._dispatch(item, None)
             else:
-                raise KeyError(response)
+                self._dispatch(response, frame)
         except ssl.SSLError:
             raise ConnectionClosed
         except (ConnectionClosed, KeyError):
@@ -155,42 +297,162 @@ class PatrolWebsocket:
         except asyncio.CancelledError:
             pass
         except ConnectionClosed:
-            async with self._lock:
-                await self.connect(force=True)
+            logger.warning("Connection to %s closed, reconnecting.", self.ws_url)
+            await self._reconnect()
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self._lock:
+                    await self.connect(force=True)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Stay out of rotation until a connection is re-established.
+                self._initialized = False
+                backoff = min(2 ** attempt, 30)
+                logger.warning("Reconnect attempt %s to %s failed: %s. Retrying in %s s", attempt, self.ws_url, e, backoff)
+                await asyncio.sleep(backoff)
 
-    async def send(self, payload: dict) -> str:
+    async def send(self, payload: dict, timeout: Optional[float] = None) -> str:
         """
-        Sends a payload to the websocket connection.
+        Sends a payload to the websocket connection and registers a future for its response.
 
         Args:
             payload: payload, generate a payload with the AsyncSubstrateInterface.make_payload method
+            timeout: Deadline in seconds for the response, defaults to the connection's request timeout
 
         Returns:
             id: the internal ID of the request (incremented int)
         """
-        # async with self._lock:
+        await self._pending_slots.acquire()
         original_id = await get_next_id()
+        self._register(original_id, timeout, self._fast_codec and payload.get("method") in BINARY_RESULT_METHODS)
 
-        # self._open_subscriptions += 1
         try:
-            await self.ws.send(json.dumps({**payload, **{"id": original_id}}))
+            await self.ws.send(self._encode({**payload, **{"id": original_id}}), text=True)
             return original_id
         except (ConnectionClosed, ssl.SSLError, EOFError):
+            self._discard(original_id)
             async with self._lock:
                 await self.connect(force=True)
+            raise
+        except BaseException:
+            self._discard(original_id)
+            raise
 
-    async def retrieve(self, item_id: int) -> Optional[dict]:
+    async def send_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[str]:
         """
-        Retrieves a single item from received responses dict queue
+        Sends several payloads as a single JSON-RPC batch frame, registering a future for each response.
 
         Args:
-            item_id: id of the item to retrieve
+            payloads: payloads, generate them with the AsyncSubstrateInterface.make_payload method
+            timeout: Deadline in seconds for the responses, defaults to the connection's request timeout
 
         Returns:
-             retrieved item
+            ids: the internal IDs of the requests, in the order of the payloads
         """
+        ids = []
+        for payload in payloads:
+            await self._pending_slots.acquire()
+            item_id = await get_next_id()
+            self._register(item_id, timeout, self._fast_codec and payload.get("method") in BINARY_RESULT_METHODS)
+            ids.append(item_id)
+
         try:
-            return self._received.pop(item_id)[1]
-        except KeyError:
+            frame = [{**payload, **{"id": item_id}} for payload, item_id in zip(payloads, ids)]
+            await self.ws.send(self._encode(frame), text=True)
+            return ids
+        except (ConnectionClosed, ssl.SSLError, EOFError):
+            for item_id in ids:
+                self._discard(item_id)
+            async with self._lock:
+                await self.connect(force=True)
+            raise
+        except BaseException:
+            for item_id in ids:
+                self._discard(item_id)
+            raise
+
+    async def request_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[dict | Exception]:
+        """
+        Sends payloads as a single batch frame and waits for all responses.
+
+        Args:
+            payloads: payloads, generate them with the AsyncSubstrateInterface.make_payload method
+            timeout: Deadline in seconds for the responses, defaults to the connection's request timeout
+
+        Returns:
+            the raw JSON-RPC response for each payload, in order, or the exception raised waiting for it
+        """
+        ids = await self.send_batch(payloads, timeout)
+        futures = [self._pending[item_id][0] for item_id in ids]
+        try:
+            return await asyncio.gather(*futures, return_exceptions=True)
+        finally:
+            for item_id in ids:
+                self._discard(item_id)
+                self._failed.pop(item_id, None)
+
+    async def request(self, payload: dict, timeout: Optional[float] = None) -> dict:
+        """
+        Sends a payload and waits for its response.
+
+        If the caller is cancelled, or the deadline passes, the request is dropped from the pending table
+        and any late reply is discarded.
+
+        Args:
+            payload: payload, generate a payload with the AsyncSubstrateInterface.make_payload method
+            timeout: Deadline in seconds for the response, defaults to the connection's request timeout
+
+        Returns:
+            the raw JSON-RPC response
+        """
+        item_id = await self.send(payload, timeout)
+        future = self._pending[item_id][0]
+        try:
+            return await future
+        finally:
+            self._discard(item_id)
+            self._failed.pop(item_id, None)
+
+    async def retrieve(self, item_id: str) -> Optional[dict]:
+        """
+        Retrieves a single item from the received responses, waiting briefly for it to arrive.
+
+        Args:
+            item_id: id of the item to retrieve
+
+        Returns:
+             retrieved item, or None if it has not arrived yet
+
+        Raises:
+            The exception of a request that expired or failed, e.g. TimeoutError once its deadline passed.
+        """
+        entry = self._pending.get(item_id)
+        if entry is None:
+            exc = self._failed.pop(item_id, None)
+            if exc is not None:
+                raise exc
+            notifications = self._subscriptions.get(item_id)
+            if notifications:
+                return notifications.popleft()
             await asyncio.sleep(0.001)
             return None
+
+        future = entry[0]
+        if not future.done():
+            try:
+                await asyncio.wait((future,), timeout=self._retrieve_wait_seconds)
+            except asyncio.CancelledError:
+                self._discard(item_id)
+                raise
+            if not future.done():
+                return None
+
+        self._discard(item_id)
+        self._failed.pop(item_id, None)
+        return future.result()
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from patrol_mining.chain_data.patrol_websocket import PatrolWebsocket
+
+logger = logging.getLogger(__name__)
+
+
+class PatrolWebsocketPool:
+    def __init__(
+            self,
+            ws_url: str,
+            size: int = 4,
+            shutdown_timer=5,
+            options: Optional[dict] = None,
+            stall_seconds: float = 60,
+            **websocket_kwargs
+    ):
+        """
+        A pool of websocket connections to a single endpoint, exposing the same interface as PatrolWebsocket
+        so it can be injected into CustomAsyncSubstrateInterface.
+
+        Each request is routed to the connected websocket with the fewest in-flight requests. Request ids
+        are unique across connections, so responses are retrieved from whichever connection sent them.
+        Connections reconnect independently, and are left out of routing while they do so. A forced
+        reconnect, which AsyncSubstrateInterface asks for after any request times out, only replaces the
+        connections that are down or stalled, leaving requests in flight on the others untouched.
+
+        Args:
+            ws_url: Websocket URL to connect to
+            size: Number of connections to open
+            shutdown_timer: Number of seconds to shut down each connection after last use
+            options: Options passed through to the websockets client connect call
+            stall_seconds: Time a connection with requests in flight may go without receiving anything before
+                a forced reconnect replaces it
+            **websocket_kwargs: Additional keyword arguments for each PatrolWebsocket
+        """
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+
+        self.ws_url = ws_url
+        self.stall_seconds = stall_seconds
+        self._last_reset = 0.0
+        self.connections = [
+            PatrolWebsocket(ws_url, shutdown_timer=shutdown_timer, options=options, **websocket_kwargs)
+            for _ in range(size)
+        ]
+
+    async def __aenter__(self):
+        results = await asyncio.gather(*(c.__aenter__() for c in self.connections), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if len(errors) == len(self.connections):
+            # Every connection counts itself as in use even when connecting failed, so leave them all again.
+            await asyncio.gather(*(c.__aexit__(None, None, None) for c in self.connections))
+            raise errors[0]
+        for e in errors:
+            logger.warning("Failed to connect websocket to %s: %s", self.ws_url, e)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await asyncio.gather(*(c.__aexit__(exc_type, exc_val, exc_tb) for c in self.connections))
+
+    def _stalled(self, connection: PatrolWebsocket) -> bool:
+        return connection.pending_requests > 0 and time.time() - connection.last_received >= self.stall_seconds
+
+    async def connect(self, force=False):
+        connections = self.connections
+        if force:
+            connections = [c for c in self.connections if not c.connected or self._stalled(c)]
+            if not connections:
+                return
+            logger.info("Reconnecting %s of %s websocket(s) to %s.", len(connections), len(self.connections), self.ws_url)
+
+        results = await asyncio.gather(*(c.connect(force=force) for c in connections), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        for e in errors:
+            logger.warning("Failed to connect websocket to %s: %s", self.ws_url, e)
+        if len(errors) == len(self.connections):
+            raise errors[0]
+
+    async def shutdown(self):
+        await asyncio.gather(*(c.shutdown() for c in self.connections))
+
+    @property
+    def last_received(self) -> float:
+        return max(self._last_reset, *(c.last_received for c in self.connections))
+
+    @last_received.setter
+    def last_received(self, value: float):
+        # Kept apart from the connections' own times, which tell stalled connections apart on reconnect.
+        self._last_reset = value
+
+    @property
+    def connected(self) -> bool:
+        return any(c.connected for c in self.connections)
+
+    @property
+    def pending_requests(self) -> int:
+        return sum(c.pending_requests for c in self.connections)
+
+    def owns(self, item_id: str) -> bool:
+        return any(c.owns(item_id) for c in self.connections)
+
+    async def _least_loaded(self) -> PatrolWebsocket:
+        connected = [c for c in self.connections if c.connected]
+        if connected:
+            return min(connected, key=lambda c: c.pending_requests)
+        # No connection is up, connect one before sending over it.
+        connection = min(self.connections, key=lambda c: c.pending_requests)
+        await connection.ensure_connected()
+        return connection
+
+    def _owner_of(self, item_id: str) -> Optional[PatrolWebsocket]:
+        for c in self.connections:
+            if c.owns(item_id):
+                return c
+        return None
+
+    async def send(self, payload: dict, timeout: Optional[float] = None) -> str:
+        return await (await self._least_loaded()).send(payload, timeout)
+
+    async def request(self, payload: dict, timeout: Optional[float] = None) -> dict:
+        return await (await self._least_loaded()).request(payload, timeout)
+
+    async def send_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[str]:
+        return await (await self._least_loaded()).send_batch(payloads, timeout)
+
+    async def request_batch(self, payloads: list[dict], timeout: Optional[float] = None) -> list[dict | Exception]:
+        return await (await self._least_loaded()).request_batch(payloads, timeout)
+
+    async def retrieve(self, item_id: str) -> Optional[dict]:
+        connection = self._owner_of(item_id)
+        if connection is None:
+            await asyncio.sleep(0.001)
+            return None
+        return await connection.retrieve(item_id)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeUpgradeDiscovery:
+    def __init__(self, substrate_client, interval_seconds: float = 600):
+        """
+        Keeps the runtime version index of a substrate client up to date with the chain.
+
+        Starting from the end of the last known version range, the runtime version of the finalized head
+        is compared against it. When they differ, the exact upgrade block is found by binary search between
+        the two, in O(log n) runtime version lookups, and a new range is added to the index. Otherwise the
+        last range is extended up to the finalized head.
+
+        Args:
+            substrate_client: The SubstrateClient whose `runtime_index` is extended.
+            interval_seconds: Time between discovery passes when running in the background.
+        """
+        self.substrate_client = substrate_client
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def runtime_index(self):
+        return self.substrate_client.runtime_index
+
+    async def _version_at(self, block_number: int) -> int:
+        version = (await self.substrate_client.get_block_runtime_versions([block_number]))[block_number]
+        if isinstance(version, Exception):
+            raise version
+        return version
+
+    async def find_upgrade(self, low: int, high: int, low_version: int, high_version: int) -> Tuple[int, int]:
+        """
+        Finds the first block after `low` that was executed with a different runtime than `low_version`,
+        given that `high` was.
+
+        Returns:
+            The upgrade block and its runtime version.
+        """
+        while high - low > 1:
+            mid = (low + high) // 2
+            version = await self._version_at(mid)
+            if version == low_version:
+                low = mid
+            else:
+                high, high_version = mid, version
+        return high, high_version
+
+    async def _set_range(self, version: int, block_number_min: int, block_number_max: int):
+        hashes = await self.substrate_client.get_block_hashes([block_number_min, block_number_max])
+        for block_hash in hashes.values():
+            if isinstance(block_hash, Exception):
+                raise block_hash
+
+        bounds = dict(self.runtime_index.versions.get(str(version), {}))
+        bounds.update({
+            "block_number_min": block_number_min,
+            "block_hash_min": hashes[block_number_min],
+            "block_number_max": block_number_max,
+            "block_hash_max": hashes[block_number_max],
+        })
+        self.runtime_index.add_version(version, bounds)
+
+    async def discover(self) -> list[int]:
+        """
+        Runs a single discovery pass up to the finalized head.
+
+        Returns:
+            The runtime versions that were added to the index.
+        """
+        index = self.runtime_index
+        low, low_version = index.highest_max, index.highest_version
+        low_min = index.versions[str(low_version)]["block_number_min"]
+
+        head = await self.substrate_client.get_finalized_block_number()
+        if head <= low:
+            return []
+
+        head_version = await self._version_at(head)
+        added = []
+        while head_version != low_version:
+            upgrade, version = await self.find_upgrade(low, head, low_version, head_version)
+            logger.info(f"Discovered runtime upgrade from version {low_version} to {version} at block {upgrade}.")
+
+            await self._set_range(low_version, low_min, upgrade - 1)
+            await self._set_range(version, upgrade, upgrade)
+            added.append(version)
+            low, low_version, low_min = upgrade, version, upgrade
+
+        await self._set_range(low_version, low_min, head)
+        return added
+
+    async def run(self):
+        while True:
+            try:
+                await self.discover()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Runtime upgrade discovery failed, retrying in {self.interval_seconds}s: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts discovery passes in the background, every `interval_seconds`.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -1,6 +1,7 @@
 import json
 import logging
-from typing import List, Dict, Optional, Tuple
+from bisect import bisect_right
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -19,41 +20,123 @@ def load_versions(filename: str = "runtime_versions.json") -> VersionData:
     with open(filepath, 'r') as f:
         return json.load(f)
 
-# Create a function to get the version for a block number
-def get_version_for_block(
-    block_number: int,
-    current_block: int,
-    versions: VersionData
-) -> Optional[int]:
-    # Convert version keys to integers for sorting
-    version_bounds: Dict[int, VersionRange] = {int(v): b for v, b in versions.items()}
+class RuntimeVersionIndex:
+    def __init__(self, versions: VersionData):
+        """
+        Block number to runtime version lookups over the version ranges of `versions`, built once and
+        answered by bisecting the sorted range starts.
+
+        The index wraps `versions` itself, so versions added through `add_version` are visible to anything
+        holding the mapping.
+        """
+        self.versions = versions
+        self._rebuild()
+
+    @classmethod
+    def from_file(cls, filename: str = "runtime_versions.json") -> "RuntimeVersionIndex":
+        return cls(load_versions(filename))
+
+    def _rebuild(self):
+        ranges = sorted(
+            (bounds["block_number_min"], bounds["block_number_max"], int(version))
+            for version, bounds in self.versions.items()
+        )
+        self._starts = [r[0] for r in ranges]
+        self._ends = [r[1] for r in ranges]
+        self._versions = [r[2] for r in ranges]
+        highest = max(ranges, key=lambda r: r[1]) if ranges else None
+        self.highest_max = highest[1] if highest else None
+        self.highest_version = highest[2] if highest else None
+
+    def add_version(self, version: int, bounds: VersionRange):
+        self.versions[str(version)] = bounds
+        self._rebuild()
+
+    @property
+    def latest_version(self) -> int:
+        return max(int(v) for v in self.versions)
+
+    def version_for_block(self, block_number: int, current_block: int) -> Optional[int]:
+        """
+        Returns the runtime version of a block: the version whose range contains it, the highest version for
+        blocks past every known range up to `current_block`, or None for blocks outside both.
+        """
+        if not self._starts or block_number < self._starts[0]:
+            return None
+
+        i = bisect_right(self._starts, block_number) - 1
+        if block_number <= self._ends[i]:
+            return self._versions[i]
+
+        # If block is beyond current block height, it's not yet valid
+        if block_number > current_block:
+            return None
+
+        if block_number > self.highest_max:
+            return self.highest_version
 
-    # Find the version with the lowest 'min' and highest 'max'
-    min_bound_version = min(version_bounds.items(), key=lambda x: x[1]['block_number_min'])
-    max_bound_version = max(version_bounds.items(), key=lambda x: x[1]['block_number_max'])
+        return None
 
-    lowest_min = min_bound_version[1]['block_number_min']
-    highest_version = max_bound_version[0]
-    highest_max = max_bound_version[1]['block_number_max']
+    def partition(self, block_numbers: Iterable[int], current_block: int) -> Tuple[Dict[int, List[int]], List[int]]:
+        """
+        Splits block numbers into runs of the same runtime version, walking the sorted blocks and version
+        ranges together in a single pass.
+
+        Returns:
+            A dict of version to its sorted block numbers, and the block numbers with no known version.
+        """
+        partitioned: Dict[int, List[int]] = {}
+        unknown: List[int] = []
+        i = 0
+        for block_number in sorted(block_numbers):
+            while i < len(self._starts) and block_number > self._ends[i]:
+                i += 1
+            if i < len(self._starts) and self._starts[i] <= block_number:
+                partitioned.setdefault(self._versions[i], []).append(block_number)
+            elif i == len(self._starts) and self.highest_max is not None and block_number <= current_block:
+                partitioned.setdefault(self.highest_version, []).append(block_number)
+            else:
+                unknown.append(block_number)
+        return partitioned, unknown
+
+    def group_blocks(
+        self,
+        block_hashes: dict[int, str],
+        current_block: int,
+        batch_size: int = 25,
+        min_batch_size: int = 10,
+        batch_size_for: Optional[Callable[[int], int]] = None
+    ) -> Dict[int, List[List[Tuple[int, str]]]]:
+        """
+        Groups blocks by version and splits each group into batches, see `group_blocks`.
+        """
+        partitioned, unknown = self.partition(block_hashes, current_block)
+        for block_number in unknown:
+            logger.warning(f"Block {block_number} is outside current groupings.")
 
-    # If block is below all known ranges
-    if block_number < lowest_min:
-        return None
+        batched: Dict[int, List[List[Tuple[int, str]]]] = {}
+        for group_id, block_numbers in partitioned.items():
+            size = batch_size_for(group_id) if batch_size_for is not None else batch_size
+            block_list = [(n, block_hashes[n]) for n in block_numbers]
+            batches: List[List[Tuple[int, str]]] = [
+                block_list[i:i + size] for i in range(0, len(block_list), size)
+            ]
 
-    # If block is within any known range
-    for version, bounds in version_bounds.items():
-        if bounds['block_number_min'] <= block_number <= bounds['block_number_max']:
-            return version
+            # Merge the final batch if it's too small
+            if len(batches) > 1 and len(batches[-1]) < min(min_batch_size, size):
+                batches[-2].extend(batches.pop())  # Merge last into second-last
 
-    # If block is beyond current block height, it's not yet valid
-    if block_number > current_block:
-        return None
+            batched[group_id] = batches
 
-    # If block is above highest known max, return that highest version
-    if block_number > highest_max:
-        return highest_version
+        return batched
 
-    return None  # Should not reach here
+# Create a function to get the version for a block number
+def get_version_for_block(
+    block_number: int,
+    current_block: int,
+    versions: VersionData
+) -> Optional[int]:
+    return RuntimeVersionIndex(versions).version_for_block(block_number, current_block)
 
 # def group_blocks(
 #     block_numbers: List[int],
@@ -102,7 +185,8 @@ def group_blocks(
     current_block: int,
     versions: VersionData,
     batch_size: int = 25,
-    min_batch_size: int = 10
+    min_batch_size: int = 10,
+    batch_size_for: Optional[Callable[[int], int]] = None
 ) -> Dict[int, List[List[Tuple[int, str]]]]:
     """
     Groups blocks by version and splits each group into batches.
@@ -112,31 +196,12 @@ def group_blocks(
         current_block: Current latest block.
         versions: Version boundaries for blocks.
         batch_size: Maximum number of blocks per batch (default 25).
+        batch_size_for: Optional function returning the batch size for a version, overriding batch_size.
 
     Returns:
         Dictionary mapping version number to list of block batches (each a list of ints).
     """
-    grouped: Dict[int, List[int]] = {}
-    for block_number, block_hash in block_hashes.items():
-        group = get_version_for_block(block_number, current_block, versions)
-        if group is not None:
-            grouped.setdefault(group, []).append((block_number, block_hash))
-        else:
-            logger.warning(f"Block {block_number} is outside current groupings.")
-
-    batched: Dict[int, List[List[Tuple[int, str]]]] = {}
-    for group_id, block_list in grouped.items():
-        batches: List[List[Tuple[int, str]]] = [
-            block_list[i:i + batch_size] for i in range(0, len(block_list), batch_size)
-        ]
-
-        # Merge the final batch if it's too small
-        if len(batches) > 1 and len(batches[-1]) < min_batch_size:
-            batches[-2].extend(batches.pop())  # Merge last into second-last
-
-        batched[group_id] = batches
-
-    return batched
+    return RuntimeVersionIndex(versions).group_blocks(block_hashes, current_block, batch_size, min_batch_size, batch_size_for)
 
 # Example usage
 if __name__ == "__main__":
@@ -1,53 +1,159 @@
 import asyncio
 import logging
+from collections import OrderedDict
+from typing import Any, Optional
 
+from async_substrate_interface import AsyncSubstrateInterface
+from async_substrate_interface.errors import SubstrateRequestException
+from patrol_common.block_hash_index import BlockHashIndex
+
+from patrol_mining.chain_data.archive_endpoint_router import ArchiveEndpointRouter
 from patrol_mining.chain_data.custom_async_substrate_interface import CustomAsyncSubstrateInterface
 from patrol_mining.chain_data.patrol_websocket import PatrolWebsocket
+from patrol_mining.chain_data.patrol_websocket_pool import PatrolWebsocketPool
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
 
 logger = logging.getLogger(__name__)
 
 class SubstrateClient:
-    def __init__(self, runtime_mappings: dict, network_url: str, websocket: PatrolWebsocket = None, max_retries: int = 3):
+    def __init__(
+        self,
+        runtime_mappings: dict,
+        network_url: str,
+        websocket: PatrolWebsocket | PatrolWebsocketPool | ArchiveEndpointRouter = None,
+        max_retries: int = 3,
+        connections: int = 4,
+        max_batch_size: int = 100,
+        warm_versions: int = 0,
+        fallback_urls: Optional[list[str]] = None,
+        hedge_requests: bool = False,
+        block_hash_index: Optional[BlockHashIndex] = None
+    ):
         """
         Args:
             runtime_mappings: A dict mapping group_id to runtime versions.
             network_url: The URL for the archive node.
-            keepalive_interval: Interval for keepalive pings in seconds.
+            websocket: Optional websocket (or pool) to use instead of creating one.
             max_retries: Number of times to retry a query before reinitializing the connection.
+            connections: Number of websocket connections opened to the archive node.
+            max_batch_size: Maximum number of calls sent in a single JSON-RPC batch frame.
+            warm_versions: Number of the latest runtime versions to initialize in the background on startup.
+                Other versions are initialized on first use.
+            fallback_urls: Further archive node URLs to fail over to when `network_url` is unhealthy.
+            hedge_requests: With fallback URLs, duplicate requests the preferred endpoint is slow to answer.
+            block_hash_index: Optional persistent index of finalized block hashes, consulted before the node.
         """
         self.runtime_mappings = runtime_mappings
+        # Shared block number -> runtime version lookups over runtime_mappings
+        self.runtime_index = RuntimeVersionIndex(runtime_mappings)
         self.max_retries = max_retries
         self.websocket = websocket
+        self.connections = connections
+        self.max_batch_size = max_batch_size
+        self.warm_versions = warm_versions
         self.substrate_cache = {}  # group_id -> AsyncSubstrateInterface
+        self._initializing: dict[int, asyncio.Task] = {}
+        self._warm_task = None
         self.network_url = network_url
+        self.fallback_urls = fallback_urls or []
+        self.hedge_requests = hedge_requests
+        self.block_hash_index = block_hash_index
+        self._finalized_block = None
+        # (runtime version, module, storage function, params) -> preprocessed storage request
+        self._preprocessed: OrderedDict[tuple, Any] = OrderedDict()
+        self.max_preprocessed = 4096
 
     async def initialize(self):
         """
-        Initializes the websocket connection and loads metadata instances fol all runtime versions.
+        Initializes the websocket connections. Substrate instances for each runtime version are created on
+        first use, apart from the latest `warm_versions`, which start initializing in the background.
         """
-        logger.info("Initializing websocket connection.")
+        urls = [self.network_url] + self.fallback_urls
+        logger.info(f"Initializing {self.connections} websocket connection(s) to each of {len(urls)} archive node(s).")
         if self.websocket is None:
-            self.websocket = PatrolWebsocket(
-                    self.network_url,
+            pools = [
+                PatrolWebsocketPool(
+                    url,
+                    size=self.connections,
                     shutdown_timer=300,
                     options={
                         "max_size": 2**32,
                         "write_limit": 2**16,
                     },
                 )
-        
+                for url in urls
+            ]
+            if len(pools) == 1:
+                self.websocket = pools[0]
+            else:
+                self.websocket = ArchiveEndpointRouter(pools, hedge_requests=self.hedge_requests)
+
         await self.websocket.connect(force=True)
 
-        for version, mapping in self.runtime_mappings.items():
-            logger.info(f"Initializing substrate instance for version: {version}.")
+        if self.block_hash_index is not None:
+            await self._bind_block_hash_index()
 
-            substrate = CustomAsyncSubstrateInterface(ws=self.websocket)
+        if self.warm_versions > 0:
+            latest = sorted((int(v) for v in self.runtime_mappings), reverse=True)[:self.warm_versions]
+            self._warm_task = asyncio.create_task(self._warm(latest))
 
-            await substrate.init_runtime(block_hash=mapping["block_hash_min"])
+        logger.info("Substrate client successfully initialized.")
 
-            self.substrate_cache[int(version)] = substrate
+    async def _bind_block_hash_index(self):
+        """
+        Binds the block hash index to the archive node's chain, leaving the index unused when it holds the
+        block hashes of another chain or the genesis hash could not be read.
+        """
+        try:
+            response = (await self.batch_request([("chain_getBlockHash", [[0]])]))[0]
+            if isinstance(response, Exception):
+                raise response
+            self.block_hash_index.bind(response["result"][0])
+        except Exception as e:
+            logger.warning(f"Not using the block hash index: {e}")
+            self.block_hash_index = None
 
-        logger.info("Substrate client successfully initialized.")
+    async def _warm(self, versions: list[int]):
+        for version in versions:
+            try:
+                await self.get_substrate(version)
+            except Exception as e:
+                logger.warning(f"Unable to warm substrate instance for version {version}: {e}")
+        logger.info(f"Warmed substrate instances for versions: {versions}.")
+
+    def _default_version(self) -> int:
+        return self.runtime_index.latest_version
+
+    async def get_substrate(self, runtime_version: int) -> CustomAsyncSubstrateInterface:
+        """
+        Returns the substrate instance for a runtime version, initializing it on first use.
+        Concurrent callers for a version that is still initializing share the same initialization.
+        """
+        if runtime_version in self.substrate_cache:
+            return self.substrate_cache[runtime_version]
+
+        if str(runtime_version) not in self.runtime_mappings:
+            raise Exception(f"Runtime version {runtime_version} is not known. Available versions: {list(self.runtime_mappings.keys())}")
+
+        task = self._initializing.get(runtime_version)
+        if task is None:
+            task = asyncio.create_task(self._init_substrate(runtime_version))
+            self._initializing[runtime_version] = task
+        # Shielded so a cancelled caller does not abort an initialization other callers are waiting on.
+        return await asyncio.shield(task)
+
+    async def _init_substrate(self, runtime_version: int) -> CustomAsyncSubstrateInterface:
+        try:
+            logger.info(f"Initializing substrate instance for version: {runtime_version}.")
+            mapping = self.runtime_mappings[str(runtime_version)]
+
+            substrate = CustomAsyncSubstrateInterface(ws=self.websocket)
+            await substrate.init_runtime(block_hash=mapping["block_hash_min"])
+
+            self.substrate_cache[runtime_version] = substrate
+            return substrate
+        finally:
+            self._initializing.pop(runtime_version, None)
 
     async def query(self, method_name: str, runtime_version: int = None, *args, **kwargs):
         """
@@ -65,15 +171,15 @@ class SubstrateClient:
         """
         if runtime_version is None:
             logger.debug("No runtime version provided, setting default.")
-            runtime_version = max(self.substrate_cache.keys())
+            runtime_version = self._default_version()
 
-        if runtime_version not in self.substrate_cache:
-            raise Exception(f"Runtime version {runtime_version} is not initialized. Available versions: {list(self.substrate_cache.keys())}")
+        if runtime_version not in self.substrate_cache and str(runtime_version) not in self.runtime_mappings:
+            raise Exception(f"Runtime version {runtime_version} is not known. Available versions: {list(self.runtime_mappings.keys())}")
 
         errors = []
         for attempt in range(self.max_retries):
             try:
-                substrate = self.substrate_cache[runtime_version]
+                substrate = await self.get_substrate(runtime_version)
 
                 query_func = getattr(substrate, method_name)
                 return await query_func(*args, **kwargs)
@@ -87,6 +193,272 @@ class SubstrateClient:
 
         raise Exception(f"Query failed for version {runtime_version} after reinitialization attempts. Errors: {errors}")
     
+    async def batch_request(self, calls: list[tuple[str, list]], timeout: float = 30) -> list[Any]:
+        """
+        Sends RPC calls as JSON-RPC batch frames of up to `max_batch_size` calls each.
+        A batch is retried as a whole on transport errors, while errors for individual calls are returned
+        in place of their result.
+
+        Args:
+            calls: (method, params) tuples, e.g. ("chain_getBlockHash", [3014341]).
+            timeout: Deadline in seconds for the responses to a batch.
+
+        Returns:
+            The raw JSON-RPC response for each call, in order, or the exception for calls that failed.
+        """
+        chunks = [calls[i:i + self.max_batch_size] for i in range(0, len(calls), self.max_batch_size)]
+        results = await asyncio.gather(*(self._send_batch(chunk, timeout) for chunk in chunks))
+        return [response for chunk_results in results for response in chunk_results]
+
+    async def _send_batch(self, calls: list[tuple[str, list]], timeout: float) -> list[Any]:
+        payloads = [
+            AsyncSubstrateInterface.make_payload(str(i), method, params)["payload"]
+            for i, (method, params) in enumerate(calls)
+        ]
+
+        errors = []
+        for attempt in range(self.max_retries):
+            try:
+                responses = await self.websocket.request_batch(payloads, timeout)
+                break
+            except Exception as e:
+                errors.append(e)
+                logger.warning(f"Batch request error on attempt {attempt + 1}: {e}")
+                if "429" in str(e):
+                    await asyncio.sleep(2 * (attempt + 1))
+                else:
+                    await asyncio.sleep(0.25)
+        else:
+            raise Exception(f"Batch request of {len(calls)} calls failed after {self.max_retries} attempts. Errors: {errors}")
+
+        results = []
+        for response in responses:
+            if isinstance(response, Exception):
+                results.append(response)
+            elif "error" in response:
+                results.append(SubstrateRequestException(response["error"].get("message", response["error"])))
+            else:
+                results.append(response)
+        return results
+
+    async def get_block_hashes(self, block_numbers: list[int]) -> dict[int, str | Exception]:
+        """
+        Looks up the hashes of many blocks, reading finalized blocks from the block hash index when one
+        is configured. The remaining blocks are fetched with batched array-argument chain_getBlockHash calls,
+        and those that are finalized are added to the index.
+
+        Returns:
+            A dict of block number to block hash, or to the exception raised for that block.
+        """
+        block_numbers = list(block_numbers)
+        block_hashes = self.block_hash_index.get_many(block_numbers) if self.block_hash_index else {}
+
+        missing = [n for n in block_numbers if n not in block_hashes]
+        if not missing:
+            return block_hashes
+
+        chunks = [missing[i:i + self.max_batch_size] for i in range(0, len(missing), self.max_batch_size)]
+        responses = await self.batch_request([("chain_getBlockHash", [chunk]) for chunk in chunks])
+
+        fetched = {}
+        for chunk, response in zip(chunks, responses):
+            for i, block_number in enumerate(chunk):
+                if isinstance(response, Exception):
+                    block_hashes[block_number] = response
+                elif response["result"][i] is None:
+                    block_hashes[block_number] = SubstrateRequestException(f"Block {block_number} not found")
+                else:
+                    block_hashes[block_number] = fetched[block_number] = response["result"][i]
+
+        if self.block_hash_index is not None and fetched:
+            finalized_block = await self.get_finalized_block_number(max(fetched))
+            self.block_hash_index.put_many({n: h for n, h in fetched.items() if n <= finalized_block})
+
+        return block_hashes
+
+    async def get_finalized_block_number(self, at_least: int = None) -> int:
+        """
+        Returns the number of the last finalized block, only asking the node again when the last known
+        finalized block is below `at_least`.
+        """
+        if self._finalized_block is not None and at_least is not None and at_least <= self._finalized_block:
+            return self._finalized_block
+
+        block_number, _ = await self.get_finalized_head()
+        return block_number
+
+    async def get_finalized_head(self) -> tuple[int, str]:
+        """
+        Asks the node for the last finalized block, returning its number and hash.
+        """
+        [head] = await self.batch_request([("chain_getFinalizedHead", [])])
+        if isinstance(head, Exception):
+            raise head
+        [header] = await self.batch_request([("chain_getHeader", [head["result"]])])
+        if isinstance(header, Exception):
+            raise header
+
+        self._finalized_block = int(header["result"]["number"], 16)
+        return self._finalized_block, head["result"]
+
+    async def get_block_runtime_versions(self, block_numbers: list[int]) -> dict[int, int | Exception]:
+        """
+        Looks up the runtime (spec) version each block was executed with, which is the runtime of its parent's
+        state, with batched state_getRuntimeVersion calls.
+
+        Returns:
+            A dict of block number to spec version, or to the exception raised for that block.
+        """
+        parent_hashes = await self.get_block_hashes([n - 1 for n in block_numbers])
+        resolvable = [n for n in block_numbers if not isinstance(parent_hashes[n - 1], Exception)]
+        responses = await self.batch_request([("state_getRuntimeVersion", [parent_hashes[n - 1]]) for n in resolvable])
+
+        versions = {n: parent_hashes[n - 1] for n in block_numbers if n not in resolvable}
+        for block_number, response in zip(resolvable, responses):
+            if isinstance(response, Exception):
+                versions[block_number] = response
+            else:
+                versions[block_number] = response["result"]["specVersion"]
+        return versions
+
+    async def query_batch(
+        self,
+        module: str,
+        storage_function: str,
+        params: list[Optional[list]],
+        block_hashes: list[str],
+        runtime_version: int = None,
+        response_sizes: Optional[list[int]] = None
+    ) -> list[Any]:
+        """
+        Batched equivalent of the substrate `query` method: reads a storage item for each (params, block hash)
+        pair in as few frames as possible, decoding results with the runtime of the given version.
+
+        Args:
+            response_sizes: If given, the size in bytes of each raw storage value received is appended to it.
+
+        Returns:
+            The decoded value for each pair, in order, as returned by `_make_rpc_request`,
+            or the exception raised for that pair.
+        """
+        if runtime_version is None:
+            runtime_version = self._default_version()
+
+        substrate = await self.get_substrate(runtime_version)
+
+        # Storage keys depend only on the runtime and the params, so each distinct set is preprocessed once.
+        preprocessed = {}
+        for item_params in params:
+            queryable = str(item_params)
+            if queryable not in preprocessed:
+                preprocessed[queryable] = await self._get_preprocessed(substrate, runtime_version, module, storage_function, item_params)
+
+        calls = [
+            ("state_getStorageAt", [preprocessed[str(item_params)].params[0], block_hash])
+            for item_params, block_hash in zip(params, block_hashes)
+        ]
+        responses = await self.batch_request(calls)
+
+        results = []
+        for item_params, response in zip(params, responses):
+            if isinstance(response, Exception):
+                results.append(response)
+                continue
+            if response_sizes is not None:
+                result = response.get("result")
+                if isinstance(result, str):
+                    response_sizes.append(max(0, len(result) - 2) // 2)
+                else:
+                    response_sizes.append(len(result) if result is not None else 0)
+            item = preprocessed[str(item_params)]
+            try:
+                decoded, _ = await substrate._process_response(response, None, item.value_scale_type, item.storage_item)
+                results.append(decoded)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def get_block_numbers(self, block_hashes: list[str]) -> dict[str, int | Exception]:
+        """
+        Looks up the numbers of many blocks by hash with batched chain_getHeader calls.
+
+        Returns:
+            A dict of block hash to block number, or to the exception raised for that block.
+        """
+        block_hashes = list(dict.fromkeys(block_hashes))
+        responses = await self.batch_request([("chain_getHeader", [block_hash]) for block_hash in block_hashes])
+
+        block_numbers = {}
+        for block_hash, response in zip(block_hashes, responses):
+            if isinstance(response, Exception):
+                block_numbers[block_hash] = response
+            elif response["result"] is None:
+                block_numbers[block_hash] = SubstrateRequestException(f"Block {block_hash} not found")
+            else:
+                block_numbers[block_hash] = int(response["result"]["number"], 16)
+        return block_numbers
+
+    async def query_storage_history(
+        self,
+        module: str,
+        storage_function: str,
+        params: Optional[list],
+        block_ranges: list[tuple[str, str]],
+        runtime_version: int = None
+    ) -> list[list[tuple[str, Any]] | Exception]:
+        """
+        Reads the history of a single storage item over ranges of blocks with batched state_queryStorage calls,
+        one per (from block hash, to block hash) range, sent concurrently.
+
+        Returns:
+            For each range, in order, (block hash, decoded value) for its first block and for each block in
+            it where the value changed, or the exception raised for that range.
+        """
+        if runtime_version is None:
+            runtime_version = self._default_version()
+
+        substrate = await self.get_substrate(runtime_version)
+        item = await self._get_preprocessed(substrate, runtime_version, module, storage_function, params)
+        storage_key = item.params[0]
+
+        responses = await self.batch_request([
+            ("state_queryStorage", [[storage_key], from_hash, to_hash]) for from_hash, to_hash in block_ranges
+        ])
+
+        results = []
+        for response in responses:
+            if isinstance(response, Exception):
+                results.append(response)
+                continue
+            try:
+                history = []
+                for change_set in response["result"]:
+                    # Only one key is queried, so every change is a change of it.
+                    for _, value in change_set["changes"]:
+                        decoded, _ = await substrate._process_response({"result": value}, None, item.value_scale_type, item.storage_item)
+                        history.append((change_set["block"], decoded))
+                results.append(history)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def _get_preprocessed(self, substrate, runtime_version: int, module: str, storage_function: str, params: Optional[list]):
+        """
+        Returns the preprocessed storage request (storage key, value type and storage item) for a storage
+        function and params under a runtime version, keeping the most recently used ones cached.
+        """
+        key = (runtime_version, module, storage_function, str(params))
+        preprocessed = self._preprocessed.get(key)
+        if preprocessed is not None:
+            self._preprocessed.move_to_end(key)
+            return preprocessed
+
+        preprocessed = await substrate._preprocess(params, None, storage_function, module)
+        self._preprocessed[key] = preprocessed
+        while len(self._preprocessed) > self.max_preprocessed:
+            self._preprocessed.popitem(last=False)
+        return preprocessed
+
     def return_runtime_versions(self):
         return self.runtime_mappings
 
@@ -1,15 +1,36 @@
 import asyncio
+from typing import Optional
 
+import bittensor as bt
+from async_substrate_interface.errors import SubstrateRequestException
+
+from patrol_mining.chain_data.ownership_range_cache import OwnershipHistory, OwnershipRangeCache
 from patrol_mining.chain_data.substrate_client import SubstrateClient
-from patrol_mining.chain_data.runtime_groupings import VersionData, get_version_for_block
+from patrol_mining.hotkey_ownership_index import HotkeyOwnershipIndex
 from patrol_common.protocol import Node, Edge, GraphPayload, HotkeyOwnershipEvidence
 from patrol_mining import Constants
 
 class HotkeyOwnerFinder:
 
-    def __init__(self, substrate_client: SubstrateClient):
+    def __init__(self, substrate_client: SubstrateClient, range_cache: Optional[OwnershipRangeCache] = None, search_arity: int = 16, history_chunk_blocks: int = 50000, ownership_index: Optional[HotkeyOwnershipIndex] = None):
+        """
+        Args:
+            substrate_client: The SubstrateClient used to read owners.
+            range_cache: Optional cache of the ownership history found for each hotkey.
+            search_arity: Number of parts a block range is split into at each step of the point read search.
+            history_chunk_blocks: Number of blocks covered by each state_queryStorage read of the Owner history,
+                0 to only use point reads. Point reads are also used once the archive node refuses these reads.
+            ownership_index: Optional index of ownership changes, used for the block ranges it covers.
+        """
+        if search_arity < 2:
+            raise ValueError("search_arity must be at least 2")
         self.substrate_client = substrate_client
-        self.runtime_versions = self.substrate_client.return_runtime_versions()
+        self.runtime_index = self.substrate_client.runtime_index
+        self.range_cache = range_cache
+        self.search_arity = search_arity
+        self.history_chunk_blocks = history_chunk_blocks
+        self._storage_history_supported = history_chunk_blocks > 0
+        self.ownership_index = ownership_index
 
     async def get_current_block(self) -> int:
         result = await self.substrate_client.query("get_block", None)
@@ -19,8 +40,10 @@ class HotkeyOwnerFinder:
         """
         Returns (block_number, block_hash, runtime_version_for_that_block)
         """
-        version = get_version_for_block(block_number, current_block, self.runtime_versions)
-        block_hash = await self.substrate_client.query("get_block_hash", None, block_number)
+        version = self.runtime_index.version_for_block(block_number, current_block)
+        block_hash = (await self.substrate_client.get_block_hashes([block_number]))[block_number]
+        if isinstance(block_hash, Exception):
+            raise block_hash
         return block_number, block_hash, version
 
     async def get_owner_at(self, hotkey: str, block_number: int, current_block: int = None) -> str:
@@ -40,75 +63,221 @@ class HotkeyOwnerFinder:
             block_hash=block_hash
         )
 
+    async def get_owners_at(self, hotkey: str, block_numbers: list[int], current_block: int) -> list[str]:
+        """
+        Fetches the owner at each of `block_numbers`, batching the block hash lookups and the
+        Owner reads of each runtime version into single requests.
+        """
+        block_hashes = await self.substrate_client.get_block_hashes(block_numbers)
+
+        by_version: dict[int, list[int]] = {}
+        for block_number in block_numbers:
+            version = self.runtime_index.version_for_block(block_number, current_block)
+            by_version.setdefault(version, []).append(block_number)
+
+        owners = {}
+        for version, version_blocks in by_version.items():
+            hashes = [block_hashes[n] for n in version_blocks]
+            for block_hash in hashes:
+                if isinstance(block_hash, Exception):
+                    raise block_hash
+            results = await self.substrate_client.query_batch(
+                "SubtensorModule",
+                "Owner",
+                [[hotkey]] * len(version_blocks),
+                hashes,
+                version
+            )
+            for block_number, result in zip(version_blocks, results):
+                if isinstance(result, Exception):
+                    raise result
+                owners[block_number] = result
+
+        return [owners[n] for n in block_numbers]
+
     async def _find_change_block(
         self,
         hotkey: str,
         low: int,
         high: int,
         owner_low: str,
+        owner_high: str,
         current_block: int
-    ) -> int:
+    ) -> tuple[int, str]:
         """
-        Binary‐search in (low, high] to find the *first* block where owner != owner_low.
-        Assumes that owner at high != owner_low.
-        Returns that block number.
+        K-ary search in (low, high] for the *first* block where owner != owner_low.
+        Assumes that owner at high (owner_high) != owner_low.
+        Each level reads the owners at `search_arity - 1` evenly spaced blocks in one batch
+        and narrows the range to the part that holds the change.
+        Returns that block number and the owner at it.
         """
-        # If the two are adjacent, high must be the change point
-        if low + 1 == high:
-            return high
+        while low + 1 < high:
+            probes = sorted({low + max(1, (high - low) * i // self.search_arity) for i in range(1, self.search_arity)})
+            owners = await self.get_owners_at(hotkey, probes, current_block)
 
-        mid = (low + high) // 2
-        owner_mid = await self.get_owner_at(hotkey, mid, current_block)
+            # The change is before the first probe with a different owner, or after the last probe
+            next_low = low
+            for probe, owner in zip(probes, owners):
+                if owner != owner_low:
+                    high, owner_high = probe, owner
+                    break
+                next_low = probe
+            low = next_low
 
-        if owner_mid == owner_low:
-            # change must be in (mid, high]
-            return await self._find_change_block(hotkey, mid, high, owner_low, current_block)
-        else:
-            # change is in (low, mid]
-            return await self._find_change_block(hotkey, low, mid, owner_low, current_block)
+        # The two are adjacent, high must be the change point
+        return high, owner_high
 
-    async def find_owner_ranges(
+    async def _find_changes_in_storage_history(
         self,
         hotkey: str,
-        minimum_block: int = Constants.LOWER_BLOCK_LIMIT,
-        max_block: int = None
-    ) -> GraphPayload:
+        start: int,
+        owner: str,
+        current_block: int
+    ) -> list[tuple[int, str, str]]:
         """
-        Builds a graph of hotkey ownership changes over time.
-        Returns a GraphPayload containing wallet and hotkey nodes,
-        and edges capturing ownership-change events with evidence.
+        Finds the ownership changes in (start, current_block] from the history of the hotkey's Owner storage,
+        read with one state_queryStorage call per chunk of `history_chunk_blocks` blocks, all sent concurrently.
+        Unlike the point read search, this also finds changes that were later reverted.
+        Returns (change_block, old_owner, new_owner) for each change, in block order.
         """
-        if max_block is None:
-            current_block = await self.get_current_block()
-        else:
-            current_block = max_block
-        nodes: list[Node] = []
-        edges: list[Edge] = []
+        chunks = [
+            (low, min(low + self.history_chunk_blocks - 1, current_block))
+            for low in range(start, current_block + 1, self.history_chunk_blocks)
+        ]
+        block_hashes = await self.substrate_client.get_block_hashes(sorted({n for chunk in chunks for n in chunk}))
+        for block_hash in block_hashes.values():
+            if isinstance(block_hash, Exception):
+                raise block_hash
+
+        histories = await self.substrate_client.query_storage_history(
+            "SubtensorModule",
+            "Owner",
+            [hotkey],
+            [(block_hashes[low], block_hashes[high]) for low, high in chunks],
+            self.runtime_index.version_for_block(current_block, current_block)
+        )
+
+        # Each chunk starts with the owner at its first block, so changes on chunk boundaries are seen as well
+        changed = []
+        for history in histories:
+            if isinstance(history, SubstrateRequestException):
+                # The node answered with an error, as nodes that restrict or limit state_queryStorage do
+                self._storage_history_supported = False
+            if isinstance(history, Exception):
+                raise history
+            for block_hash, new_owner in history:
+                if new_owner != owner:
+                    changed.append((block_hash, owner, new_owner))
+                    owner = new_owner
+
+        block_numbers = await self.substrate_client.get_block_numbers([block_hash for block_hash, _, _ in changed])
+        for block_number in block_numbers.values():
+            if isinstance(block_number, Exception):
+                raise block_number
+        return [(block_numbers[block_hash], old_owner, new_owner) for block_hash, old_owner, new_owner in changed]
+
+    async def _find_changes(
+        self,
+        hotkey: str,
+        start: int,
+        owner: str,
+        owner_at_head: str,
+        current_block: int
+    ) -> list[tuple[int, str, str]]:
+        """
+        Finds the ownership changes in (start, current_block], given the owners at both ends.
+        Returns (change_block, old_owner, new_owner) for each change, in block order.
+        """
+        if self.ownership_index is not None and self.ownership_index.covers(start + 1, current_block):
+            changes = self.ownership_index.changes(hotkey, start, current_block, owner)
+            # The owner the index ends with is checked against the chain, in case an ownership change was missed
+            if (changes[-1][2] if changes else owner) == owner_at_head:
+                return changes
+            bt.logging.warning(f"Ownership index disagrees with the owner of {hotkey} at block {current_block}, searching instead.")
 
-        # Initialize search
-        start = minimum_block
-        owner = await self.get_owner_at(hotkey, start, current_block)
-        nodes.append(Node(id=owner, type="wallet", origin="bittensor"))
+        if owner_at_head != owner and self._storage_history_supported:
+            try:
+                return await self._find_changes_in_storage_history(hotkey, start, owner, current_block)
+            except Exception as e:
+                bt.logging.warning(f"Unable to read the Owner history of {hotkey}, falling back to point reads: {e}")
+
+        changes = []
 
         # Walk through ownership changes until head
         while start <= current_block:
             # Check if owner at chain head changed
-            owner_at_head = await self.get_owner_at(hotkey, current_block, current_block)
             if owner_at_head == owner:
                 break
 
-            # Binary search for exact change block
-            change_block = await self._find_change_block(
+            # Search for exact change block and the new owner from it
+            change_block, new_owner = await self._find_change_block(
                 hotkey,
                 low=start,
                 high=current_block,
                 owner_low=owner,
+                owner_high=owner_at_head,
                 current_block=current_block
             )
-            # New owner from change point
-            new_owner = await self.get_owner_at(hotkey, change_block, current_block)
+            changes.append((change_block, owner, new_owner))
+
+            # Advance to next segment
+            owner = new_owner
+            start = change_block
+
+        return changes
+
+    async def _get_history(self, hotkey: str, minimum_block: int, current_block: int) -> OwnershipHistory:
+        """
+        Returns the ownership history of `hotkey` covering at least `minimum_block` to `current_block`. A cached
+        history is extended by searching only the blocks after its last verified block.
+        """
+        history = self.range_cache.get(hotkey) if self.range_cache is not None else None
+        if history is None or history.minimum_block > minimum_block:
+            # Initialize search, reading the owners at both ends of the range in one batch
+            owner, owner_at_head = await self.get_owners_at(hotkey, [minimum_block, current_block], current_block)
+            changes = await self._find_changes(hotkey, minimum_block, owner, owner_at_head, current_block)
+            history = OwnershipHistory(minimum_block, current_block, owner, changes)
+        elif history.verified_block < current_block:
+            start = history.verified_block
+            owner = history.owner_at(start)
+            owner_at_head = await self.get_owner_at(hotkey, current_block, current_block)
+            changes = await self._find_changes(hotkey, start, owner, owner_at_head, current_block)
+            history = OwnershipHistory(history.minimum_block, current_block, history.first_owner, history.changes + changes)
+        else:
+            bt.logging.debug(f"Ownership of {hotkey} up to block {current_block} served from cache.")
+            return history
+
+        if self.range_cache is not None:
+            self.range_cache.put(hotkey, history)
+        return history
+
+    async def find_owner_ranges(
+        self,
+        hotkey: str,
+        minimum_block: int = Constants.LOWER_BLOCK_LIMIT,
+        max_block: int = None
+    ) -> GraphPayload:
+        """
+        Builds a graph of hotkey ownership changes over time.
+        Returns a GraphPayload containing wallet and hotkey nodes,
+        and edges capturing ownership-change events with evidence.
+        """
+        if max_block is None:
+            current_block = await self.get_current_block()
+        else:
+            current_block = max_block
+
+        history = await self._get_history(hotkey, minimum_block, current_block)
+
+        first_owner = history.owner_at(minimum_block)
+        nodes: list[Node] = [Node(id=first_owner, type="wallet", origin="bittensor")]
+        seen = {first_owner}
+        edges: list[Edge] = []
+        for change_block, owner, new_owner in history.changes_between(minimum_block, current_block):
             # Add the new wallet node if unseen
-            nodes.append(Node(id=new_owner, type="wallet", origin="bittensor"))
+            if new_owner not in seen:
+                seen.add(new_owner)
+                nodes.append(Node(id=new_owner, type="wallet", origin="bittensor"))
 
             # Record an ownership-change edge
             edges.append(
@@ -122,14 +291,9 @@ class HotkeyOwnerFinder:
                 )
             )
 
-            # Advance to next segment
-            owner = new_owner
-            start = change_block
-
         return GraphPayload(nodes=nodes, edges=edges)
 
 
-
 if __name__ == "__main__":
     import time
     from patrol_mining.chain_data.runtime_groupings import load_versions
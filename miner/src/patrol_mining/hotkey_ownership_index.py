@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from patrol_common.paths import prepare_path
+from patrol_mining import Constants
+from patrol_mining.chain_data.event_fetcher import EventFetcher
+from patrol_mining.chain_data.event_processor import EventProcessor
+from patrol_mining.chain_data.owner_cache import to_address
+
+logger = logging.getLogger(__name__)
+
+# (hotkey, block_number, coldkey): the owner of a hotkey read at a block where its ownership may have changed.
+Observation = Tuple[str, int, str]
+
+
+class HotkeyOwnershipIndex:
+    def __init__(self, path: Optional[str] = None):
+        """
+        The owner of every hotkey at each block where it may have changed, with checkpoints of the block
+        ranges that have been scanned for such blocks.
+
+        Args:
+            path: Location of the sqlite store, or None for a memory only index.
+        """
+        path = prepare_path(path) if path else ":memory:"
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS observations ("
+            "hotkey TEXT NOT NULL, block_number INTEGER NOT NULL, coldkey TEXT NOT NULL, PRIMARY KEY (hotkey, block_number))"
+        )
+        # Blocks from start_block up to next_block (exclusive) are scanned. An open ended range has no end_block.
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ranges (start_block INTEGER PRIMARY KEY, end_block INTEGER, next_block INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        self._ranges: Dict[int, Tuple[Optional[int], int]] = {
+            start_block: (end_block, next_block)
+            for start_block, end_block, next_block in self._db.execute("SELECT start_block, end_block, next_block FROM ranges")
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+    @property
+    def ranges(self) -> List[Tuple[int, Optional[int], int]]:
+        """
+        (start_block, end_block, next_block) of each range, in block order.
+        """
+        return [(start_block, *self._ranges[start_block]) for start_block in sorted(self._ranges)]
+
+    def progress(self, start_block: int) -> Tuple[Optional[int], int]:
+        """
+        (end_block, next_block) of the range starting at `start_block`.
+        """
+        return self._ranges[start_block]
+
+    def add_ranges(self, ranges: Iterable[Tuple[int, Optional[int]]]):
+        """
+        Adds (start_block, end_block) ranges to be scanned, with end_block None for a range following the chain head.
+        """
+        ranges = [(start_block, end_block, start_block) for start_block, end_block in ranges]
+        for start_block, end_block, next_block in ranges:
+            self._ranges[start_block] = (end_block, next_block)
+        self._db.executemany("INSERT OR REPLACE INTO ranges (start_block, end_block, next_block) VALUES (?, ?, ?)", ranges)
+        self._db.commit()
+
+    def record(self, start_block: int, next_block: int, observations: List[Observation]):
+        """
+        Stores the observations found while scanning the range starting at `start_block` and moves its
+        checkpoint to `next_block`, in one transaction, so a scan resumes exactly where it stopped.
+        """
+        end_block, _ = self._ranges[start_block]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO observations (hotkey, block_number, coldkey) VALUES (?, ?, ?)", observations
+            )
+            self._db.execute("UPDATE ranges SET next_block = ? WHERE start_block = ?", (next_block, start_block))
+        self._ranges[start_block] = (end_block, next_block)
+
+    def covers(self, low: int, high: int) -> bool:
+        """
+        Whether every block from `low` to `high` inclusive has been scanned.
+        """
+        for start_block, _, next_block in self.ranges:
+            if start_block > low:
+                return False
+            if next_block > low:
+                low = next_block
+            if low > high:
+                return True
+        return False
+
+    def changes(self, hotkey: str, low: int, high: int, owner: str) -> List[Tuple[int, str, str]]:
+        """
+        Returns the ownership changes of `hotkey` in (low, high], given its owner at `low`, as
+        (change_block, old_owner, new_owner) in block order.
+        """
+        changes = []
+        for block_number, coldkey in self._db.execute(
+            "SELECT block_number, coldkey FROM observations WHERE hotkey = ? AND block_number > ? AND block_number <= ? "
+            "ORDER BY block_number",
+            (hotkey, low, high)
+        ):
+            if coldkey != owner:
+                changes.append((block_number, owner, coldkey))
+                owner = coldkey
+        return changes
+
+
+class HotkeyOwnershipIndexer:
+    def __init__(
+            self,
+            substrate_client,
+            index: Optional[HotkeyOwnershipIndex],
+            workers: int = 4,
+            chunk_blocks: int = 100,
+            poll_interval_seconds: float = 12,
+            start_block: int = Constants.LOWER_BLOCK_LIMIT,
+            max_blocks_per_second: float = 0,
+    ):
+        """
+        Fills a HotkeyOwnershipIndex from chain events. Registrations, hotkey swaps and coldkey swaps mark the
+        blocks where hotkey ownership can change, and the owners of the hotkeys involved are read at those blocks.
+
+        History from `start_block` is split into `workers` ranges scanned concurrently, each checkpointed after
+        every chunk so a restarted miner resumes them. Blocks finalized after that are followed as they arrive.
+        Scanning can be throttled, to leave the archive node capacity for answering requests.
+
+        Args:
+            substrate_client: The SubstrateClient used to fetch events and read owners.
+            index: The index to fill, or None to only use `scan_blocks`.
+            workers: Number of ranges the history is split into and scanned concurrently.
+            chunk_blocks: Number of blocks fetched, scanned and checkpointed at a time.
+            poll_interval_seconds: Time between checks for new finalized blocks once caught up.
+            start_block: First block scanned.
+            max_blocks_per_second: Limit on the number of blocks scanned per second across all ranges, 0 for none.
+        """
+        self.substrate_client = substrate_client
+        self.index = index
+        self.workers = workers
+        self.chunk_blocks = chunk_blocks
+        self.poll_interval_seconds = poll_interval_seconds
+        self.start_block = start_block
+        self.max_blocks_per_second = max_blocks_per_second
+        self._throttled_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def collect_ownership_events(events: List[Dict]) -> Tuple[set, set]:
+        """
+        Returns the hotkeys registered or swapped in a block's events, and the coldkeys that received the
+        hotkeys of a coldkey swap.
+        """
+        hotkeys = set()
+        coldkeys = set()
+        for event in events:
+            if "event" not in event:
+                continue
+            for module, event_list in event["event"].items():
+                if module != "SubtensorModule":
+                    continue
+                for item in event_list:
+                    for event_type, details in item.items():
+                        try:
+                            if event_type == "NeuronRegistered" and len(details) >= 3:
+                                hotkeys.add(EventProcessor.format_address(details[2]))
+                            elif event_type in ("HotkeySwapped", "HotkeySwappedOnSubnet") and len(details) >= 3:
+                                hotkeys.add(EventProcessor.format_address(details[1]))
+                                hotkeys.add(EventProcessor.format_address(details[2]))
+                            elif event_type == "ColdkeySwapped" and len(details) >= 2:
+                                coldkeys.add(EventProcessor.format_address(details[1]))
+                        except Exception as e:
+                            logger.warning(f"Unable to parse {event_type} event {details}: {e}")
+        return hotkeys, coldkeys
+
+    async def _read_at(self, storage_function: str, reads: List[Tuple[str, int]], head: int) -> List[Any]:
+        """
+        Reads a SubtensorModule storage item for each (key, block number) pair, batched per runtime version.
+        """
+        block_hashes = await self.substrate_client.get_block_hashes(sorted({block_number for _, block_number in reads}))
+        by_version: Dict[int, List[int]] = {}
+        for i, (_, block_number) in enumerate(reads):
+            if isinstance(block_hashes[block_number], Exception):
+                raise block_hashes[block_number]
+            version = self.substrate_client.runtime_index.version_for_block(block_number, head)
+            by_version.setdefault(version, []).append(i)
+
+        results: List[Any] = [None] * len(reads)
+        for version, indices in by_version.items():
+            values = await self.substrate_client.query_batch(
+                "SubtensorModule",
+                storage_function,
+                [[reads[i][0]] for i in indices],
+                [block_hashes[reads[i][1]] for i in indices],
+                version
+            )
+            for i, value in zip(indices, values):
+                if isinstance(value, Exception):
+                    raise value
+                results[i] = value
+        return results
+
+    async def scan_blocks(self, event_fetcher: EventFetcher, start_block: int, end_block: int, head: int) -> List[Observation]:
+        """
+        Scans blocks `start_block` to `end_block` inclusive for ownership changes, raising if any block's
+        events could not be fetched, so the chunk is retried rather than skipped.
+        """
+        block_numbers = list(range(start_block, end_block + 1))
+        events = await event_fetcher.fetch_all_events(block_numbers, batch_size=self.chunk_blocks)
+        missing = [n for n in block_numbers if n not in events]
+        if missing:
+            raise Exception(f"Unable to fetch events for blocks {missing}")
+
+        reads = []
+        swaps = []
+        for block_number in block_numbers:
+            hotkeys, coldkeys = self.collect_ownership_events(events[block_number])
+            reads.extend((hotkey, block_number) for hotkey in hotkeys)
+            swaps.extend((coldkey, block_number) for coldkey in coldkeys)
+
+        # A coldkey swap moves all hotkeys of the old coldkey, which only the new coldkey's OwnedHotkeys lists.
+        if swaps:
+            for (_, block_number), owned in zip(swaps, await self._read_at("OwnedHotkeys", swaps, head)):
+                owned = getattr(owned, "value", owned) or []
+                reads.extend((to_address(hotkey), block_number) for hotkey in owned)
+        reads = list(dict.fromkeys(reads))
+
+        if not reads:
+            return []
+        owners = await self._read_at("Owner", reads, head)
+        return [(hotkey, block_number, to_address(owner)) for (hotkey, block_number), owner in zip(reads, owners)]
+
+    async def throttle(self, blocks: int):
+        """
+        Waits for the turn of a chunk of `blocks` blocks, spacing chunks of all ranges so no more than
+        `max_blocks_per_second` blocks are scanned per second.
+        """
+        if not self.max_blocks_per_second:
+            return
+        now = time.monotonic()
+        self._throttled_until = max(self._throttled_until, now) + blocks / self.max_blocks_per_second
+        await asyncio.sleep(self._throttled_until - now)
+
+    async def scan_range(self, start_block: int):
+        """
+        Scans the range starting at `start_block` from its checkpoint, chunk by chunk. A closed range is done
+        once scanned to its end, an open ended one keeps following the finalized head.
+        """
+        # Each range has its own fetcher, as a fetcher only runs one fetch at a time.
+        event_fetcher = EventFetcher(substrate_client=self.substrate_client)
+        while True:
+            end_block, next_block = self.index.progress(start_block)
+            if end_block is not None and next_block > end_block:
+                return
+            try:
+                head = await self.substrate_client.get_finalized_block_number()
+                last_block = min(next_block + self.chunk_blocks - 1, head if end_block is None else end_block)
+                if last_block < next_block:
+                    await asyncio.sleep(self.poll_interval_seconds)
+                    continue
+                await self.throttle(last_block - next_block + 1)
+                observations = await self.scan_blocks(event_fetcher, next_block, last_block, head)
+                self.index.record(start_block, last_block + 1, observations)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Hotkey ownership indexing of blocks from {next_block} failed, retrying in {self.poll_interval_seconds}s: {e}")
+                await asyncio.sleep(self.poll_interval_seconds)
+
+    async def plan(self):
+        """
+        Splits history up to the finalized head into `workers` ranges, followed by an open ended range,
+        unless ranges were planned before.
+        """
+        if self.index.ranges:
+            return
+        head = await self.substrate_client.get_finalized_block_number()
+        size = max(1, (head - self.start_block + 1 + self.workers - 1) // self.workers)
+        ranges = [(low, min(low + size - 1, head)) for low in range(self.start_block, head + 1, size)]
+        self.index.add_ranges(ranges + [(head + 1, None)])
+        logger.info(f"Planned hotkey ownership indexing of blocks {self.start_block} to {head} in {len(ranges)} ranges.")
+
+    async def run(self):
+        while True:
+            try:
+                await self.plan()
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Planning hotkey ownership indexing failed, retrying in {self.poll_interval_seconds}s: {e}")
+                await asyncio.sleep(self.poll_interval_seconds)
+
+        await asyncio.gather(*(self.scan_range(start_block) for start_block, _, _ in self.index.ranges))
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts indexing in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -11,11 +11,19 @@ from bittensor import AsyncSubtensor
 from bittensor.utils.networking import get_external_ip
 
 from patrol_common.protocol import PatrolSynapse, HotkeyOwnershipSynapse, AlphaSellSynapse
+from patrol_common.block_hash_index import BlockHashIndex
+from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+from patrol_mining.chain_data.event_cache import EventCache
 from patrol_mining.chain_data.event_fetcher import EventFetcher
 from patrol_mining.chain_data.coldkey_finder import ColdkeyFinder
 from patrol_mining.chain_data.event_processor import EventProcessor
+from patrol_mining.chain_data.owner_cache import OwnerCache, OwnerCacheSync
+from patrol_mining.chain_data.ownership_range_cache import OwnershipRangeCache
+from patrol_mining.chain_data.runtime_discovery import RuntimeUpgradeDiscovery
 from patrol_mining.subgraph_generator import SubgraphGenerator
+from patrol_mining.transaction_index import TransactionIndex, TransactionIndexer
 from patrol_mining.chain_data.substrate_client import SubstrateClient
+from patrol_mining.hotkey_ownership_index import HotkeyOwnershipIndex, HotkeyOwnershipIndexer
 from patrol_mining.hotkey_owner_finder import HotkeyOwnerFinder
 from patrol_mining.chain_data.runtime_groupings import load_versions
 from patrol_mining.alpha_sell_predictor import AlphaSellPredictor
@@ -27,7 +35,7 @@ def get_event_loop():
     return loop
 
 class Miner:
-    def __init__(self, dev_flag: bool, wallet_path: str, coldkey: str, hotkey: str, port: int, external_ip: str, netuid: int, subtensor: AsyncSubtensor, min_stake_allowed: int, network_url: str, max_future_events: int= 50, max_past_events: int = 50, batch_size: int = 25):
+    def __init__(self, dev_flag: bool, wallet_path: str, coldkey: str, hotkey: str, port: int, external_ip: str, netuid: int, subtensor: AsyncSubtensor, min_stake_allowed: int, network_url: str, max_future_events: int= 50, max_past_events: int = 50, batch_size: int = 25, archive_node_connections: int = 4, warm_runtime_versions: int = 3, fallback_archive_node_addresses: list[str] = None, hedge_archive_requests: bool = False, block_hash_index_path: str = None, event_cache_path: str = None, event_cache_max_mb: int = 1024, batch_parameters_path: str = None, pipelined_subgraph_generation: bool = False, runtime_discovery_interval: float = 600, event_processing_workers: int = 0, owner_cache_path: str = None, owner_cache_refresh_interval: float = 3600, transaction_index_path: str = None, transaction_index_backfill_blocks: int = 50000, indexed_window_blocks: int = 1000, coldkey_search_timeout: float = 0, ownership_cache_path: str = None, ownership_search_arity: int = 16, ownership_history_chunk_blocks: int = 50000, ownership_index_path: str = None, ownership_index_workers: int = 4, ownership_index_blocks_per_second: float = 200):
         self.dev_flag = dev_flag
         self.wallet_path = wallet_path
         self.coldkey = coldkey
@@ -41,6 +49,33 @@ class Miner:
         self.max_future_events = max_future_events
         self.max_past_events = max_past_events
         self.batch_size = batch_size
+        self.archive_node_connections = archive_node_connections
+        self.warm_runtime_versions = warm_runtime_versions
+        self.fallback_archive_node_addresses = fallback_archive_node_addresses or []
+        self.hedge_archive_requests = hedge_archive_requests
+        self.block_hash_index_path = block_hash_index_path
+        self.event_cache_path = event_cache_path
+        self.event_cache_max_mb = event_cache_max_mb
+        self.batch_parameters_path = batch_parameters_path
+        self.pipelined_subgraph_generation = pipelined_subgraph_generation
+        self.runtime_discovery_interval = runtime_discovery_interval
+        self.event_processing_workers = event_processing_workers
+        self.owner_cache_path = owner_cache_path
+        self.owner_cache_refresh_interval = owner_cache_refresh_interval
+        self.owner_cache_sync = None
+        self.transaction_index_path = transaction_index_path
+        self.transaction_index_backfill_blocks = transaction_index_backfill_blocks
+        self.indexed_window_blocks = indexed_window_blocks
+        self.transaction_indexer = None
+        self.coldkey_search_timeout = coldkey_search_timeout
+        self.ownership_cache_path = ownership_cache_path
+        self.ownership_search_arity = ownership_search_arity
+        self.ownership_history_chunk_blocks = ownership_history_chunk_blocks
+        self.ownership_index_path = ownership_index_path
+        self.ownership_index_workers = ownership_index_workers
+        self.ownership_index_blocks_per_second = ownership_index_blocks_per_second
+        self.ownership_indexer = None
+        self.runtime_discovery = None
         self.subgraph_loop = get_event_loop()
         self.subgraph_generator = None
         self.hotkey_owner_finder = None
@@ -141,22 +176,64 @@ class Miner:
         try:
             versions = load_versions()
 
-            client = SubstrateClient(runtime_mappings=versions, network_url=self.network_url, max_retries=3)
+            block_hash_index = BlockHashIndex(self.block_hash_index_path) if self.block_hash_index_path else None
+
+            client = SubstrateClient(runtime_mappings=versions, network_url=self.network_url, max_retries=3, connections=self.archive_node_connections, warm_versions=self.warm_runtime_versions, fallback_urls=self.fallback_archive_node_addresses, hedge_requests=self.hedge_archive_requests, block_hash_index=block_hash_index)
             await client.initialize()
 
-            event_fetcher = EventFetcher(substrate_client=client)
-            coldkey_finder = ColdkeyFinder(substrate_client=client)
-            event_processor = EventProcessor(coldkey_finder=coldkey_finder)
-            
+            if self.runtime_discovery_interval > 0:
+                self.runtime_discovery = RuntimeUpgradeDiscovery(client, interval_seconds=self.runtime_discovery_interval)
+                self.runtime_discovery.start()
+
+            event_cache = EventCache(self.event_cache_path or None, max_disk_bytes=self.event_cache_max_mb * 2**20)
+            batch_controller = AdaptiveBatchController(self.batch_parameters_path or None, initial_batch_size=self.batch_size)
+            event_fetcher = EventFetcher(substrate_client=client, event_cache=event_cache, batch_controller=batch_controller)
+            owner_cache = OwnerCache(self.owner_cache_path or None)
+            if self.owner_cache_refresh_interval > 0:
+                self.owner_cache_sync = OwnerCacheSync(client, owner_cache, interval_seconds=self.owner_cache_refresh_interval)
+                self.owner_cache_sync.start()
+            coldkey_finder = ColdkeyFinder(substrate_client=client, owner_cache=owner_cache)
+            event_processor = EventProcessor(coldkey_finder=coldkey_finder, workers=self.event_processing_workers)
+
+            background_client = None
+            if self.transaction_index_path or self.ownership_index_path:
+                # Background indexers share a client of their own, with a single connection, so backfilling history
+                # does not compete with validator requests for the connections of the main client.
+                background_client = SubstrateClient(runtime_mappings=versions, network_url=self.network_url, max_retries=3, connections=1, fallback_urls=self.fallback_archive_node_addresses, block_hash_index=block_hash_index)
+                await background_client.initialize()
+
+            transaction_index = None
+            if self.transaction_index_path:
+                transaction_index = TransactionIndex(self.transaction_index_path)
+                # The indexer gets its own fetcher and processor, so it does not hold up requests waiting on them.
+                self.transaction_indexer = TransactionIndexer(
+                    event_fetcher=EventFetcher(substrate_client=background_client, event_cache=event_cache),
+                    event_processor=EventProcessor(coldkey_finder=ColdkeyFinder(substrate_client=background_client, owner_cache=owner_cache)),
+                    index=transaction_index,
+                    backfill_blocks=self.transaction_index_backfill_blocks
+                )
+                self.transaction_indexer.start()
+
             self.alpha_sell_predictor = AlphaSellPredictor()
             self.subgraph_generator = SubgraphGenerator(
                 event_fetcher=event_fetcher,
                 event_processor=event_processor,
                 max_future_events=self.max_future_events,
                 max_past_events=self.max_past_events,
-                batch_size=self.batch_size
+                batch_size=self.batch_size,
+                timeout=self.coldkey_search_timeout or None,
+                pipelined=self.pipelined_subgraph_generation,
+                transaction_index=transaction_index,
+                indexed_past_blocks=self.indexed_window_blocks,
+                indexed_future_blocks=self.indexed_window_blocks
             )
-            self.hotkey_owner_finder = HotkeyOwnerFinder(substrate_client=client)
+            ownership_index = None
+            if self.ownership_index_path:
+                ownership_index = HotkeyOwnershipIndex(self.ownership_index_path)
+                self.ownership_indexer = HotkeyOwnershipIndexer(background_client, ownership_index, workers=self.ownership_index_workers, max_blocks_per_second=self.ownership_index_blocks_per_second)
+                self.ownership_indexer.start()
+
+            self.hotkey_owner_finder = HotkeyOwnerFinder(substrate_client=client, range_cache=OwnershipRangeCache(self.ownership_cache_path or None), search_arity=self.ownership_search_arity, history_chunk_blocks=self.ownership_history_chunk_blocks, ownership_index=ownership_index)
             bt.logging.info("Successfully initialised, waiting for requests...")
             return True
         except Exception as e:
@@ -172,19 +249,29 @@ class Miner:
         await self.setup_axon()
 
         step = 0
-        while True:
-            try:
-                if step % 60 == 0 and not self.dev_flag:
-                    await self.metagraph.sync()
-                    bt.logging.info(f"Block: {self.metagraph.block.item()} | Incentive: {self.metagraph.I[self.my_subnet_uid]}")
-                step += 1
-                time.sleep(1)
-            except KeyboardInterrupt:
-                self.axon.stop()
-                break
-            except Exception:
-                bt.logging.debug(traceback.format_exc())
-                continue
+        try:
+            while True:
+                try:
+                    if step % 60 == 0 and not self.dev_flag:
+                        await self.metagraph.sync()
+                        bt.logging.info(f"Block: {self.metagraph.block.item()} | Incentive: {self.metagraph.I[self.my_subnet_uid]}")
+                    step += 1
+                    time.sleep(1)
+                except KeyboardInterrupt:
+                    self.axon.stop()
+                    break
+                except Exception:
+                    bt.logging.debug(traceback.format_exc())
+                    continue
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """
+        Shuts down the event processing workers, which would otherwise be left running.
+        """
+        if self.subgraph_generator is not None:
+            self.subgraph_generator.event_processor.shutdown()
 
 async def boot():
     parser = argparse.ArgumentParser()
@@ -201,6 +288,34 @@ async def boot():
     parser.add_argument('--max_future_events', type=int, default=50)
     parser.add_argument('--max_past_events', type=int, default=50)
     parser.add_argument('--event_batch_size', type=int, default=25)
+    parser.add_argument('--archive_node_connections', type=int, default=4)
+    parser.add_argument('--warm_runtime_versions', type=int, default=3)
+    parser.add_argument('--fallback_archive_node_addresses', type=str, nargs='*', default=[])
+    parser.add_argument('--hedge_archive_requests', action='store_true')
+    parser.add_argument('--block_hash_index_path', type=str, default="~/.patrol/block_hashes.bin")
+    parser.add_argument('--event_cache_path', type=str, default="~/.patrol/events.sqlite")
+    parser.add_argument('--event_cache_max_mb', type=int, default=1024)
+    parser.add_argument('--batch_parameters_path', type=str, default="~/.patrol/batch_parameters.json")
+    parser.add_argument('--pipelined_subgraph_generation', action='store_true')
+    parser.add_argument('--runtime_discovery_interval', type=float, default=600)
+    parser.add_argument(
+        '--event_processing_workers', type=int, default=0,
+        help="Opt-in: worker processes parsing the events of large block windows off the event loop. Keeps the "
+             "loop responsive, but parsing is several times slower overall unless spare CPU cores are available. "
+             "0 parses events on the event loop."
+    )
+    parser.add_argument('--owner_cache_path', type=str, default="~/.patrol/owners.sqlite")
+    parser.add_argument('--owner_cache_refresh_interval', type=float, default=3600)
+    parser.add_argument('--transaction_index_path', type=str, default="")
+    parser.add_argument('--transaction_index_backfill_blocks', type=int, default=50000)
+    parser.add_argument('--indexed_window_blocks', type=int, default=1000)
+    parser.add_argument('--coldkey_search_timeout', type=float, default=0)
+    parser.add_argument('--ownership_cache_path', type=str, default="~/.patrol/ownership_ranges.sqlite")
+    parser.add_argument('--ownership_search_arity', type=int, default=16)
+    parser.add_argument('--ownership_history_chunk_blocks', type=int, default=50000)
+    parser.add_argument('--ownership_index_path', type=str, default="")
+    parser.add_argument('--ownership_index_workers', type=int, default=4)
+    parser.add_argument('--ownership_index_blocks_per_second', type=float, default=200)
     args = parser.parse_args()
 
     async with AsyncSubtensor(network=args.subtensor_address) as subtensor:
@@ -217,7 +332,30 @@ async def boot():
             network_url=args.archive_node_address,
             max_future_events=args.max_future_events,
             max_past_events=args.max_past_events,
-            batch_size=args.event_batch_size
+            batch_size=args.event_batch_size,
+            archive_node_connections=args.archive_node_connections,
+            warm_runtime_versions=args.warm_runtime_versions,
+            fallback_archive_node_addresses=args.fallback_archive_node_addresses,
+            hedge_archive_requests=args.hedge_archive_requests,
+            block_hash_index_path=args.block_hash_index_path,
+            event_cache_path=args.event_cache_path,
+            event_cache_max_mb=args.event_cache_max_mb,
+            batch_parameters_path=args.batch_parameters_path,
+            pipelined_subgraph_generation=args.pipelined_subgraph_generation,
+            runtime_discovery_interval=args.runtime_discovery_interval,
+            event_processing_workers=args.event_processing_workers,
+            owner_cache_path=args.owner_cache_path,
+            owner_cache_refresh_interval=args.owner_cache_refresh_interval,
+            transaction_index_path=args.transaction_index_path,
+            transaction_index_backfill_blocks=args.transaction_index_backfill_blocks,
+            indexed_window_blocks=args.indexed_window_blocks,
+            coldkey_search_timeout=args.coldkey_search_timeout,
+            ownership_cache_path=args.ownership_cache_path,
+            ownership_search_arity=args.ownership_search_arity,
+            ownership_history_chunk_blocks=args.ownership_history_chunk_blocks,
+            ownership_index_path=args.ownership_index_path,
+            ownership_index_workers=args.ownership_index_workers,
+            ownership_index_blocks_per_second=args.ownership_index_blocks_per_second
         )
         await miner.run()
 
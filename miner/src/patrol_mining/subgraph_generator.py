@@ -1,13 +1,15 @@
 import time
 import asyncio
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import bittensor as bt
 
 from patrol_mining import Constants
 from patrol_mining.chain_data.event_fetcher import EventFetcher
 from patrol_mining.chain_data.event_processor import EventProcessor
-from patrol_common.protocol import GraphPayload, Node, Edge, TransferEvidence, StakeEvidence
+from patrol_mining.transaction_graph import TransactionGraph
+from patrol_mining.transaction_index import TransactionIndex
+from patrol_common.protocol import GraphPayload
 
 class SubgraphGenerator:
     
@@ -15,16 +17,29 @@ class SubgraphGenerator:
     # - _max_future_events: The number of events into the past you will collect
     # - _max_past_events: The number of events into the future you will collect
     # - _batch_size: The number of events fetched in one go from the block chain
-    # Adjust these based on your needs - higher values give higher chance of being able to find and deliver larger subgraphs, 
+    # - _pipelined: Whether fetching, processing and graph building overlap, working through events batch by batch
+    # - _queue_size: The number of batches buffered between pipeline stages
+    # - timeout: Optional time budget in seconds for collecting events. Batches of _batch_size blocks are then fetched nearest
+    #   to the target block first, and the subgraph of the batches fetched when the budget runs out is returned
+    # - _transaction_index: Optional local index of processed blocks, kept filled by a TransactionIndexer
+    # - _indexed_past_blocks / _indexed_future_blocks: The window around the target block read from the index
+    # The index combines with the other modes: indexed blocks are read from it, and the blocks it is missing are
+    # collected by the time budgeted mode when a timeout is set, otherwise by the pipeline when enabled.
+    # Adjust these based on your needs - higher values give higher chance of being able to find and deliver larger subgraphs,
     # but will require more time and resources to generate
-    
-    def __init__(self,  event_fetcher: EventFetcher, event_processor: EventProcessor, max_future_events: int = 50, max_past_events: int = 50, batch_size: int = 25, timeout=10):
+
+    def __init__(self,  event_fetcher: EventFetcher, event_processor: EventProcessor, max_future_events: int = 50, max_past_events: int = 50, batch_size: int = 25, timeout: Optional[float] = None, pipelined: bool = False, queue_size: int = 4, transaction_index: Optional[TransactionIndex] = None, indexed_past_blocks: Optional[int] = None, indexed_future_blocks: Optional[int] = None):
         self.event_fetcher = event_fetcher
         self.event_processor = event_processor
         self._max_future_events = max_future_events
         self._max_past_events = max_past_events
         self._batch_size = batch_size
         self.timeout = timeout
+        self._pipelined = pipelined
+        self._queue_size = queue_size
+        self._transaction_index = transaction_index
+        self._indexed_past_blocks = max_past_events if indexed_past_blocks is None else indexed_past_blocks
+        self._indexed_future_blocks = max_future_events if indexed_future_blocks is None else indexed_future_blocks
     
     async def generate_block_numbers(self, target_block: int, upper_block_limit: int, lower_block_limit: int = Constants.LOWER_BLOCK_LIMIT) -> List[int]:
 
@@ -35,124 +50,149 @@ class SubgraphGenerator:
 
         return list(range(start_block, end_block + 1))
 
-    def generate_adjacency_graph_from_events(self, events: List[Dict]) -> Dict:
+    def generate_adjacency_graph_from_events(self, events: List[Dict], graph: Optional[TransactionGraph] = None) -> TransactionGraph:
 
         start_time = time.time()
-        graph = {}
-
-        # Iterate over the events and add edges based on available keys.
-        # We look for 'coldkey_source', 'coldkey_destination' and 'coldkey_owner'
-        for event in events:
-            if event.get('evidence', {}).get('rao_amount') == 0:
-                continue
-            src = event.get("coldkey_source")
-            dst = event.get("coldkey_destination")
-            ownr = event.get("coldkey_owner")
-
-            connections = []
-            if src and dst:
-                connections.append((src, dst))
-                connections.append((dst, src))
-            if src and ownr:
-                connections.append((src, ownr))
-                connections.append((ownr, src))
-            if dst and ownr:
-                connections.append((dst, ownr))
-                connections.append((ownr, dst))
-
-            for a, b in connections:
-                if a not in graph:
-                    graph[a] = []
-                graph[a].append({"neighbor": b, "event": event})
+        graph = TransactionGraph() if graph is None else graph
+        self.add_events_to_adjacency_graph(graph, events)
 
         bt.logging.info(f"Adjacency graph created in {time.time() - start_time} seconds.")
         return graph
 
-    def generate_subgraph_from_adjacency_graph(self, adjacency_graph: Dict, target_address: str) -> Dict:
-        start_time = time.time()
+    @staticmethod
+    def add_events_to_adjacency_graph(graph: TransactionGraph, events: List[Dict]) -> None:
+        graph.add_events(events)
 
-        nodes = []
-        edges = []
-
-        seen_nodes = set()
-        seen_edges = set()
-        queue = [target_address]
-
-        while queue:
-            current = queue.pop(0)
-
-            if current not in seen_nodes:
-                nodes.append(
-                    Node(
-                        id=current,
-                        type="wallet",
-                        origin="bittensor"
-                    ))
-                seen_nodes.add(current)
-
-            for conn in adjacency_graph.get(current, []):
-                neighbor = conn["neighbor"]
-                event = conn["event"]
-                evidence = event['evidence']
-                edge_key = (
-                    event.get('coldkey_source'),
-                    event.get('coldkey_destination'),
-                    event.get('category'),
-                    event.get('type'),
-                    evidence.get('rao_amount'),
-                    evidence.get('block_number')
-                )
-
-                try:
-                    if edge_key not in seen_edges:
-                        seen_edges.add(edge_key)
-                        if event.get('category') == "balance":  
-                            edges.append(
-                                Edge(
-                                    coldkey_source=event['coldkey_source'],
-                                    coldkey_destination=event['coldkey_destination'],
-                                    category=event['category'],
-                                    type=event['type'],
-                                    evidence=TransferEvidence(**event['evidence'])
-                                )
-                            )
-                        elif event.get('category') == "staking":
-                            edges.append(
-                                Edge(
-                                    coldkey_source=event['coldkey_source'],
-                                    coldkey_destination=event['coldkey_destination'],
-                                    coldkey_owner=event.get('coldkey_owner'),
-                                    category=event['category'],
-                                    type=event['type'],
-                                    evidence=StakeEvidence(**event['evidence'])
-                                )
-                            )
-                except Exception as e:
-                    bt.logging.debug(f"Issue with adding edge to subgraph, skipping for now. Error: {e}")
-
-                if neighbor not in seen_nodes and neighbor not in queue:
-                    queue.append(neighbor)
-
-        subgraph_length = len(nodes) + len(edges)
-        bt.logging.info(f"Subgraph graph of length {subgraph_length} created in {time.time() - start_time} seconds.")
-
-        return GraphPayload(nodes=nodes, edges=edges)
+    def generate_subgraph_from_adjacency_graph(self, adjacency_graph: TransactionGraph, target_address: str) -> GraphPayload:
+        return adjacency_graph.subgraph(target_address)
 
 
     async def run(self, target_address:str, target_block:int, max_block_number: int):
 
+        deadline = time.monotonic() + self.timeout if self.timeout else None
         block_numbers = await self.generate_block_numbers(target_block, upper_block_limit=max_block_number)
 
+        adjacency_graph = TransactionGraph()
+        if self._transaction_index is not None:
+            block_numbers = self.add_indexed_blocks(adjacency_graph, block_numbers, target_block, max_block_number)
+            if not block_numbers:
+                return self.generate_subgraph_from_adjacency_graph(adjacency_graph, target_address)
+
+        if deadline is not None:
+            await self.grow_adjacency_graph(adjacency_graph, block_numbers, target_block, deadline)
+            return self.generate_subgraph_from_adjacency_graph(adjacency_graph, target_address)
+
+        if self._pipelined:
+            await self.generate_adjacency_graph_pipelined(block_numbers, adjacency_graph)
+            return self.generate_subgraph_from_adjacency_graph(adjacency_graph, target_address)
+
         events = await self.event_fetcher.fetch_all_events(block_numbers)
 
         processed_events = await self.event_processor.process_event_data(events)
 
-        adjacency_graph = self.generate_adjacency_graph_from_events(processed_events)
+        adjacency_graph = self.generate_adjacency_graph_from_events(processed_events, adjacency_graph)
 
         subgraph = self.generate_subgraph_from_adjacency_graph(adjacency_graph, target_address)
 
         return subgraph
 
+    async def grow_adjacency_graph(self, graph: TransactionGraph, block_numbers: List[int], target_block: int, deadline: float) -> int:
+        """
+        Adds the events of the blocks to the graph batch by batch as they are fetched, nearest to the target block
+        first, until all are added or the deadline (a time.monotonic() value) passes. At the deadline, the batches
+        still being fetched are cancelled, while those already fetched are added, so the graph only ever holds
+        the events of whole blocks.
+
+        Returns:
+            The number of blocks whose events were added.
+        """
+        fetched = asyncio.Queue()
+        added = 0
+
+        async def build_graph():
+            nonlocal added
+            while (events := await fetched.get()) is not None:
+                processed_events = await self.event_processor.process_event_data(events)
+                self.add_events_to_adjacency_graph(graph, processed_events)
+                added += len(events)
+
+        fetch = asyncio.create_task(
+            self.event_fetcher.stream_all_events(block_numbers, fetched, batch_size=self._batch_size, target_block=target_block)
+        )
+        builder = asyncio.create_task(build_graph())
+        try:
+            await asyncio.wait((fetch,), timeout=max(deadline - time.monotonic(), 0))
+            timed_out = not fetch.done()
+            fetch.cancel()
+            await asyncio.gather(fetch, return_exceptions=True)
+            # Ends the graph building once the batches fetched in time are added, however fetching ended.
+            await fetched.put(None)
+            await builder
+        finally:
+            fetch.cancel()
+            builder.cancel()
+
+        if timed_out:
+            bt.logging.warning(f"Time budget used up, continuing with the events of {added} of {len(block_numbers)} blocks.")
+        return added
+
+    def add_indexed_blocks(self, graph: TransactionGraph, block_numbers: List[int], target_block: int, max_block_number: int) -> List[int]:
+        """
+        Adds the events of the indexed blocks around the target block to the graph, using the wider indexed
+        window as far as it is available.
+
+        Returns:
+            The blocks of the regular window that are not indexed yet, to be fetched and processed as usual.
+        """
+        start_time = time.time()
+        start_block = max(target_block - self._indexed_past_blocks, Constants.LOWER_BLOCK_LIMIT)
+        end_block = min(target_block + self._indexed_future_blocks, max_block_number)
+        indexed = self._transaction_index.get_range(start_block, end_block)
+
+        for events in indexed.values():
+            self.add_events_to_adjacency_graph(graph, events)
+
+        missing = [block_number for block_number in block_numbers if block_number not in indexed]
+        if missing:
+            bt.logging.debug(f"{len(missing)} of {len(block_numbers)} blocks not indexed yet, fetching them.")
+        bt.logging.info(f"Added {len(indexed)} indexed blocks to the adjacency graph in {time.time() - start_time} seconds.")
+        return missing
+
+    async def generate_adjacency_graph_pipelined(self, block_numbers: List[int], graph: Optional[TransactionGraph] = None) -> TransactionGraph:
+        """
+        Builds the adjacency graph with fetching, event processing and graph insertion running as overlapping
+        stages, connected by bounded queues, so each batch of events moves on as soon as it is ready. Events
+        are added to `graph` when given.
+        """
+        start_time = time.time()
+        fetched = asyncio.Queue(maxsize=self._queue_size)
+        processed = asyncio.Queue(maxsize=self._queue_size)
+        graph = TransactionGraph() if graph is None else graph
+
+        async def fetch():
+            await self.event_fetcher.stream_all_events(block_numbers, fetched, batch_size=self._batch_size)
+
+        async def process():
+            while (events := await fetched.get()) is not None:
+                await processed.put(await self.event_processor.process_event_data(events))
+            await processed.put(None)
+
+        async def build_graph():
+            while (events := await processed.get()) is not None:
+                self.add_events_to_adjacency_graph(graph, events)
+
+        stages = [asyncio.create_task(stage()) for stage in (fetch, process, build_graph)]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            # A failed stage would leave the others blocked on their queues.
+            for stage in stages:
+                stage.cancel()
+            raise
+
+        bt.logging.info(f"Adjacency graph created through pipeline in {time.time() - start_time} seconds.")
+        return graph
+
 if __name__ == "__main__":
 
     from patrol_mining.chain_data.coldkey_finder import ColdkeyFinder
@@ -0,0 +1,178 @@
+import time
+from array import array
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+import bittensor as bt
+import numpy as np
+
+from patrol_common.protocol import GraphPayload, Node, Edge, TransferEvidence, StakeEvidence
+
+
+class TransactionGraph:
+    def __init__(self):
+        """
+        An undirected graph of wallets connected by transfer and staking events.
+
+        Addresses are interned to integer ids and connections are appended to flat arrays. These are
+        compacted on demand into CSR form (per-node offsets into neighbor and event id arrays), with the
+        events themselves kept in a parallel attribute table. Events that would produce the same subgraph
+        edge share a single entry in that table.
+        """
+        self._ids: Dict[str, int] = {}
+        self.addresses: List[str] = []
+        self.events: List[Dict] = []
+        self._event_ids: Dict[tuple, int] = {}
+
+        self._src = array("i")
+        self._dst = array("i")
+        self._eid = array("i")
+
+        self._offsets: Optional[np.ndarray] = None
+        self._neighbors: Optional[np.ndarray] = None
+        self._edge_ids: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._src)
+
+    def _intern(self, address: str) -> int:
+        node_id = self._ids.get(address)
+        if node_id is None:
+            node_id = self._ids[address] = len(self.addresses)
+            self.addresses.append(address)
+        return node_id
+
+    @staticmethod
+    def edge_key(event: Dict) -> tuple:
+        evidence = event['evidence']
+        return (
+            event.get('coldkey_source'),
+            event.get('coldkey_destination'),
+            event.get('category'),
+            event.get('type'),
+            evidence.get('rao_amount'),
+            evidence.get('block_number')
+        )
+
+    def add_events(self, events: Iterable[Dict]) -> None:
+        """
+        Adds a connection in each direction between the source, destination and owner coldkeys of each event.
+        """
+        for event in events:
+            if event.get('evidence', {}).get('rao_amount') == 0:
+                continue
+            src = event.get("coldkey_source")
+            dst = event.get("coldkey_destination")
+            ownr = event.get("coldkey_owner")
+
+            connections = []
+            if src and dst:
+                connections.append((src, dst))
+            if src and ownr:
+                connections.append((src, ownr))
+            if dst and ownr:
+                connections.append((dst, ownr))
+            if not connections:
+                continue
+
+            key = self.edge_key(event)
+            event_id = self._event_ids.get(key)
+            if event_id is None:
+                event_id = self._event_ids[key] = len(self.events)
+                self.events.append(event)
+
+            for a, b in connections:
+                a, b = self._intern(a), self._intern(b)
+                self._src.extend((a, b))
+                self._dst.extend((b, a))
+                self._eid.extend((event_id, event_id))
+
+        self._offsets = None
+
+    def _compact(self):
+        if self._offsets is not None:
+            return
+        src = np.frombuffer(self._src, dtype=np.int32) if len(self._src) else np.zeros(0, dtype=np.int32)
+        dst = np.frombuffer(self._dst, dtype=np.int32) if len(self._dst) else np.zeros(0, dtype=np.int32)
+        eid = np.frombuffer(self._eid, dtype=np.int32) if len(self._eid) else np.zeros(0, dtype=np.int32)
+
+        # A stable sort keeps each node's connections in the order they were added.
+        order = np.argsort(src, kind="stable")
+        self._neighbors = dst[order]
+        self._edge_ids = eid[order]
+        self._offsets = np.zeros(len(self.addresses) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(self.addresses)), out=self._offsets[1:])
+
+    def neighbors(self, address: str) -> List[str]:
+        node_id = self._ids.get(address)
+        if node_id is None:
+            return []
+        self._compact()
+        start, end = self._offsets[node_id], self._offsets[node_id + 1]
+        return [self.addresses[n] for n in self._neighbors[start:end].tolist()]
+
+    @staticmethod
+    def to_edge(event: Dict) -> Optional[Edge]:
+        if event.get('category') == "balance":
+            return Edge(
+                coldkey_source=event['coldkey_source'],
+                coldkey_destination=event['coldkey_destination'],
+                category=event['category'],
+                type=event['type'],
+                evidence=TransferEvidence(**event['evidence'])
+            )
+        elif event.get('category') == "staking":
+            return Edge(
+                coldkey_source=event['coldkey_source'],
+                coldkey_destination=event['coldkey_destination'],
+                coldkey_owner=event.get('coldkey_owner'),
+                category=event['category'],
+                type=event['type'],
+                evidence=StakeEvidence(**event['evidence'])
+            )
+        return None
+
+    def subgraph(self, target_address: str) -> GraphPayload:
+        """
+        Collects the connected component of `target_address` breadth first, with the nodes in the order they
+        are reached and each edge once.
+        """
+        start_time = time.time()
+        start = self._ids.get(target_address)
+        if start is None:
+            return GraphPayload(nodes=[Node(id=target_address, type="wallet", origin="bittensor")], edges=[])
+
+        self._compact()
+        offsets, neighbors, edge_ids = self._offsets, self._neighbors, self._edge_ids
+        visited = np.zeros(len(self.addresses), dtype=bool)
+        emitted = np.zeros(len(self.events), dtype=bool)
+
+        nodes = []
+        edges = []
+        queue = deque([start])
+        visited[start] = True
+        while queue:
+            current = queue.popleft()
+            nodes.append(Node(id=self.addresses[current], type="wallet", origin="bittensor"))
+
+            begin, end = offsets[current], offsets[current + 1]
+            for neighbor, event_id in zip(neighbors[begin:end].tolist(), edge_ids[begin:end].tolist()):
+                if not emitted[event_id]:
+                    emitted[event_id] = True
+                    try:
+                        edge = self.to_edge(self.events[event_id])
+                        if edge is not None:
+                            edges.append(edge)
+                    except Exception as e:
+                        bt.logging.debug(f"Issue with adding edge to subgraph, skipping for now. Error: {e}")
+
+                if not visited[neighbor]:
+                    visited[neighbor] = True
+                    queue.append(neighbor)
+
+        bt.logging.info(f"Subgraph graph of length {len(nodes) + len(edges)} created in {time.time() - start_time} seconds.")
+        return GraphPayload(nodes=nodes, edges=edges)
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import sqlite3
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from patrol_common.paths import prepare_path
+from patrol_mining import Constants
+from patrol_mining.chain_data.event_cache import encode_events, decode_events
+from patrol_mining.chain_data.event_fetcher import EventFetcher
+from patrol_mining.chain_data.event_processor import EventProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionIndex:
+    def __init__(self, path: Optional[str] = None):
+        """
+        The processed balance and staking events of finalized blocks, stored per block. Blocks are only
+        stored once all their events have been processed, so a stored block with no events had none.
+
+        Args:
+            path: Location of the sqlite store, or None for a memory only index.
+        """
+        path = prepare_path(path) if path else ":memory:"
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS block_edges (block_number INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+        self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM block_edges").fetchone()[0]
+
+    @property
+    def lowest_block(self) -> Optional[int]:
+        return self._db.execute("SELECT MIN(block_number) FROM block_edges").fetchone()[0]
+
+    @property
+    def highest_block(self) -> Optional[int]:
+        return self._db.execute("SELECT MAX(block_number) FROM block_edges").fetchone()[0]
+
+    def put_blocks(self, events_by_block: Dict[int, List[Dict]]):
+        """
+        Stores the processed events of each block, replacing anything stored for it before.
+        """
+        self._db.executemany(
+            "INSERT OR REPLACE INTO block_edges (block_number, data) VALUES (?, ?)",
+            [(block_number, encode_events(events)) for block_number, events in events_by_block.items()]
+        )
+        self._db.commit()
+
+    def get_range(self, start_block: int, end_block: int) -> Dict[int, List[Dict]]:
+        """
+        Returns the processed events of the stored blocks from `start_block` to `end_block` inclusive, in
+        block order, leaving out blocks that are not stored.
+        """
+        rows = self._db.execute(
+            "SELECT block_number, data FROM block_edges WHERE block_number BETWEEN ? AND ? ORDER BY block_number",
+            (start_block, end_block)
+        )
+        return {block_number: decode_events(data) for block_number, data in rows}
+
+    def missing(self, block_numbers: Iterable[int]) -> List[int]:
+        """
+        Returns the block numbers among `block_numbers` that are not stored, in order.
+        """
+        block_numbers = sorted(set(block_numbers))
+        if not block_numbers:
+            return []
+        stored = {
+            row[0] for row in self._db.execute(
+                "SELECT block_number FROM block_edges WHERE block_number BETWEEN ? AND ?",
+                (block_numbers[0], block_numbers[-1])
+            )
+        }
+        return [n for n in block_numbers if n not in stored]
+
+
+class TransactionIndexer:
+    def __init__(
+            self,
+            event_fetcher: EventFetcher,
+            event_processor: EventProcessor,
+            index: TransactionIndex,
+            backfill_blocks: int = 0,
+            chunk_blocks: int = 100,
+            poll_interval_seconds: float = 12,
+    ):
+        """
+        Fills a TransactionIndex in the background, following finalized blocks as they arrive and then
+        backfilling history, up to `backfill_blocks` below the finalized head, while it is caught up.
+
+        Args:
+            event_fetcher: EventFetcher used to fetch block events, best not shared with request handling.
+            event_processor: EventProcessor turning events into edges.
+            index: The index to fill.
+            backfill_blocks: How far below the finalized head the index is backfilled.
+            chunk_blocks: Number of blocks fetched, processed and stored at a time.
+            poll_interval_seconds: Time between checks for new finalized blocks once caught up.
+        """
+        self.event_fetcher = event_fetcher
+        self.event_processor = event_processor
+        self.index = index
+        self.backfill_blocks = backfill_blocks
+        self.chunk_blocks = chunk_blocks
+        self.poll_interval_seconds = poll_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def index_blocks(self, block_numbers: List[int]) -> int:
+        """
+        Fetches, processes and stores the events of blocks, raising if any block's events could not be fetched
+        or processed, so the chunk is retried rather than stored with gaps or with blocks missing events.
+
+        Returns:
+            The number of blocks stored.
+        """
+        events = await self.event_fetcher.fetch_all_events(block_numbers, batch_size=self.chunk_blocks)
+        missing = [n for n in block_numbers if n not in events]
+        if missing:
+            raise Exception(f"Unable to fetch events for blocks {missing}")
+
+        failed_blocks = []
+        processed = await self.event_processor.process_event_data(events, failed_blocks)
+        if failed_blocks:
+            raise Exception(f"Unable to process events of blocks {sorted(set(failed_blocks))}")
+
+        events_by_block = defaultdict(list)
+        for event in processed:
+            events_by_block[event["evidence"]["block_number"]].append(event)
+        self.index.put_blocks({block_number: events_by_block[block_number] for block_number in block_numbers})
+        return len(block_numbers)
+
+    async def step(self) -> int:
+        """
+        Indexes the next chunk of blocks, new finalized blocks first and then history.
+
+        Returns:
+            The number of blocks stored, 0 when there was nothing left to index.
+        """
+        head = await self.event_fetcher.substrate_client.get_finalized_block_number()
+        lowest_wanted = max(Constants.LOWER_BLOCK_LIMIT, head - self.backfill_blocks)
+
+        # Following the head comes first, an empty index starts from the head and is backfilled from there.
+        highest = self.index.highest_block
+        if highest is None:
+            start = max(lowest_wanted, head - self.chunk_blocks + 1)
+        else:
+            start = max(highest + 1, lowest_wanted)
+        if start <= head:
+            return await self.index_blocks(list(range(start, min(start + self.chunk_blocks, head + 1))))
+
+        lowest = self.index.lowest_block
+        if lowest is not None and lowest > lowest_wanted:
+            end = lowest - 1
+            return await self.index_blocks(list(range(max(lowest_wanted, end - self.chunk_blocks + 1), end + 1)))
+
+        return 0
+
+    async def run(self):
+        while True:
+            try:
+                if await self.step() > 0:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Transaction indexing failed, retrying in {self.poll_interval_seconds}s: {e}")
+            await asyncio.sleep(self.poll_interval_seconds)
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts indexing in the background.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
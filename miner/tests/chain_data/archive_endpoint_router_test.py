@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+
+from patrol_mining.chain_data.archive_endpoint_router import ArchiveEndpointRouter, CircuitBreaker
+
+
+class FakeEndpoint:
+    """Stands in for a PatrolWebsocketPool, answering after `delay` seconds or failing."""
+    def __init__(self, ws_url, delay=0.0, error=None, response=None, connected=True, enter_error=None):
+        self.ws_url = ws_url
+        self.delay = delay
+        self.error = error
+        self.response = response
+        self.calls = 0
+        self.last_received = 0.0
+        self.pending_requests = 0
+        self.connected = connected
+        self.enter_error = enter_error
+        self.in_use = 0
+
+    async def __aenter__(self):
+        if self.enter_error is not None:
+            raise self.enter_error
+        self.in_use += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.in_use -= 1
+
+    async def connect(self, force=False):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def request(self, payload, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.response or {"jsonrpc": "2.0", "result": self.ws_url}
+
+    async def request_batch(self, payloads, timeout=None):
+        return [await self.request(payload, timeout) for payload in payloads]
+
+
+async def test_fails_over_to_next_endpoint():
+    primary = FakeEndpoint("primary", error=ConnectionError("down"))
+    fallback = FakeEndpoint("fallback")
+    router = ArchiveEndpointRouter([primary, fallback])
+
+    response = await router.request({"method": "chain_getBlockHash", "params": [1]})
+
+    assert response["result"] == "fallback"
+    assert router.endpoints[0].breaker.consecutive_failures == 1
+
+
+async def test_open_breaker_skips_endpoint():
+    primary = FakeEndpoint("primary")
+    fallback = FakeEndpoint("fallback", error=ConnectionError("down"))
+    router = ArchiveEndpointRouter([primary, fallback], failure_threshold=2)
+    router.endpoints[0].record_failure()
+    router.endpoints[0].record_failure()
+
+    with pytest.raises(ConnectionError):
+        await router.request({"method": "system_health"})
+
+    assert router.endpoints[0].breaker.state == "open"
+    assert primary.calls == 0
+
+
+async def test_rate_limited_responses_count_as_failures():
+    limited = FakeEndpoint("limited", response={"jsonrpc": "2.0", "error": {"code": 429, "message": "Too Many Requests"}})
+    fallback = FakeEndpoint("fallback")
+    router = ArchiveEndpointRouter([limited, fallback], failure_threshold=1)
+
+    response = await router.request({"method": "system_health"})
+
+    assert response["result"] == "fallback"
+    assert router.endpoints[0].breaker.state == "open"
+
+
+async def test_slow_request_is_hedged_to_second_endpoint():
+    slow = FakeEndpoint("slow", delay=1)
+    fast = FakeEndpoint("fast")
+    router = ArchiveEndpointRouter([slow, fast], hedge_requests=True, default_hedge_delay_seconds=0.05)
+
+    response = await asyncio.wait_for(router.request({"method": "system_health"}), 0.5)
+
+    assert response["result"] == "fast"
+    assert slow.calls == 1
+
+
+async def test_send_and_retrieve_route_through_endpoints():
+    router = ArchiveEndpointRouter([FakeEndpoint("primary")])
+
+    item_id = await router.send({"method": "system_health"})
+    assert router.owns(item_id)
+
+    response = await router.retrieve(item_id)
+    assert response["result"] == "primary"
+    assert not router.owns(item_id)
+
+
+async def test_finished_request_is_kept_until_retrieved():
+    router = ArchiveEndpointRouter([FakeEndpoint("primary")], request_timeout_seconds=0.01)
+
+    item_id = await router.send({"method": "system_health"})
+    await asyncio.sleep(0.05)
+
+    assert (await router.retrieve(item_id))["result"] == "primary"
+
+
+async def test_request_past_its_timeout_raises_from_retrieve():
+    router = ArchiveEndpointRouter([FakeEndpoint("slow", delay=1)], request_timeout_seconds=0.01)
+
+    item_id = await router.send({"method": "system_health"})
+    await asyncio.sleep(0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await router.retrieve(item_id)
+    assert not router.owns(item_id)
+
+
+async def test_context_enters_only_connected_endpoints():
+    primary = FakeEndpoint("primary")
+    unreachable = FakeEndpoint("unreachable", connected=False, enter_error=ConnectionRefusedError())
+    router = ArchiveEndpointRouter([primary, unreachable])
+
+    async with router:
+        assert (primary.in_use, unreachable.in_use) == (1, 0)
+        response = await router.request({"method": "system_health"})
+
+    assert response["result"] == "primary"
+    assert primary.in_use == 0
+
+
+async def test_context_survives_an_endpoint_failing_to_connect():
+    primary = FakeEndpoint("primary", connected=False, enter_error=ConnectionRefusedError())
+    fallback = FakeEndpoint("fallback", connected=False)
+    router = ArchiveEndpointRouter([primary, fallback])
+
+    async with router:
+        pass
+
+    assert router.endpoints[0].breaker.consecutive_failures == 1
+    assert fallback.in_use == 0
+    assert not router._entered
+
+
+async def test_all_endpoints_failing_raises_last_error():
+    router = ArchiveEndpointRouter([
+        FakeEndpoint("a", error=ConnectionError("a down")),
+        FakeEndpoint("b", error=ConnectionError("b down")),
+    ])
+
+    with pytest.raises(ConnectionError):
+        await router.request({"method": "system_health"})
+
+
+async def test_half_open_endpoint_keeps_its_trial_until_used():
+    primary = FakeEndpoint("primary")
+    recovering = FakeEndpoint("recovering")
+    router = ArchiveEndpointRouter([primary, recovering], failure_threshold=1, reset_timeout_seconds=0)
+    router.endpoints[1].record_failure()
+
+    await router.request({"method": "system_health"})
+
+    # Ranking the half-open endpoint did not take its trial, so it is still let through once it is needed.
+    assert recovering.calls == 0
+    assert router.endpoints[1].breaker.available
+    primary.error = ConnectionError("down")
+    response = await router.request({"method": "system_health"})
+    assert response["result"] == "recovering"
+    assert router.endpoints[1].breaker.state == "closed"
+
+
+def test_breaker_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.available
+    assert breaker.allow_request()
+    assert not breaker.available
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
@@ -0,0 +1,57 @@
+from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+
+
+def test_fast_full_batches_grow_additively():
+    controller = AdaptiveBatchController(initial_batch_size=10, additive_increase=5)
+
+    controller.record_success(1, blocks=10, response_bytes=10_000, seconds=0.1)
+    controller.record_success(1, blocks=15, response_bytes=15_000, seconds=0.1)
+
+    assert controller.batch_size(1) == 20
+    assert controller.batch_size(2) == 10
+
+
+def test_partial_or_slow_batches_do_not_grow():
+    controller = AdaptiveBatchController(initial_batch_size=10, target_batch_seconds=1)
+
+    controller.record_success(1, blocks=3, response_bytes=100, seconds=0.1)
+    controller.record_success(1, blocks=10, response_bytes=100, seconds=1.5)
+
+    assert controller.batch_size(1) == 10
+
+
+def test_growth_is_capped_by_batch_bytes():
+    controller = AdaptiveBatchController(initial_batch_size=10, additive_increase=50, max_batch_bytes=1_000_000)
+
+    controller.record_success(1, blocks=10, response_bytes=500_000, seconds=0.1)
+
+    assert controller.batch_size(1) == 20
+
+
+def test_timeouts_halve_batch_and_extend_timeout():
+    controller = AdaptiveBatchController(initial_batch_size=40, initial_timeout=4)
+
+    controller.record_failure(1, timed_out=True)
+
+    assert controller.batch_size(1) == 20
+    assert controller.timeout(1) == 6
+
+
+def test_timeout_follows_observed_latency():
+    controller = AdaptiveBatchController(initial_batch_size=10, timeout_margin=3, min_timeout=0.5)
+
+    controller.record_success(1, blocks=10, response_bytes=100, seconds=1)
+
+    # 0.1s per block, at the grown batch size of 15 blocks, with a margin of 3.
+    assert controller.timeout(1) == 4.5
+
+
+def test_parameters_persist_across_restarts(tmp_path):
+    path = str(tmp_path / "batch_parameters.json")
+    controller = AdaptiveBatchController(path, initial_batch_size=10)
+    controller.record_failure(219)
+    controller.save(force=True)
+
+    restarted = AdaptiveBatchController(path, initial_batch_size=10)
+
+    assert restarted.batch_size(219) == 5
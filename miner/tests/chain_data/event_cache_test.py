@@ -0,0 +1,56 @@
+from patrol_mining.chain_data.event_cache import EventCache, decode_events, encode_events
+
+EVENTS = [
+    {
+        "phase": {"ApplyExtrinsic": 1},
+        "event": {"Balances": [{"Transfer": {"from": ((1, 2, 3),), "to": ((4, 5, 6),), "amount": 10**12}}]},
+        "topics": [],
+    }
+]
+
+
+def test_encoding_round_trips_tuples_and_lists():
+    decoded = decode_events(encode_events(EVENTS))
+
+    assert decoded == EVENTS
+    transfer = decoded[0]["event"]["Balances"][0]["Transfer"]
+    assert isinstance(transfer["from"], tuple) and isinstance(transfer["from"][0], tuple)
+    assert isinstance(decoded[0]["topics"], list)
+
+
+def test_events_are_served_from_disk_after_restart(tmp_path):
+    path = str(tmp_path / "events.sqlite")
+    cache = EventCache(path)
+    cache.put("0xa", EVENTS)
+    cache.close()
+
+    cache = EventCache(path)
+    assert cache.get("0xa") == EVENTS
+    assert cache.get("0xa") == EVENTS
+    assert cache.get("0xb") is None
+    assert cache.stats["disk_hits"] == 1
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["misses"] == 1
+    cache.close()
+
+
+def test_memory_tier_is_bounded():
+    cache = EventCache(memory_entries=2)
+    cache.put_many({"0xa": [], "0xb": [], "0xc": []})
+
+    assert cache.get_many(["0xa", "0xb", "0xc"]) == {"0xb": [], "0xc": []}
+
+
+def test_least_recently_used_blocks_are_evicted_past_byte_limit(tmp_path):
+    cache = EventCache(str(tmp_path / "events.sqlite"), memory_entries=0)
+    size = len(encode_events(EVENTS))
+    cache.max_disk_bytes = size * 3
+
+    for block_hash in ("0xa", "0xb", "0xc"):
+        cache.put(block_hash, EVENTS)
+    cache.get("0xa")
+    cache.put("0xd", EVENTS)
+
+    assert cache.disk_bytes <= cache.max_disk_bytes
+    assert set(cache.get_many(["0xa", "0xb", "0xc", "0xd"])) == {"0xa", "0xd"}
+    cache.close()
@@ -0,0 +1,211 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from patrol_mining.chain_data.event_fetcher import EventFetcher
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
+
+
+@pytest.fixture
+def substrate_client():
+    client = MagicMock()
+    client.get_block_hashes = AsyncMock(side_effect=lambda numbers: {n: f"hash{n}" for n in numbers})
+    client.query = AsyncMock(return_value={"header": {"number": 9999}})
+    client.get_substrate = AsyncMock()
+    client.runtime_index = RuntimeVersionIndex({
+        "1": {"block_number_min": 0, "block_number_max": 10000},
+    })
+    client.query_batch = AsyncMock(
+        side_effect=lambda module, storage, params, hashes, version, **kwargs: [f"events_{h}" for h in hashes]
+    )
+    return client
+
+
+async def test_get_block_events_reads_batch_in_one_request(substrate_client):
+    fetcher = EventFetcher(substrate_client)
+
+    events = await fetcher.get_block_events(1, [(100, "hash100"), (101, "hash101")])
+
+    assert events == {100: "events_hash100", 101: "events_hash101"}
+    substrate_client.query_batch.assert_awaited_once()
+    assert substrate_client.query_batch.await_args.args == ("System", "Events", [None, None], ["hash100", "hash101"], 1)
+
+
+async def test_get_block_events_raises_when_a_block_fails(substrate_client):
+    substrate_client.query_batch.side_effect = None
+    substrate_client.query_batch.return_value = ["events", Exception("boom")]
+    fetcher = EventFetcher(substrate_client)
+
+    with pytest.raises(Exception, match=r"\[101\]"):
+        await fetcher.get_block_events(1, [(100, "hash100"), (101, "hash101")])
+
+
+async def test_fetch_all_events_looks_up_hashes_in_batch(substrate_client):
+    fetcher = EventFetcher(substrate_client)
+
+    events = await fetcher.fetch_all_events([100, 101, 102])
+
+    assert events == {n: f"events_hash{n}" for n in (100, 101, 102)}
+    substrate_client.get_block_hashes.assert_awaited_once()
+
+
+async def test_stream_all_events_tracks_failed_hash_lookups(substrate_client):
+    substrate_client.get_block_hashes.side_effect = lambda numbers: {
+        n: (Exception("unknown block") if n == 101 else f"hash{n}") for n in numbers
+    }
+    fetcher = EventFetcher(substrate_client)
+    queue = asyncio.Queue()
+    missed_blocks = []
+
+    await fetcher.stream_all_events([100, 101], queue, missed_blocks)
+
+    assert await queue.get() == {100: "events_hash100"}
+    assert await queue.get() is None
+    assert missed_blocks == [101]
+
+
+async def test_stream_fetches_batches_nearest_to_target_first(substrate_client):
+    fetcher = EventFetcher(substrate_client)
+    queue = asyncio.Queue()
+
+    await fetcher.stream_all_events(list(range(100, 130)), queue, batch_size=10, target_block=125)
+
+    batches = []
+    while (events := await queue.get()) is not None:
+        batches.append(min(events))
+    assert batches == [120, 110, 100]
+    assert [call.args[3][0] for call in substrate_client.query_batch.await_args_list] == ["hash120", "hash110", "hash100"]
+
+
+async def test_full_stream_queue_does_not_hold_up_other_fetches(substrate_client):
+    fetcher = EventFetcher(substrate_client)
+    queue = asyncio.Queue(maxsize=1)
+    await queue.put("unconsumed")
+
+    stream = asyncio.create_task(fetcher.stream_all_events([100], queue))
+    await asyncio.sleep(0.05)
+
+    # The stream is blocked on the full queue, but fetching for another request goes ahead.
+    assert not stream.done()
+    assert await asyncio.wait_for(fetcher.fetch_all_events([200]), timeout=1) == {200: "events_hash200"}
+
+    assert await queue.get() == "unconsumed"
+    assert await queue.get() == {100: "events_hash100"}
+    assert await queue.get() is None
+    await stream
+
+
+async def test_get_block_events_serves_cached_blocks(substrate_client):
+    from patrol_mining.chain_data.event_cache import EventCache
+
+    fetcher = EventFetcher(substrate_client, event_cache=EventCache())
+    await fetcher.get_block_events(1, [(100, "hash100")])
+
+    events = await fetcher.get_block_events(1, [(100, "hash100"), (101, "hash101")])
+
+    assert events == {100: "events_hash100", 101: "events_hash101"}
+    assert substrate_client.query_batch.await_args.args[3] == ["hash101"]
+    assert fetcher.event_cache.stats["memory_hits"] == 1
+
+
+async def test_get_block_events_reports_batches_to_controller(substrate_client):
+    from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+
+    async def slow_query_batch(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    controller = AdaptiveBatchController(initial_batch_size=2, initial_timeout=0.05)
+    fetcher = EventFetcher(substrate_client, batch_controller=controller)
+
+    await fetcher.get_block_events(1, [(100, "hash100"), (101, "hash101")])
+    assert controller.batch_size(1) == 7
+
+    substrate_client.query_batch.side_effect = slow_query_batch
+    with pytest.raises(asyncio.TimeoutError):
+        await fetcher.get_block_events(1, [(102, "hash102")])
+    assert controller.batch_size(1) == 3
+
+
+async def test_runtime_initialization_is_not_timed_with_the_batch(substrate_client):
+    from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+
+    async def slow_get_substrate(runtime_version):
+        await asyncio.sleep(0.2)
+
+    substrate_client.get_substrate.side_effect = slow_get_substrate
+    controller = AdaptiveBatchController(initial_batch_size=2, initial_timeout=0.05)
+    fetcher = EventFetcher(substrate_client, batch_controller=controller)
+
+    events = await fetcher.get_block_events(1, [(100, "hash100"), (101, "hash101")])
+
+    assert events == {100: "events_hash100", 101: "events_hash101"}
+    substrate_client.get_substrate.assert_awaited_once_with(1)
+    assert controller.batch_size(1) == 7
+
+
+async def test_only_failed_blocks_of_a_batch_are_retried(substrate_client):
+    async def query_batch(module, storage, params, hashes, version, **kwargs):
+        return [Exception("pathological block") if h == "hash103" else f"events_{h}" for h in hashes]
+
+    substrate_client.query_batch.side_effect = query_batch
+    fetcher = EventFetcher(substrate_client)
+    queue = asyncio.Queue()
+    missed_blocks = []
+
+    await fetcher.stream_all_events(list(range(100, 108)), queue, missed_blocks)
+
+    events = await queue.get()
+    assert sorted(events) == [100, 101, 102, 104, 105, 106, 107]
+    assert await queue.get() is None
+    assert missed_blocks == [103]
+    # Blocks fetched with the batch are kept, only the failing block is fetched again, on its own.
+    fetched = [h for call in substrate_client.query_batch.await_args_list for h in call.args[3]]
+    assert fetched.count("hash103") == 3
+    assert fetched.count("hash100") == 1
+    assert fetched.count("hash104") == 1
+
+
+async def test_failed_batches_are_split_to_isolate_failing_blocks(substrate_client):
+    async def query_batch(module, storage, params, hashes, version, **kwargs):
+        if "hash103" in hashes:
+            raise Exception("pathological block")
+        return [f"events_{h}" for h in hashes]
+
+    substrate_client.query_batch.side_effect = query_batch
+    fetcher = EventFetcher(substrate_client)
+    queue = asyncio.Queue()
+    missed_blocks = []
+
+    await fetcher.stream_all_events(list(range(100, 108)), queue, missed_blocks)
+
+    events = await queue.get()
+    assert sorted(events) == [100, 101, 102, 104, 105, 106, 107]
+    assert await queue.get() is None
+    assert missed_blocks == [103]
+    # A batch failing as a whole is halved until the failing block is on its own. Halves that succeed are
+    # not fetched again, while blocks sharing a half with the failing block are fetched at every split.
+    fetched = [h for call in substrate_client.query_batch.await_args_list for h in call.args[3]]
+    assert fetched.count("hash103") == 6
+    assert fetched.count("hash100") == 3
+    assert fetched.count("hash104") == 2
+
+
+async def test_retries_of_parts_of_a_batch_are_not_reported_to_controller(substrate_client):
+    from patrol_mining.chain_data.batch_controller import AdaptiveBatchController
+
+    async def query_batch(module, storage, params, hashes, version, **kwargs):
+        if "hash103" in hashes:
+            raise Exception("pathological block")
+        return [f"events_{h}" for h in hashes]
+
+    substrate_client.query_batch.side_effect = query_batch
+    controller = AdaptiveBatchController(initial_batch_size=8)
+    fetcher = EventFetcher(substrate_client, batch_controller=controller)
+
+    events, failed = await fetcher._fetch_bisecting(1, [(n, f"hash{n}") for n in range(100, 108)])
+
+    assert failed == [103]
+    assert len(events) == 7
+    # Only the failure of the batch itself is counted, not those of the halves and retries that isolated the block.
+    assert controller.batch_size(1) == 4
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from bittensor.core.chain_data.utils import decode_account_id
+
+from patrol_mining.chain_data.coldkey_finder import ColdkeyFinder
+from patrol_mining.chain_data.event_processor import EventProcessor
+
+
+def account(n: int) -> tuple:
+    return (tuple([n] * 32),)
+
+
+def address(n: int) -> str:
+    return decode_account_id(account(n)[0])
+
+
+def stake_added(coldkey: int, hotkey: int, amount: int) -> dict:
+    return {"event": {"SubtensorModule": [{"StakeAdded": (account(coldkey), account(hotkey), amount, amount, 1)}]}}
+
+
+def stake_moved(coldkey: int, source_hotkey: int, destination_hotkey: int, amount: int) -> dict:
+    return {"event": {"SubtensorModule": [{"StakeMoved": (account(coldkey), account(source_hotkey), 1, account(destination_hotkey), 2, amount)}]}}
+
+
+@pytest.fixture
+def substrate_client():
+    client = MagicMock()
+    client.query_batch = AsyncMock(
+        side_effect=lambda module, storage, params, hashes: [f"owner-of-{p[0][:6]}" for p in params]
+    )
+    return client
+
+
+async def test_owners_of_all_blocks_are_resolved_in_one_batch(substrate_client):
+    processor = EventProcessor(ColdkeyFinder(substrate_client))
+    event_data = {
+        100: [stake_added(1, 2, 10), stake_added(1, 3, 20)],
+        101: [stake_moved(1, 2, 4, 30)],
+    }
+
+    events = await processor.process_event_data(event_data)
+
+    substrate_client.query_batch.assert_awaited_once()
+    module, storage, params, hashes = substrate_client.query_batch.await_args.args
+    assert (module, storage) == ("SubtensorModule", "Owner")
+    assert sorted(p[0] for p in params) == sorted([address(2), address(3), address(4)])
+    assert [e["coldkey_destination"] for e in events] == [
+        f"owner-of-{address(2)[:6]}", f"owner-of-{address(3)[:6]}", f"owner-of-{address(4)[:6]}"
+    ]
+    assert events[2]["coldkey_source"] == f"owner-of-{address(2)[:6]}"
+    assert events[2]["coldkey_owner"] == address(1)
+
+
+async def test_cached_owners_are_not_read_again(substrate_client):
+    processor = EventProcessor(ColdkeyFinder(substrate_client))
+
+    await processor.process_event_data({100: [stake_added(1, 2, 10)]})
+    await processor.process_event_data({101: [stake_added(5, 2, 10), stake_added(5, 3, 10)]})
+
+    _, _, params, _ = substrate_client.query_batch.await_args.args
+    assert params == [[address(3)]]
+
+
+async def test_events_with_unresolved_owners_are_skipped(substrate_client):
+    substrate_client.query_batch.side_effect = lambda module, storage, params, hashes: [
+        Exception("boom") if p[0] == address(3) else "owner" for p in params
+    ]
+    processor = EventProcessor(ColdkeyFinder(substrate_client))
+    transfer = {"event": {"Balances": [{"Transfer": {"from": account(7), "to": account(8), "amount": 5}}]}}
+
+    events = await processor.process_event_data({100: [stake_added(1, 2, 10), stake_added(1, 3, 20), transfer]})
+
+    assert [(e["category"], e["evidence"]["rao_amount"]) for e in events] == [("staking", 10), ("balance", 5)]
+
+
+async def test_worker_mode_matches_parsing_on_the_event_loop(substrate_client):
+    transfer = {"event": {"Balances": [{"Transfer": {"from": account(7), "to": account(8), "amount": 5}}]}}
+    legacy_add = {"event": {"SubtensorModule": [{"StakeAdded": (account(3), 40)}]}}
+    withdraw = {"event": {"Balances": [{"Withdraw": {"who": account(9), "amount": 40}}]}}
+    event_data = {
+        100 + n: [stake_added(1, n % 5, 10 + n), transfer, stake_moved(1, 2, 4, n), legacy_add, withdraw]
+        for n in range(20)
+    }
+
+    serial = await EventProcessor(ColdkeyFinder(substrate_client)).process_event_data(event_data)
+
+    processor = EventProcessor(ColdkeyFinder(substrate_client), workers=2, min_parallel_blocks=1)
+    processor._executor = ThreadPoolExecutor(2)
+    try:
+        parallel = await processor.process_event_data(event_data)
+    finally:
+        processor.shutdown()
+
+    assert parallel == serial
+    assert len(parallel) == 20 * 4
+
+
+async def test_unresolved_owner_skips_only_its_event_in_both_modes(substrate_client):
+    substrate_client.query_batch.side_effect = lambda module, storage, params, hashes: [
+        Exception("boom") if p[0] == address(3) else "owner" for p in params
+    ]
+    # One event record holding a stake of each hotkey, only one of which has a resolvable owner.
+    stakes = {"event": {"SubtensorModule": [
+        {"StakeAdded": (account(1), account(3), 20, 20, 1)},
+        {"StakeAdded": (account(1), account(2), 10, 10, 1)},
+    ]}}
+
+    serial_failed, parallel_failed = [], []
+    serial = await EventProcessor(ColdkeyFinder(substrate_client)).process_event_data({100: [stakes], 101: []}, serial_failed)
+
+    processor = EventProcessor(ColdkeyFinder(substrate_client), workers=2, min_parallel_blocks=1)
+    processor._executor = ThreadPoolExecutor(2)
+    try:
+        parallel = await processor.process_event_data({100: [stakes], 101: []}, parallel_failed)
+    finally:
+        processor.shutdown()
+
+    assert [e["evidence"]["rao_amount"] for e in serial] == [10]
+    assert parallel == serial
+    # The block is reported as not fully processed either way.
+    assert set(serial_failed) == set(parallel_failed) == {100}
+
+
+def test_legacy_stake_events_match_only_unique_amounts():
+    old_stake_events = [
+        {"type": "add", "coldkey_source": None, "coldkey_destination": "owner", "evidence": {"rao_amount": 10}},
+        {"type": "add", "coldkey_source": None, "coldkey_destination": "owner", "evidence": {"rao_amount": 20}},
+        {"type": "remove", "coldkey_source": "owner", "coldkey_destination": None, "evidence": {"rao_amount": 10}},
+        {"type": "remove", "coldkey_source": "owner", "coldkey_destination": None, "evidence": {"rao_amount": 30}},
+    ]
+    chain_operations = {
+        "withdrawal": [
+            {"coldkey_source": "A", "rao_amount": 10},
+            {"coldkey_source": "B", "rao_amount": 20},
+            {"coldkey_source": "C", "rao_amount": 20},
+        ],
+        "deposit": [{"coldkey_destination": "D", "rao_amount": 10}],
+    }
+
+    matched = EventProcessor.match_old_stake_events(old_stake_events, chain_operations)
+
+    assert [(e["type"], e["coldkey_source"], e["coldkey_destination"]) for e in matched] == [
+        ("add", "A", "owner"),
+        ("remove", "owner", "D"),
+    ]
@@ -0,0 +1,129 @@
+from unittest.mock import AsyncMock, MagicMock
+
+from bittensor.core.chain_data.utils import decode_account_id
+
+from patrol_mining.chain_data import owner_cache
+from patrol_mining.chain_data.coldkey_finder import ColdkeyFinder
+from patrol_mining.chain_data.owner_cache import OwnerCache, OwnerCacheSync
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
+
+
+def test_owners_persist_with_the_block_they_were_read_at(tmp_path):
+    path = tmp_path / "owners.sqlite"
+    cache = OwnerCache(str(path))
+    cache.put_many({"hk1": "A", "hk2": "B"}, block_number=100)
+    cache.put_many({"hk1": "C"}, block_number=90)
+    cache.mark_synced(100)
+    cache.close()
+
+    reopened = OwnerCache(str(path))
+
+    assert reopened.get_many(["hk1", "hk2", "hk3"]) == {"hk1": "A", "hk2": "B"}
+    assert reopened.block_number("hk1") == 100
+    assert reopened.synced_block == 100
+
+
+def test_sync_removes_hotkeys_missing_from_a_later_pass():
+    cache = OwnerCache()
+    cache.put_many({"hk1": "A", "hk2": "B"}, block_number=100)
+    cache.put_many({"hk3": "C"}, block_number=250)
+
+    cache.put_many({"hk1": "A"}, block_number=200)
+    cache.mark_synced(200)
+
+    assert cache.get_many(["hk1", "hk2", "hk3"]) == {"hk1": "A", "hk3": "C"}
+
+
+class FakeQueryMapResult:
+    def __init__(self, records):
+        self.records = records
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self.records:
+            yield record
+
+
+async def test_owner_map_is_streamed_into_the_cache():
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex({"1": {"block_number_min": 0, "block_number_max": 1000}})
+    client.get_finalized_head = AsyncMock(return_value=(500, "0x500"))
+    records = [(f"hk{n}", MagicMock(value=f"owner{n}")) for n in range(5)]
+    client.query = AsyncMock(return_value=FakeQueryMapResult(records))
+    cache = OwnerCache()
+
+    count = await OwnerCacheSync(client, cache, page_size=2).sync()
+
+    assert count == 5
+    assert cache.get("hk3") == "owner3"
+    assert cache.block_number("hk3") == 500
+    assert cache.synced_block == 500
+    assert client.query.await_args.args == ("query_map", 1, "SubtensorModule", "Owner")
+    assert client.query.await_args.kwargs == {"block_hash": "0x500", "page_size": 2}
+
+
+async def test_coldkey_finder_reads_only_hotkeys_missing_from_owner_cache():
+    client = MagicMock()
+    client.query_batch = AsyncMock(side_effect=lambda module, storage, params, hashes: [f"owner-{p[0]}" for p in params])
+    client.get_finalized_head = AsyncMock(return_value=(700, "0x700"))
+    cache = OwnerCache()
+    cache.put_many({"hk1": "A"}, block_number=600)
+    finder = ColdkeyFinder(client, owner_cache=cache)
+
+    owners = await finder.find_many(["hk1", "hk2"])
+
+    assert owners == {"hk1": "A", "hk2": "owner-hk2"}
+    assert client.query_batch.await_args.args[2:] == ([["hk2"]], ["0x700"])
+    assert cache.get("hk2") == "owner-hk2"
+    assert cache.block_number("hk2") == 700
+
+
+async def test_recent_cache_is_updated_from_ownership_changes(monkeypatch):
+    hotkey = (tuple([1] * 32),)
+    events = {505: [{"event": {"SubtensorModule": [{"NeuronRegistered": (1, 0, hotkey)}]}}]}
+
+    class FakeEventFetcher:
+        def __init__(self, substrate_client=None):
+            pass
+
+        async def fetch_all_events(self, block_numbers, batch_size=25):
+            return {n: events.get(n, []) for n in block_numbers}
+
+    monkeypatch.setattr(owner_cache, "EventFetcher", FakeEventFetcher)
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex({"1": {"block_number_min": 0, "block_number_max": 1000}})
+    client.get_finalized_head = AsyncMock(return_value=(510, "0x510"))
+    client.get_block_hashes = AsyncMock(side_effect=lambda numbers: {n: f"0x{n}" for n in numbers})
+    client.query_batch = AsyncMock(side_effect=lambda module, storage, params, hashes, version: ["owner1"] * len(params))
+    client.query = AsyncMock()
+    cache = OwnerCache()
+    cache.put_many({"hk0": "owner0"}, block_number=500)
+    cache.mark_synced(500)
+
+    count = await OwnerCacheSync(client, cache).sync()
+
+    assert count == 1
+    assert cache.get(decode_account_id(hotkey[0])) == "owner1"
+    assert cache.block_number(decode_account_id(hotkey[0])) == 505
+    assert cache.get("hk0") == "owner0"
+    assert cache.synced_block == 510
+    # Only the hotkey involved was read, at the block it was registered at.
+    assert client.query_batch.await_args.args[2:4] == ([[decode_account_id(hotkey[0])]], ["0x505"])
+    client.query.assert_not_awaited()
+
+
+async def test_cache_far_behind_is_refilled_from_the_owner_map():
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex({"1": {"block_number_min": 0, "block_number_max": 10000}})
+    client.get_finalized_head = AsyncMock(return_value=(9000, "0x9000"))
+    client.query = AsyncMock(return_value=FakeQueryMapResult([("hk1", MagicMock(value="owner1"))]))
+    cache = OwnerCache()
+    cache.put_many({"hk0": "owner0"}, block_number=500)
+    cache.mark_synced(500)
+
+    await OwnerCacheSync(client, cache, max_update_blocks=1000).sync()
+
+    assert cache.get_many(["hk0", "hk1"]) == {"hk1": "owner1"}
+    assert cache.synced_block == 9000
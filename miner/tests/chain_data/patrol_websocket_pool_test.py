@@ -0,0 +1,124 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from patrol_mining.chain_data.patrol_websocket_pool import PatrolWebsocketPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sent = []
+        self.replies = asyncio.Queue()
+
+    async def send(self, message, **kwargs):
+        self.sent.append(json.loads(message))
+
+    async def recv(self, decode=True):
+        return await self.replies.get()
+
+    async def close(self):
+        pass
+
+    def reply(self, item_id, result="ok"):
+        self.replies.put_nowait(json.dumps({"jsonrpc": "2.0", "id": item_id, "result": result}).encode())
+
+
+@pytest.fixture
+async def pool_and_connections():
+    connections = []
+
+    def connect(ws_url, **options):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    with patch("patrol_mining.chain_data.patrol_websocket.client.connect", new_callable=AsyncMock) as mock_connect:
+        mock_connect.side_effect = connect
+        pool = PatrolWebsocketPool("ws://example.com", size=3)
+        await pool.connect()
+        yield pool, connections
+        await pool.shutdown()
+
+
+async def test_requests_are_spread_across_least_loaded_connections(pool_and_connections):
+    pool, connections = pool_and_connections
+
+    for _ in range(6):
+        await pool.send({"method": "chain_getBlockHash", "params": [1]})
+
+    assert [len(c.sent) for c in connections] == [2, 2, 2]
+    assert pool.pending_requests == 6
+
+
+async def test_retrieve_reads_from_sending_connection(pool_and_connections):
+    pool, connections = pool_and_connections
+
+    ids = [await pool.send({"method": "chain_getBlockHash", "params": [n]}) for n in range(3)]
+    for connection in connections:
+        for payload in connection.sent:
+            connection.reply(payload["id"], payload["params"][0])
+
+    results = [(await pool.retrieve(item_id))["result"] for item_id in ids]
+    assert sorted(results) == [0, 1, 2]
+    assert pool.pending_requests == 0
+
+
+async def test_disconnected_connection_is_skipped(pool_and_connections):
+    pool, connections = pool_and_connections
+    pool.connections[0]._initialized = False
+
+    for _ in range(4):
+        await pool.send({"method": "chain_getBlockHash", "params": [1]})
+
+    assert len(connections[0].sent) == 0
+
+
+def test_pool_size_must_be_positive():
+    with pytest.raises(ValueError):
+        PatrolWebsocketPool("ws://example.com", size=0)
+
+
+async def test_forced_reconnect_only_replaces_stalled_connections(pool_and_connections):
+    pool, connections = pool_and_connections
+    for _ in range(3):
+        await pool.send({"method": "chain_getBlockHash", "params": [1]})
+    pool.connections[1].last_received -= pool.stall_seconds
+
+    pool.last_received = 0
+    await pool.connect(force=True)
+
+    # Only the stalled connection was replaced, requests in flight on the others still wait for replies.
+    assert len(connections) == 4
+    assert [c.ws for c in pool.connections] == [connections[0], connections[3], connections[2]]
+    assert [c.pending_requests for c in pool.connections] == [1, 0, 1]
+
+
+async def test_send_connects_first_when_no_connection_is_up(pool_and_connections):
+    pool, connections = pool_and_connections
+    for connection in pool.connections:
+        connection._initialized = False
+        connection.ws = None
+
+    await pool.send({"method": "chain_getBlockHash", "params": [1]})
+
+    assert len(connections) == 4
+    assert len(connections[3].sent) == 1
+
+
+async def test_entering_survives_a_connection_failing_to_connect():
+    attempts = []
+
+    def connect(ws_url, **options):
+        attempts.append(ws_url)
+        if len(attempts) == 1:
+            raise ConnectionRefusedError()
+        return FakeConnection()
+
+    with patch("patrol_mining.chain_data.patrol_websocket.client.connect", new_callable=AsyncMock) as mock_connect:
+        mock_connect.side_effect = connect
+        pool = PatrolWebsocketPool("ws://example.com", size=2)
+        async with pool:
+            assert pool.connected
+        assert [c._in_use for c in pool.connections] == [0, 0]
+        await pool.shutdown()
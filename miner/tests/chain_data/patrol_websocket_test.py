@@ -0,0 +1,225 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from patrol_mining.chain_data.patrol_websocket import PatrolWebsocket, hex_result_to_bytes
+
+
+class FakeConnection:
+    """Records sent frames and replays replies pushed by the test."""
+    def __init__(self):
+        self.sent = []
+        self.replies = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, message, **kwargs):
+        self.sent.append(json.loads(message))
+
+    async def recv(self, decode=True):
+        return await self.replies.get()
+
+    async def close(self):
+        self.closed = True
+
+    def reply(self, item_id, result="ok"):
+        self.replies.put_nowait(json.dumps({"jsonrpc": "2.0", "id": item_id, "result": result}).encode())
+
+
+@pytest.fixture
+def connection():
+    return FakeConnection()
+
+
+@pytest.fixture
+async def websocket(connection):
+    with patch("patrol_mining.chain_data.patrol_websocket.client.connect", new_callable=AsyncMock) as mock_connect:
+        mock_connect.return_value = connection
+        ws = PatrolWebsocket("ws://example.com", request_timeout_seconds=0.5, max_pending_requests=2)
+        await ws.connect()
+        yield ws
+        await ws.shutdown()
+
+
+async def test_request_resolves_when_reply_arrives(websocket, connection):
+    task = asyncio.create_task(websocket.request({"method": "chain_getBlockHash", "params": [1]}))
+    await asyncio.sleep(0)
+
+    item_id = connection.sent[0]["id"]
+    connection.reply(item_id, "0xabc")
+
+    response = await task
+    assert response["result"] == "0xabc"
+    assert websocket.pending_requests == 0
+
+
+async def test_retrieve_returns_reply_for_sent_request(websocket, connection):
+    item_id = await websocket.send({"method": "chain_getBlockHash", "params": [1]})
+    connection.reply(item_id, "0xdef")
+
+    response = await websocket.retrieve(item_id)
+    assert response["result"] == "0xdef"
+    assert websocket.pending_requests == 0
+
+
+async def test_cancelled_request_drops_late_reply(websocket, connection):
+    task = asyncio.create_task(websocket.request({"method": "chain_getBlockHash", "params": [1]}))
+    await asyncio.sleep(0)
+    item_id = connection.sent[0]["id"]
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert websocket.pending_requests == 0
+
+    connection.reply(item_id)
+    await asyncio.sleep(0.01)
+    assert websocket.pending_requests == 0
+
+
+async def test_request_times_out_at_deadline(websocket):
+    with pytest.raises(asyncio.TimeoutError):
+        await websocket.request({"method": "chain_getBlockHash", "params": [1]}, timeout=0.05)
+    assert websocket.pending_requests == 0
+
+
+async def test_uncollected_reply_expires(websocket, connection):
+    item_id = await websocket.send({"method": "chain_getBlockHash", "params": [1]})
+    connection.reply(item_id)
+    await asyncio.sleep(0.01)
+    assert websocket.pending_requests == 1
+
+    await asyncio.sleep(0.6)
+    assert websocket.pending_requests == 0
+
+
+async def test_retrieve_raises_for_expired_request(websocket):
+    waited = await websocket.send({"method": "chain_getBlockHash", "params": [1]}, timeout=0.05)
+    expired = await websocket.send({"method": "chain_getBlockHash", "params": [2]}, timeout=0.05)
+
+    # Expiring while retrieve waits for it, and before retrieve is called.
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(websocket.retrieve(waited), 1)
+    with pytest.raises(asyncio.TimeoutError):
+        await websocket.retrieve(expired)
+    # The exception is handed out once, after which the ids are no longer tracked.
+    assert not websocket.owns(waited) and not websocket.owns(expired)
+
+
+async def test_retrieve_raises_for_request_failed_by_reconnect(websocket):
+    from websockets import ConnectionClosed
+
+    item_id = await websocket.send({"method": "chain_getBlockHash", "params": [1]})
+    websocket._fail_pending(ConnectionClosed(None, None))
+
+    with pytest.raises(ConnectionClosed):
+        await websocket.retrieve(item_id)
+
+
+async def test_send_waits_for_free_slot(websocket, connection):
+    await websocket.send({"method": "a"})
+    second = await websocket.send({"method": "b"})
+
+    blocked = asyncio.create_task(websocket.send({"method": "c"}))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    connection.reply(second)
+    await websocket.retrieve(second)
+
+    await asyncio.wait_for(blocked, 1)
+    assert websocket.pending_requests == 2
+
+
+async def test_reconnects_from_receiving_task_when_connection_closes():
+    from websockets import ConnectionClosed
+
+    class ClosingConnection(FakeConnection):
+        async def recv(self, decode=True):
+            await asyncio.sleep(0.01)
+            raise ConnectionClosed(None, None)
+
+    connections = [ClosingConnection(), FakeConnection()]
+
+    with patch("patrol_mining.chain_data.patrol_websocket.client.connect", new_callable=AsyncMock) as mock_connect:
+        mock_connect.side_effect = connections
+        ws = PatrolWebsocket("ws://example.com")
+        await ws.connect()
+        pending = asyncio.create_task(ws.request({"method": "a"}))
+
+        with pytest.raises(ConnectionClosed):
+            await asyncio.wait_for(pending, 1)
+        await asyncio.sleep(0)
+        assert ws.ws is connections[1]
+        assert ws.connected
+        await ws.shutdown()
+
+
+async def test_storage_results_are_returned_as_bytes(websocket, connection):
+    task = asyncio.create_task(websocket.request({"method": "state_getStorageAt", "params": ["0x26aa", "0x01"]}))
+    await asyncio.sleep(0)
+    connection.reply(connection.sent[0]["id"], "0x0102ff")
+
+    response = await task
+    assert response["result"] == b"\x01\x02\xff"
+
+
+async def test_other_hex_results_stay_strings(websocket, connection):
+    task = asyncio.create_task(websocket.request({"method": "chain_getBlockHash", "params": [1]}))
+    await asyncio.sleep(0)
+    connection.reply(connection.sent[0]["id"], "0x0102ff")
+
+    response = await task
+    assert response["result"] == "0x0102ff"
+
+
+async def test_standard_codec_keeps_hex_strings(connection):
+    with patch("patrol_mining.chain_data.patrol_websocket.client.connect", new_callable=AsyncMock) as mock_connect:
+        mock_connect.return_value = connection
+        ws = PatrolWebsocket("ws://example.com", fast_codec=False)
+        await ws.connect()
+        task = asyncio.create_task(ws.request({"method": "state_getStorageAt", "params": ["0x26aa", "0x01"]}))
+        await asyncio.sleep(0)
+        connection.reply(connection.sent[0]["id"], "0x0102ff")
+
+        response = await task
+        assert response["result"] == "0x0102ff"
+        await ws.shutdown()
+
+
+def test_hex_result_to_bytes_falls_back_when_result_not_found_in_frame():
+    frame = b'{"jsonrpc": "2.0", "result": "0xabcd", "id": "000001"}'
+    assert hex_result_to_bytes(frame, "0xabcd") == b"\xab\xcd"
+    assert hex_result_to_bytes(b'{"result":"0xabcd"}', "0xabcd") == b"\xab\xcd"
+
+
+async def test_batch_is_sent_as_one_frame_and_demultiplexed(websocket, connection):
+    sent = []
+    original_send = connection.send
+
+    async def record_frame(message, **kwargs):
+        sent.append(json.loads(message))
+
+    connection.send = record_frame
+    task = asyncio.create_task(websocket.request_batch([
+        {"method": "chain_getBlockHash", "params": [1]},
+        {"method": "chain_getBlockHash", "params": [2]},
+    ]))
+    await asyncio.sleep(0)
+    connection.send = original_send
+
+    assert len(sent) == 1
+    frame = sent[0]
+    assert [item["params"] for item in frame] == [[1], [2]]
+
+    # Replies may come back in any order, and individual items may fail.
+    connection.replies.put_nowait(json.dumps([
+        {"jsonrpc": "2.0", "id": frame[1]["id"], "error": {"code": -32000, "message": "boom"}},
+        {"jsonrpc": "2.0", "id": frame[0]["id"], "result": "0x01"},
+    ]).encode())
+
+    first, second = await task
+    assert first["result"] == "0x01"
+    assert second["error"]["message"] == "boom"
+    assert websocket.pending_requests == 0
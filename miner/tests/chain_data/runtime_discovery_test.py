@@ -0,0 +1,68 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from patrol_mining.chain_data.runtime_discovery import RuntimeUpgradeDiscovery
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
+
+# Block number at which each runtime version took effect on the fake chain
+UPGRADES = [(0, 149), (1_000, 150), (5_321, 151), (5_322, 152)]
+
+
+def version_at(block_number: int) -> int:
+    return [version for start, version in UPGRADES if start <= block_number][-1]
+
+
+@pytest.fixture
+def substrate_client():
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex({
+        "149": {"block_number_min": 0, "block_hash_min": "0x0", "block_number_max": 999, "block_hash_max": "0x3e7"},
+        "150": {"block_number_min": 1_000, "block_hash_min": "0x3e8", "block_number_max": 2_000, "block_hash_max": "0x7d0"},
+    })
+    client.lookups = []
+
+    async def get_block_runtime_versions(block_numbers):
+        client.lookups.extend(block_numbers)
+        return {n: version_at(n) for n in block_numbers}
+
+    async def get_block_hashes(block_numbers):
+        return {n: hex(n) for n in block_numbers}
+
+    async def get_finalized_block_number(at_least=None):
+        return client.head
+
+    client.get_block_runtime_versions = get_block_runtime_versions
+    client.get_block_hashes = get_block_hashes
+    client.get_finalized_block_number = get_finalized_block_number
+    return client
+
+
+async def test_discover_finds_exact_upgrade_blocks(substrate_client):
+    substrate_client.head = 1_000_000
+    discovery = RuntimeUpgradeDiscovery(substrate_client)
+
+    assert await discovery.discover() == [151, 152]
+
+    index = substrate_client.runtime_index
+    assert index.versions["150"]["block_number_max"] == 5_320
+    assert index.versions["151"] == {
+        "block_number_min": 5_321, "block_hash_min": hex(5_321), "block_number_max": 5_321, "block_hash_max": hex(5_321),
+    }
+    assert index.versions["152"]["block_number_min"] == 5_322
+    assert index.versions["152"]["block_number_max"] == 1_000_000
+    assert [index.version_for_block(n, 1_000_000) for n in (5_320, 5_321, 5_322)] == [150, 151, 152]
+    # Binary search needs about log2(998_000) lookups per upgrade
+    assert len(substrate_client.lookups) < 50
+
+
+async def test_discover_extends_last_range_without_upgrades(substrate_client):
+    substrate_client.head = 3_000
+    discovery = RuntimeUpgradeDiscovery(substrate_client)
+
+    assert await discovery.discover() == []
+    assert substrate_client.runtime_index.versions["150"]["block_number_max"] == 3_000
+    assert substrate_client.lookups == [3_000]
+
+    assert await discovery.discover() == []
+    assert substrate_client.lookups == [3_000]
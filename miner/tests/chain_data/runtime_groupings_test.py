@@ -0,0 +1,64 @@
+import pytest
+
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex, group_blocks, load_versions
+
+VERSIONS = {
+    "1": {"block_number_min": 100, "block_number_max": 199},
+    "2": {"block_number_min": 200, "block_number_max": 299},
+    # gap between 300 and 399
+    "3": {"block_number_min": 400, "block_number_max": 499},
+}
+
+
+@pytest.mark.parametrize("block_number, expected", [
+    (99, None),
+    (100, 1),
+    (199, 1),
+    (200, 2),
+    (350, None),
+    (499, 3),
+    (600, 3),
+    (1001, None),
+])
+def test_version_for_block(block_number, expected):
+    index = RuntimeVersionIndex(VERSIONS)
+
+    assert index.version_for_block(block_number, current_block=1000) == expected
+
+
+def test_group_blocks_partitions_runs_of_each_version():
+    index = RuntimeVersionIndex(VERSIONS)
+    block_hashes = {n: f"0x{n}" for n in [450, 150, 250, 151, 350, 700, 2000]}
+
+    grouped = index.group_blocks(block_hashes, current_block=1000, batch_size=2, min_batch_size=1)
+
+    assert grouped == {
+        1: [[(150, "0x150"), (151, "0x151")]],
+        2: [[(250, "0x250")]],
+        3: [[(450, "0x450"), (700, "0x700")]],
+    }
+
+
+def test_add_version_extends_the_index():
+    index = RuntimeVersionIndex({k: dict(v) for k, v in VERSIONS.items()})
+    index.versions["3"]["block_number_max"] = 549
+    index.add_version(4, {"block_number_min": 550, "block_number_max": 599})
+
+    assert index.version_for_block(560, current_block=1000) == 4
+    assert index.version_for_block(700, current_block=1000) == 4
+    assert index.latest_version == 4
+
+
+def test_index_matches_bundled_runtime_versions():
+    versions = load_versions()
+    index = RuntimeVersionIndex(versions)
+    current_block = max(b["block_number_max"] for b in versions.values()) + 1000
+    block_hashes = {n: str(n) for n in range(3_000_000, current_block + 10, 997)}
+
+    grouped = group_blocks(block_hashes, current_block, versions, batch_size=10_000)
+
+    for version, batches in grouped.items():
+        for block_number, _ in batches[0]:
+            assert index.version_for_block(block_number, current_block) == version
+            bounds = versions.get(str(version))
+            assert bounds["block_number_min"] <= block_number <= bounds["block_number_max"] or version == index.highest_version
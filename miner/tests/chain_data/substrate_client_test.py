@@ -0,0 +1,282 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from async_substrate_interface.errors import SubstrateRequestException
+
+from patrol_mining.chain_data.substrate_client import SubstrateClient
+
+
+@pytest.fixture
+def websocket():
+    ws = MagicMock()
+
+    async def request_batch(payloads, timeout=None):
+        return [{"jsonrpc": "2.0", "result": f"0x{p['params'][0]:x}"} for p in payloads]
+
+    ws.request_batch = AsyncMock(side_effect=request_batch)
+    return ws
+
+
+async def test_batch_request_splits_calls_into_frames(websocket):
+    client = SubstrateClient({}, "wss://mock", websocket=websocket, max_batch_size=2)
+
+    results = await client.batch_request([("chain_getBlockHash", [n]) for n in range(5)])
+
+    assert [r["result"] for r in results] == ["0x0", "0x1", "0x2", "0x3", "0x4"]
+    assert [len(call.args[0]) for call in websocket.request_batch.await_args_list] == [2, 2, 1]
+
+
+async def test_batch_request_returns_item_errors_in_place(websocket):
+    async def request_batch(payloads, timeout=None):
+        return [{"jsonrpc": "2.0", "result": "0x1"}, {"jsonrpc": "2.0", "error": {"code": 1, "message": "Unknown block"}}]
+
+    websocket.request_batch.side_effect = request_batch
+    client = SubstrateClient({}, "wss://mock", websocket=websocket)
+
+    ok, failed = await client.batch_request([("chain_getBlockHash", [1]), ("chain_getBlockHash", [2])])
+
+    assert ok["result"] == "0x1"
+    assert isinstance(failed, SubstrateRequestException)
+    assert websocket.request_batch.await_count == 1
+
+
+async def test_batch_request_retries_transport_errors(websocket):
+    responses = [[{"jsonrpc": "2.0", "result": "0x1"}]]
+
+    async def request_batch(payloads, timeout=None):
+        if websocket.request_batch.await_count == 1:
+            raise ConnectionError("reset")
+        return responses.pop()
+
+    websocket.request_batch.side_effect = request_batch
+    client = SubstrateClient({}, "wss://mock", websocket=websocket)
+
+    results = await client.batch_request([("chain_getBlockHash", [1])])
+
+    assert results[0]["result"] == "0x1"
+    assert websocket.request_batch.await_count == 2
+
+
+def chain_node(finalized_block: int):
+    """A request_batch handler answering block hash and finalized head calls like an archive node."""
+    async def request_batch(payloads, timeout=None):
+        responses = []
+        for p in payloads:
+            if p["method"] == "chain_getBlockHash":
+                result = [f"0x{n:064x}" if n <= finalized_block + 10 else None for n in p["params"][0]]
+            elif p["method"] == "chain_getFinalizedHead":
+                result = "0xhead"
+            else:
+                result = {"number": hex(finalized_block)}
+            responses.append({"jsonrpc": "2.0", "result": result})
+        return responses
+
+    return request_batch
+
+
+async def test_get_block_hashes_uses_array_arguments(websocket):
+    websocket.request_batch.side_effect = chain_node(100)
+    client = SubstrateClient({}, "wss://mock", websocket=websocket, max_batch_size=2)
+
+    block_hashes = await client.get_block_hashes([10, 11, 12, 200])
+
+    assert block_hashes[10] == f"0x{10:064x}"
+    assert block_hashes[12] == f"0x{12:064x}"
+    assert isinstance(block_hashes[200], SubstrateRequestException)
+    sent = websocket.request_batch.await_args.args[0]
+    assert [p["params"] for p in sent] == [[[10, 11]], [[12, 200]]]
+
+
+async def test_get_block_hashes_indexes_finalized_blocks_only(websocket, tmp_path):
+    from patrol_common.block_hash_index import BlockHashIndex
+
+    websocket.request_batch.side_effect = chain_node(100)
+    with BlockHashIndex(str(tmp_path / "hashes.bin")) as index:
+        client = SubstrateClient({}, "wss://mock", websocket=websocket, block_hash_index=index)
+
+        await client.get_block_hashes([99, 105])
+        assert index.get(99) == f"0x{99:064x}"
+        assert index.get(105) is None
+
+        websocket.request_batch.reset_mock()
+        assert await client.get_block_hashes([99]) == {99: f"0x{99:064x}"}
+        websocket.request_batch.assert_not_awaited()
+
+
+async def test_query_batch_preprocesses_each_storage_key_once(websocket):
+    substrate = MagicMock()
+    preprocessed = MagicMock(params=["0xkey"], value_scale_type="scale_info::0", storage_item="item")
+    substrate._preprocess = AsyncMock(return_value=preprocessed)
+    substrate._process_response = AsyncMock(side_effect=lambda response, *args: (f"owner-{response['result']}", True))
+
+    async def request_batch(payloads, timeout=None):
+        return [{"jsonrpc": "2.0", "result": p["params"][1]} for p in payloads]
+
+    websocket.request_batch.side_effect = request_batch
+    client = SubstrateClient({"1": {"block_number_min": 0, "block_number_max": 99}}, "wss://mock", websocket=websocket)
+    client.substrate_cache = {1: substrate}
+
+    owners = await client.query_batch("SubtensorModule", "Owner", [["hk"], ["hk"]], ["0xa", "0xb"], 1)
+
+    assert owners == ["owner-0xa", "owner-0xb"]
+    substrate._preprocess.assert_awaited_once_with(["hk"], None, "Owner", "SubtensorModule")
+    sent = websocket.request_batch.await_args.args[0]
+    assert [p["params"] for p in sent] == [["0xkey", "0xa"], ["0xkey", "0xb"]]
+
+    await client.query_batch("SubtensorModule", "Owner", [["hk"]], ["0xc"], 1)
+    substrate._preprocess.assert_awaited_once()
+
+
+async def test_query_storage_history_decodes_changes_of_each_range(websocket):
+    substrate = MagicMock()
+    preprocessed = MagicMock(params=["0xkey"], value_scale_type="scale_info::0", storage_item="item")
+    substrate._preprocess = AsyncMock(return_value=preprocessed)
+    substrate._process_response = AsyncMock(side_effect=lambda response, *args: (f"owner-{response['result']}", True))
+
+    async def request_batch(payloads, timeout=None):
+        responses = []
+        for p in payloads:
+            if p["params"][1] == "0xbad":
+                responses.append({"jsonrpc": "2.0", "error": {"message": "Method not found"}})
+            else:
+                changes = [{"block": block, "changes": [["0xkey", f"0x{block[2:]}0"]]} for block in p["params"][1:]]
+                responses.append({"jsonrpc": "2.0", "result": changes})
+        return responses
+
+    websocket.request_batch.side_effect = request_batch
+    client = SubstrateClient({"1": {"block_number_min": 0, "block_number_max": 99}}, "wss://mock", websocket=websocket)
+    client.substrate_cache = {1: substrate}
+
+    histories = await client.query_storage_history("SubtensorModule", "Owner", ["hk"], [("0xa", "0xb"), ("0xbad", "0xc")], 1)
+
+    assert histories[0] == [("0xa", "owner-0xa0"), ("0xb", "owner-0xb0")]
+    assert isinstance(histories[1], SubstrateRequestException)
+    sent = websocket.request_batch.await_args.args[0]
+    assert [(p["method"], p["params"]) for p in sent] == [
+        ("state_queryStorage", [["0xkey"], "0xa", "0xb"]), ("state_queryStorage", [["0xkey"], "0xbad", "0xc"])
+    ]
+
+
+RUNTIME_MAPPINGS = {
+    "149": {"block_number_min": 0, "block_number_max": 99, "block_hash_min": "0x149"},
+    "150": {"block_number_min": 100, "block_number_max": 199, "block_hash_min": "0x150"},
+    "151": {"block_number_min": 200, "block_number_max": 299, "block_hash_min": "0x151"},
+}
+
+
+@pytest.fixture
+def substrate_cls():
+    with patch("patrol_mining.chain_data.substrate_client.CustomAsyncSubstrateInterface") as cls:
+        async def init_runtime(block_hash):
+            await asyncio.sleep(0.01)
+
+        cls.side_effect = lambda ws: MagicMock(init_runtime=AsyncMock(side_effect=init_runtime))
+        yield cls
+
+
+async def test_initialize_does_not_load_runtimes(substrate_cls, websocket):
+    websocket.connect = AsyncMock()
+    client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket)
+
+    await client.initialize()
+
+    assert client.substrate_cache == {}
+    substrate_cls.assert_not_called()
+
+
+async def test_initialize_connects_a_websocket_pool(substrate_cls):
+    with patch("patrol_mining.chain_data.substrate_client.PatrolWebsocketPool") as pool_cls:
+        pool_cls.return_value.connect = AsyncMock()
+        client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", connections=2)
+
+        await client.initialize()
+
+    pool_cls.assert_called_once_with("wss://mock", size=2, shutdown_timer=300, options={"max_size": 2**32, "write_limit": 2**16})
+    assert client.websocket is pool_cls.return_value
+    client.websocket.connect.assert_awaited_once_with(force=True)
+
+
+async def test_initialize_binds_the_block_hash_index_to_the_chain(substrate_cls, websocket, tmp_path):
+    from patrol_common.block_hash_index import BlockHashIndex
+
+    genesis_hash = "0x" + "12" * 32
+    websocket.connect = AsyncMock()
+    websocket.request_batch.side_effect = lambda payloads, timeout=None: [{"jsonrpc": "2.0", "result": [genesis_hash]}]
+    with BlockHashIndex(str(tmp_path / "hashes.bin")) as index:
+        client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket, block_hash_index=index)
+        await client.initialize()
+
+        assert websocket.request_batch.await_args.args[0][0]["params"] == [[0]]
+        assert index.genesis_hash == genesis_hash
+        assert client.block_hash_index is index
+
+
+async def test_block_hash_index_of_another_chain_is_left_unused(substrate_cls, websocket, tmp_path):
+    from patrol_common.block_hash_index import BlockHashIndex
+
+    websocket.connect = AsyncMock()
+    websocket.request_batch.side_effect = chain_node(100)
+    with BlockHashIndex(str(tmp_path / "hashes.bin")) as index:
+        index.bind("0x" + "ab" * 32)
+        client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket, block_hash_index=index)
+        await client.initialize()
+
+        assert client.block_hash_index is None
+
+
+async def test_concurrent_first_use_initializes_version_once(substrate_cls, websocket):
+    client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket)
+
+    substrates = await asyncio.gather(*(client.get_substrate(150) for _ in range(5)))
+
+    assert all(s is substrates[0] for s in substrates)
+    assert substrate_cls.call_count == 1
+    substrates[0].init_runtime.assert_awaited_once_with(block_hash="0x150")
+    assert list(client.substrate_cache) == [150]
+
+
+async def test_query_initializes_default_version_on_demand(substrate_cls, websocket):
+    client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket)
+
+    substrate = await client.get_substrate(151)
+    substrate.get_block_hash = AsyncMock(return_value="0xabc")
+
+    assert await client.query("get_block_hash", None, 1) == "0xabc"
+    assert list(client.substrate_cache) == [151]
+
+
+async def test_unknown_version_is_rejected(substrate_cls, websocket):
+    client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket)
+
+    with pytest.raises(Exception, match="not known"):
+        await client.query("get_block_hash", 999, 1)
+
+
+async def test_latest_versions_are_warmed_in_background(substrate_cls, websocket):
+    websocket.connect = AsyncMock()
+    client = SubstrateClient(RUNTIME_MAPPINGS, "wss://mock", websocket=websocket, warm_versions=2)
+
+    await client.initialize()
+    await client._warm_task
+
+    assert sorted(client.substrate_cache) == [150, 151]
+
+
+async def test_block_runtime_version_is_read_from_parent_state(websocket):
+    async def request_batch(payloads, timeout=None):
+        responses = []
+        for p in payloads:
+            if p["method"] == "chain_getBlockHash":
+                responses.append({"jsonrpc": "2.0", "result": [f"0x{n:x}" for n in p["params"][0]]})
+            else:
+                parent = int(p["params"][0], 16)
+                responses.append({"jsonrpc": "2.0", "result": {"specVersion": 150 if parent < 20 else 151}})
+        return responses
+
+    websocket.request_batch.side_effect = request_batch
+    client = SubstrateClient({}, "wss://mock", websocket=websocket)
+
+    versions = await client.get_block_runtime_versions([20, 21])
+
+    assert versions == {20: 150, 21: 151}
@@ -0,0 +1,164 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from async_substrate_interface.errors import SubstrateRequestException
+
+from patrol_mining.chain_data.ownership_range_cache import OwnershipRangeCache
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
+from patrol_mining.hotkey_owner_finder import HotkeyOwnerFinder
+
+VERSIONS = {
+    "1": {"block_number_min": 0, "block_number_max": 49},
+    "2": {"block_number_min": 50, "block_number_max": 100},
+}
+
+
+def owner_at(block_number: int) -> str:
+    return "A" if block_number < 42 else "B"
+
+
+@pytest.fixture
+def substrate_client():
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex(VERSIONS)
+    client.get_block_hashes = AsyncMock(side_effect=lambda numbers: {n: f"0x{n}" for n in numbers})
+    client.query_batch = AsyncMock(
+        side_effect=lambda module, storage, params, hashes, version: [owner_at(int(h[2:])) for h in hashes]
+    )
+
+    async def query(method, version, *args, block_hash=None):
+        return owner_at(int(block_hash[2:]))
+
+    client.query = AsyncMock(side_effect=query)
+
+    async def query_storage_history(module, storage, params, block_ranges, version=None):
+        histories = []
+        for from_hash, to_hash in block_ranges:
+            low, high = int(from_hash[2:]), int(to_hash[2:])
+            changes = [n for n in range(low + 1, high + 1) if owner_at(n) != owner_at(n - 1)]
+            histories.append([(f"0x{n}", owner_at(n)) for n in [low] + changes])
+        return histories
+
+    client.query_storage_history = AsyncMock(side_effect=query_storage_history)
+    client.get_block_numbers = AsyncMock(side_effect=lambda hashes: {h: int(h[2:]) for h in hashes})
+    return client
+
+
+async def test_get_owners_at_batches_reads_per_runtime_version(substrate_client):
+    finder = HotkeyOwnerFinder(substrate_client)
+
+    owners = await finder.get_owners_at("hk", [10, 45, 60], current_block=100)
+
+    assert owners == ["A", "B", "B"]
+    substrate_client.get_block_hashes.assert_awaited_once_with([10, 45, 60])
+    versions = [call.args[4] for call in substrate_client.query_batch.await_args_list]
+    assert versions == [1, 2]
+
+
+async def test_find_owner_ranges(substrate_client):
+    finder = HotkeyOwnerFinder(substrate_client)
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    assert [n.id for n in graph.nodes] == ["A", "B"]
+    assert len(graph.edges) == 1
+    assert graph.edges[0].evidence.effective_block_number == 42
+
+
+async def test_find_owner_ranges_only_searches_blocks_after_cached_history(substrate_client, tmp_path):
+    path = str(tmp_path / "ownership.sqlite")
+    finder = HotkeyOwnerFinder(substrate_client, range_cache=OwnershipRangeCache(path))
+    await finder.find_owner_ranges("hk", minimum_block=0, max_block=60)
+    finder.range_cache.close()
+
+    finder = HotkeyOwnerFinder(substrate_client, range_cache=OwnershipRangeCache(path))
+    substrate_client.query.reset_mock()
+    substrate_client.query_batch.reset_mock()
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    assert [n.id for n in graph.nodes] == ["A", "B"]
+    assert [e.evidence.effective_block_number for e in graph.edges] == [42]
+    # Only the owner at the new head is read, no search.
+    assert [call.kwargs["block_hash"] for call in substrate_client.query.await_args_list] == ["0x100"]
+    substrate_client.query_batch.assert_not_awaited()
+    assert finder.range_cache.get("hk").verified_block == 100
+
+
+async def test_find_owner_ranges_from_cache_for_later_minimum_block(substrate_client):
+    finder = HotkeyOwnerFinder(substrate_client, range_cache=OwnershipRangeCache())
+    await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+    substrate_client.query.reset_mock()
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=45, max_block=90)
+
+    assert [n.id for n in graph.nodes] == ["B"]
+    assert graph.edges == []
+    substrate_client.query.assert_not_awaited()
+
+
+@pytest.mark.parametrize("search_arity", [2, 4, 16])
+async def test_k_ary_search_finds_every_change(substrate_client, search_arity):
+    changes = {17: "B", 63: "C", 64: "D"}
+
+    def owner(block_number: int) -> str:
+        return ([changes[n] for n in sorted(changes) if n <= block_number] or ["A"])[-1]
+
+    substrate_client.query_batch.side_effect = lambda module, storage, params, hashes, version: [owner(int(h[2:])) for h in hashes]
+    substrate_client.query.side_effect = lambda method, version, *args, block_hash=None: owner(int(block_hash[2:]))
+    finder = HotkeyOwnerFinder(substrate_client, search_arity=search_arity, history_chunk_blocks=0)
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    assert [n.id for n in graph.nodes] == ["A", "B", "C", "D"]
+    assert [(e.coldkey_source, e.evidence.effective_block_number) for e in graph.edges] == [("A", 17), ("B", 63), ("C", 64)]
+
+
+async def test_k_ary_search_reads_each_level_in_one_batch(substrate_client):
+    finder = HotkeyOwnerFinder(substrate_client, search_arity=10, history_chunk_blocks=0)
+
+    await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    # The ends of the range, then one batch per level: (0, 100] -> (40, 50] -> (41, 42]
+    hash_lookups = [call.args[0] for call in substrate_client.get_block_hashes.await_args_list]
+    assert hash_lookups == [[0, 100], list(range(10, 100, 10)), list(range(41, 50))]
+
+
+async def test_owner_history_is_read_in_concurrent_chunks(substrate_client):
+    finder = HotkeyOwnerFinder(substrate_client, history_chunk_blocks=42)
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    assert [n.id for n in graph.nodes] == ["A", "B"]
+    assert [e.evidence.effective_block_number for e in graph.edges] == [42]
+    substrate_client.query_storage_history.assert_awaited_once()
+    assert substrate_client.query_storage_history.await_args.args[3] == [("0x0", "0x41"), ("0x42", "0x83"), ("0x84", "0x100")]
+    substrate_client.query.assert_not_awaited()
+
+
+async def test_owner_history_finds_reverted_changes(substrate_client):
+    # A until block 10, B until 20, C until 30, A again until 40 and D from then on.
+    owners = [(0, "A"), (10, "B"), (20, "C"), (30, "A"), (40, "D")]
+
+    substrate_client.query_storage_history.side_effect = lambda *args: [[(f"0x{n}", o) for n, o in owners]]
+    substrate_client.query_batch.side_effect = lambda module, storage, params, hashes, version: ["A" if h == "0x0" else "D" for h in hashes]
+    finder = HotkeyOwnerFinder(substrate_client)
+
+    graph = await finder.find_owner_ranges("hk", minimum_block=0, max_block=100)
+
+    assert [(e.coldkey_source, e.coldkey_destination, e.evidence.effective_block_number) for e in graph.edges] == [
+        ("A", "B", 10), ("B", "C", 20), ("C", "A", 30), ("A", "D", 40)
+    ]
+    # Each wallet is a single node, however often it owned the hotkey.
+    assert [n.id for n in graph.nodes] == ["A", "B", "C", "D"]
+
+
+async def test_falls_back_to_point_reads_when_node_refuses_owner_history(substrate_client):
+    substrate_client.query_storage_history.side_effect = lambda *args: [SubstrateRequestException("Method not found")]
+    finder = HotkeyOwnerFinder(substrate_client)
+
+    for hotkey in ("hk1", "hk2"):
+        graph = await finder.find_owner_ranges(hotkey, minimum_block=0, max_block=100)
+        assert [e.evidence.effective_block_number for e in graph.edges] == [42]
+
+    substrate_client.query_storage_history.assert_awaited_once()
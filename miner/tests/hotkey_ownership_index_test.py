@@ -0,0 +1,142 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from bittensor.core.chain_data.utils import decode_account_id
+
+from patrol_mining import hotkey_ownership_index
+from patrol_mining.chain_data.runtime_groupings import RuntimeVersionIndex
+from patrol_mining.hotkey_owner_finder import HotkeyOwnerFinder
+from patrol_mining.hotkey_ownership_index import HotkeyOwnershipIndex, HotkeyOwnershipIndexer
+
+
+def account(n: int) -> tuple:
+    return (tuple([n] * 32),)
+
+
+def address(n: int) -> str:
+    return decode_account_id(account(n)[0])
+
+
+# hk1 is registered by coldkey 10 at block 105, moves to coldkey 11 by a coldkey swap at block 120,
+# and is swapped for hk2 at block 130.
+EVENTS = {
+    105: [{"event": {"SubtensorModule": [{"NeuronRegistered": (1, 0, account(1))}]}}],
+    120: [{"event": {"SubtensorModule": [{"ColdkeySwapped": (account(10), account(11))}]}}],
+    130: [{"event": {"SubtensorModule": [{"HotkeySwapped": (account(11), account(1), account(2))}]}}],
+}
+
+
+def owner(hotkey: str, block_number: int) -> str:
+    if hotkey == address(1):
+        if block_number < 105 or block_number >= 130:
+            return "nobody"
+        return address(10) if block_number < 120 else address(11)
+    if hotkey == address(2):
+        return address(11) if block_number >= 130 else "nobody"
+    return "nobody"
+
+
+class FakeEventFetcher:
+    def __init__(self, substrate_client=None):
+        self.substrate_client = substrate_client
+
+    async def fetch_all_events(self, block_numbers, batch_size=25):
+        return {n: EVENTS.get(n, []) for n in block_numbers}
+
+
+@pytest.fixture
+def substrate_client():
+    client = MagicMock()
+    client.runtime_index = RuntimeVersionIndex({"1": {"block_number_min": 0, "block_number_max": 1000}})
+    client.get_finalized_block_number = AsyncMock(return_value=140)
+    client.get_block_hashes = AsyncMock(side_effect=lambda numbers: {n: f"0x{n}" for n in numbers})
+
+    def query_batch(module, storage, params, hashes, version=None):
+        blocks = [int(h[2:]) for h in hashes]
+        if storage == "OwnedHotkeys":
+            return [[address(1)] if p[0] == address(11) and n >= 120 else [] for p, n in zip(params, blocks)]
+        return [owner(p[0], n) for p, n in zip(params, blocks)]
+
+    client.query_batch = AsyncMock(side_effect=query_batch)
+    return client
+
+
+def test_ranges_and_observations_persist(tmp_path):
+    path = str(tmp_path / "ownership.sqlite")
+    index = HotkeyOwnershipIndex(path)
+    index.add_ranges([(100, 119), (120, 139), (140, None)])
+    index.record(100, 120, [("hk", 105, "A"), ("hk", 110, "A"), ("hk", 115, "B")])
+    index.record(120, 125, [])
+    index.close()
+
+    reopened = HotkeyOwnershipIndex(path)
+
+    assert reopened.ranges == [(100, 119, 120), (120, 139, 125), (140, None, 140)]
+    assert reopened.covers(100, 124)
+    assert not reopened.covers(100, 125)
+    assert not reopened.covers(99, 110)
+    assert reopened.changes("hk", 100, 124, "nobody") == [(105, "nobody", "A"), (115, "A", "B")]
+    assert reopened.changes("hk", 105, 114, "A") == []
+
+
+async def test_owners_are_read_at_blocks_with_ownership_events(substrate_client):
+    indexer = HotkeyOwnershipIndexer(substrate_client, HotkeyOwnershipIndex())
+
+    observations = await indexer.scan_blocks(FakeEventFetcher(), 100, 139, head=140)
+
+    assert sorted(observations) == sorted([
+        (address(1), 105, address(10)),
+        (address(1), 120, address(11)),
+        (address(1), 130, "nobody"),
+        (address(2), 130, address(11)),
+    ])
+
+
+async def test_history_is_indexed_in_parallel_ranges_then_followed(substrate_client, monkeypatch):
+    monkeypatch.setattr(hotkey_ownership_index, "EventFetcher", FakeEventFetcher)
+    index = HotkeyOwnershipIndex()
+    indexer = HotkeyOwnershipIndexer(substrate_client, index, workers=2, chunk_blocks=10, poll_interval_seconds=0.01, start_block=100)
+
+    indexer.start()
+    try:
+        async def indexed():
+            while not index.covers(100, 140):
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(indexed(), 1)
+    finally:
+        indexer.stop()
+
+    assert [(start, end) for start, end, _ in index.ranges] == [(100, 120), (121, 140), (141, None)]
+    assert index.changes(address(1), 100, 140, "nobody") == [
+        (105, "nobody", address(10)), (120, address(10), address(11)), (130, address(11), "nobody")
+    ]
+
+
+async def test_owner_finder_answers_from_covered_index(substrate_client):
+    index = HotkeyOwnershipIndex()
+    index.add_ranges([(100, 140)])
+    index.record(100, 141, [(address(1), 105, address(10)), (address(1), 120, address(11)), (address(1), 130, "nobody")])
+    finder = HotkeyOwnerFinder(substrate_client, ownership_index=index)
+
+    graph = await finder.find_owner_ranges(address(1), minimum_block=100, max_block=140)
+
+    assert [(e.coldkey_source, e.coldkey_destination, e.evidence.effective_block_number) for e in graph.edges] == [
+        ("nobody", address(10), 105), (address(10), address(11), 120), (address(11), "nobody", 130)
+    ]
+    # Only the owners at both ends of the range were read, in one batch.
+    substrate_client.query_batch.assert_awaited_once()
+
+
+async def test_chunks_of_all_ranges_are_spaced_to_the_block_rate(substrate_client, monkeypatch):
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(hotkey_ownership_index.asyncio, "sleep", sleep)
+    indexer = HotkeyOwnershipIndexer(substrate_client, HotkeyOwnershipIndex(), max_blocks_per_second=1000)
+
+    await asyncio.gather(*(indexer.throttle(10) for _ in range(3)))
+
+    assert waits == [pytest.approx(0.01, abs=0.005), pytest.approx(0.02, abs=0.005), pytest.approx(0.03, abs=0.005)]
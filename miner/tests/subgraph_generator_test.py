@@ -0,0 +1,93 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from patrol_mining.subgraph_generator import SubgraphGenerator
+
+
+def transfer(source: str, destination: str, block_number: int) -> dict:
+    return {
+        "coldkey_source": source,
+        "coldkey_destination": destination,
+        "category": "balance",
+        "type": "transfer",
+        "evidence": {"rao_amount": 1, "block_number": block_number},
+    }
+
+
+TRANSFERS = {
+    5_000_000: [transfer("A", "B", 5_000_000)],
+    5_000_001: [transfer("B", "C", 5_000_001)],
+    5_000_002: [transfer("D", "E", 5_000_002)],
+}
+
+
+@pytest.fixture
+def event_fetcher():
+    fetcher = MagicMock()
+
+    async def stream_all_events(block_numbers, queue, missed_blocks=None, batch_size=25, target_block=None):
+        for block_number in block_numbers:
+            await queue.put({block_number: TRANSFERS[block_number]})
+        await queue.put(None)
+
+    async def fetch_all_events(block_numbers, batch_size=25):
+        return {n: TRANSFERS[n] for n in block_numbers}
+
+    fetcher.stream_all_events = stream_all_events
+    fetcher.fetch_all_events = fetch_all_events
+    return fetcher
+
+
+@pytest.fixture
+def event_processor():
+    processor = MagicMock()
+
+    async def process_event_data(event_data):
+        await asyncio.sleep(0)
+        return [event for events in event_data.values() for event in events]
+
+    processor.process_event_data = process_event_data
+    return processor
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+async def test_run_builds_subgraph_around_target(event_fetcher, event_processor, pipelined):
+    generator = SubgraphGenerator(event_fetcher, event_processor, max_future_events=1, max_past_events=1, pipelined=pipelined)
+
+    subgraph = await generator.run("A", target_block=5_000_001, max_block_number=5_000_002)
+
+    assert sorted(node.id for node in subgraph.nodes) == ["A", "B", "C"]
+    assert len(subgraph.edges) == 2
+
+
+async def test_pipeline_stops_all_stages_when_one_fails(event_fetcher, event_processor):
+    async def process_event_data(event_data):
+        raise RuntimeError("boom")
+
+    event_processor.process_event_data = process_event_data
+    generator = SubgraphGenerator(event_fetcher, event_processor, pipelined=True, queue_size=1)
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(generator.generate_adjacency_graph_pipelined(list(TRANSFERS)), 1)
+
+
+async def test_timeout_returns_subgraph_of_blocks_fetched_in_time(event_fetcher, event_processor):
+    streamed = []
+
+    async def stream_all_events(block_numbers, queue, missed_blocks=None, batch_size=25, target_block=None):
+        # Batches nearest to the target first, the last one never arriving in time.
+        await queue.put({n: TRANSFERS[n] for n in (5_000_001, 5_000_000)})
+        streamed.append(target_block)
+        await asyncio.sleep(10)
+        await queue.put({5_000_002: TRANSFERS[5_000_002]})
+        await queue.put(None)
+
+    event_fetcher.stream_all_events = stream_all_events
+    generator = SubgraphGenerator(event_fetcher, event_processor, max_future_events=1, max_past_events=1, batch_size=2, timeout=0.2)
+
+    subgraph = await asyncio.wait_for(generator.run("B", target_block=5_000_001, max_block_number=5_000_002), 1)
+
+    assert streamed == [5_000_001]
+    assert sorted(node.id for node in subgraph.nodes) == ["A", "B", "C"]
@@ -0,0 +1,121 @@
+import random
+
+from patrol_mining.transaction_graph import TransactionGraph
+
+
+def transfer(source: str, destination: str, amount: int = 1, block_number: int = 5_000_000) -> dict:
+    return {
+        "coldkey_source": source,
+        "coldkey_destination": destination,
+        "category": "balance",
+        "type": "transfer",
+        "evidence": {"rao_amount": amount, "block_number": block_number},
+    }
+
+
+def stake_move(owner: str, source: str, destination: str, amount: int = 1) -> dict:
+    return {
+        "coldkey_owner": owner,
+        "coldkey_source": source,
+        "coldkey_destination": destination,
+        "category": "staking",
+        "type": "move",
+        "evidence": {
+            "rao_amount": amount,
+            "delegate_hotkey_source": "hk1",
+            "delegate_hotkey_destination": "hk2",
+            "source_net_uid": 1,
+            "destination_net_uid": 2,
+            "block_number": 5_000_000,
+        },
+    }
+
+
+def reference_subgraph(events: list[dict], target: str) -> tuple[list[str], list[tuple]]:
+    """
+    Breadth first search over a dict of adjacency lists, as SubgraphGenerator used to build subgraphs.
+    """
+    graph = {}
+    for event in events:
+        if event["evidence"]["rao_amount"] == 0:
+            continue
+        src, dst, ownr = event.get("coldkey_source"), event.get("coldkey_destination"), event.get("coldkey_owner")
+        connections = []
+        if src and dst:
+            connections += [(src, dst), (dst, src)]
+        if src and ownr:
+            connections += [(src, ownr), (ownr, src)]
+        if dst and ownr:
+            connections += [(dst, ownr), (ownr, dst)]
+        for a, b in connections:
+            graph.setdefault(a, []).append({"neighbor": b, "event": event})
+
+    nodes, edges, seen_nodes, seen_edges, queue = [], [], set(), set(), [target]
+    while queue:
+        current = queue.pop(0)
+        if current not in seen_nodes:
+            nodes.append(current)
+            seen_nodes.add(current)
+        for conn in graph.get(current, []):
+            key = TransactionGraph.edge_key(conn["event"])
+            if key not in seen_edges:
+                seen_edges.add(key)
+                edges.append(key)
+            if conn["neighbor"] not in seen_nodes and conn["neighbor"] not in queue:
+                queue.append(conn["neighbor"])
+    return nodes, edges
+
+
+def test_subgraph_is_the_connected_component_of_the_target():
+    graph = TransactionGraph()
+    graph.add_events([transfer("A", "B"), transfer("B", "C"), transfer("D", "E"), stake_move("C", "F", "G")])
+
+    subgraph = graph.subgraph("A")
+
+    assert [node.id for node in subgraph.nodes] == ["A", "B", "C", "F", "G"]
+    assert [(e.coldkey_source, e.coldkey_destination) for e in subgraph.edges] == [("A", "B"), ("B", "C"), ("F", "G")]
+    assert subgraph.edges[2].coldkey_owner == "C"
+
+
+def test_duplicate_and_zero_amount_events_are_left_out():
+    graph = TransactionGraph()
+    graph.add_events([transfer("A", "B"), transfer("A", "B"), transfer("A", "C", amount=0)])
+
+    subgraph = graph.subgraph("A")
+
+    assert [node.id for node in subgraph.nodes] == ["A", "B"]
+    assert len(subgraph.edges) == 1
+    assert len(graph.events) == 1
+
+
+def test_unknown_target_is_a_single_node():
+    subgraph = TransactionGraph().subgraph("A")
+
+    assert [node.id for node in subgraph.nodes] == ["A"]
+    assert subgraph.edges == []
+
+
+def test_matches_adjacency_list_search_on_random_graphs():
+    rng = random.Random(7)
+    wallets = [f"w{n}" for n in range(60)]
+    events = []
+    for _ in range(400):
+        if rng.random() < 0.7:
+            events.append(transfer(rng.choice(wallets), rng.choice(wallets), rng.randrange(3), 5_000_000 + rng.randrange(5)))
+        else:
+            events.append(stake_move(rng.choice(wallets), rng.choice(wallets), rng.choice(wallets), rng.randrange(1, 3)))
+
+    graph = TransactionGraph()
+    # Added in two parts, so the CSR arrays are rebuilt after growing.
+    graph.add_events(events[:200])
+    graph.subgraph(wallets[0])
+    graph.add_events(events[200:])
+
+    for target in wallets[:10]:
+        subgraph = graph.subgraph(target)
+        nodes, edges = reference_subgraph(events, target)
+        assert [node.id for node in subgraph.nodes] == nodes
+        assert [
+            (e.coldkey_source, e.coldkey_destination, e.category, e.type, e.evidence.rao_amount, e.evidence.block_number)
+            for e in subgraph.edges
+        ] == edges
@@ -0,0 +1,134 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from patrol_mining.subgraph_generator import SubgraphGenerator
+from patrol_mining.transaction_index import TransactionIndex, TransactionIndexer
+
+
+def transfer(source: str, destination: str, block_number: int) -> dict:
+    return {
+        "coldkey_source": source,
+        "coldkey_destination": destination,
+        "category": "balance",
+        "type": "transfer",
+        "evidence": {"rao_amount": 1, "block_number": block_number},
+    }
+
+
+def make_fetcher(head: int):
+    fetcher = MagicMock()
+    fetcher.substrate_client.get_finalized_block_number = AsyncMock(return_value=head)
+
+    async def fetch_all_events(block_numbers, batch_size=25):
+        return {n: [transfer(f"w{n}", f"w{n + 1}", n)] if n % 2 == 0 else [] for n in block_numbers}
+
+    fetcher.fetch_all_events = AsyncMock(side_effect=fetch_all_events)
+    return fetcher
+
+
+def make_processor():
+    processor = MagicMock()
+
+    async def process_event_data(event_data, failed_blocks=None):
+        return [event for events in event_data.values() for event in events]
+
+    processor.process_event_data = process_event_data
+    return processor
+
+
+def test_blocks_persist_including_those_without_events(tmp_path):
+    path = str(tmp_path / "transactions.sqlite")
+    index = TransactionIndex(path)
+    index.put_blocks({100: [transfer("A", "B", 100)], 101: []})
+    index.close()
+
+    reopened = TransactionIndex(path)
+
+    assert reopened.get_range(99, 102) == {100: [transfer("A", "B", 100)], 101: []}
+    assert reopened.missing([99, 100, 101, 102]) == [99, 102]
+    assert (reopened.lowest_block, reopened.highest_block, len(reopened)) == (100, 101, 2)
+
+
+async def test_indexer_follows_the_head_before_backfilling():
+    index = TransactionIndex()
+    fetcher = make_fetcher(head=5_000_100)
+    indexer = TransactionIndexer(fetcher, make_processor(), index, backfill_blocks=25, chunk_blocks=10)
+
+    assert await indexer.step() == 10
+    assert (index.lowest_block, index.highest_block) == (5_000_091, 5_000_100)
+
+    fetcher.substrate_client.get_finalized_block_number.return_value = 5_000_103
+    assert await indexer.step() == 3
+    assert index.highest_block == 5_000_103
+
+    while await indexer.step():
+        pass
+
+    assert (index.lowest_block, index.highest_block) == (5_000_078, 5_000_103)
+    assert index.missing(range(5_000_078, 5_000_104)) == []
+    assert index.get_range(5_000_080, 5_000_081) == {5_000_080: [transfer("w5000080", "w5000081", 5_000_080)], 5_000_081: []}
+
+
+async def test_chunk_with_blocks_not_fetched_or_processed_is_not_stored():
+    index = TransactionIndex()
+    fetcher = make_fetcher(head=5_000_100)
+    processor = make_processor()
+    indexer = TransactionIndexer(fetcher, processor, index, backfill_blocks=25, chunk_blocks=10)
+
+    fetcher.fetch_all_events.side_effect = lambda block_numbers, batch_size=25: {n: [] for n in block_numbers if n != 5_000_095}
+    with pytest.raises(Exception, match="5000095"):
+        await indexer.step()
+
+    fetcher.fetch_all_events.side_effect = lambda block_numbers, batch_size=25: {n: [] for n in block_numbers}
+
+    async def process_event_data(event_data, failed_blocks=None):
+        failed_blocks.append(5_000_097)
+        return []
+
+    processor.process_event_data = process_event_data
+    with pytest.raises(Exception, match="5000097"):
+        await indexer.step()
+
+    assert len(index) == 0
+
+
+async def test_run_reads_wide_window_from_index_and_fetches_only_missing_blocks():
+    index = TransactionIndex()
+    index.put_blocks({n: [transfer(f"w{n}", f"w{n + 1}", n)] for n in range(5_000_000, 5_000_050) if n != 5_000_031})
+    fetcher = make_fetcher(head=5_000_100)
+    generator = SubgraphGenerator(
+        fetcher, make_processor(), max_future_events=2, max_past_events=2,
+        transaction_index=index, indexed_past_blocks=40, indexed_future_blocks=40
+    )
+
+    subgraph = await generator.run("w5000030", target_block=5_000_030, max_block_number=5_000_100)
+
+    fetcher.fetch_all_events.assert_awaited_once_with([5_000_031])
+    # The indexed chain is only broken at 5_000_031, which has no events, so the target's side ends there.
+    assert sorted(node.id for node in subgraph.nodes) == [f"w{n}" for n in range(5_000_000, 5_000_032)]
+    assert len(subgraph.edges) == 31
+
+
+async def test_blocks_missing_from_index_are_collected_by_pipeline_when_enabled():
+    index = TransactionIndex()
+    index.put_blocks({n: [transfer(f"w{n}", f"w{n + 1}", n)] for n in range(5_000_028, 5_000_033) if n != 5_000_031})
+    fetcher = make_fetcher(head=5_000_100)
+    streamed = []
+
+    async def stream_all_events(block_numbers, queue, missed_blocks=None, batch_size=25):
+        streamed.extend(block_numbers)
+        await queue.put({n: [transfer(f"w{n}", f"w{n + 1}", n)] for n in block_numbers})
+        await queue.put(None)
+
+    fetcher.stream_all_events = stream_all_events
+    generator = SubgraphGenerator(
+        fetcher, make_processor(), max_future_events=2, max_past_events=2, pipelined=True,
+        transaction_index=index, indexed_past_blocks=2, indexed_future_blocks=2
+    )
+
+    subgraph = await generator.run("w5000030", target_block=5_000_030, max_block_number=5_000_100)
+
+    assert streamed == [5_000_031]
+    fetcher.fetch_all_events.assert_not_awaited()
+    assert sorted(node.id for node in subgraph.nodes) == [f"w{n}" for n in range(5_000_028, 5_000_034)]
@@ -7,6 +7,7 @@ from typing import Iterable, Any
 import bittensor.core.chain_data
 
 from bittensor.core.async_subtensor import AsyncSubstrateInterface
+from patrol_common.block_hash_index import BlockHashIndex, ChainMismatchError
 from patrol.validation.predict_alpha_sell import ChainStakeEvent, TransactionType
 
 from patrol.validation.chain import ChainEvent
@@ -20,8 +21,12 @@ PreprocessedTuple = namedtuple("PreprocessedTuple", ["block_number", "block_hash
 
 
 class ChainReader:
-    def __init__(self, substrate: AsyncSubstrateInterface):
+    def __init__(self, substrate: AsyncSubstrateInterface, block_hash_index: BlockHashIndex = None, max_batch_size: int = 100):
         self.substrate = substrate
+        self.block_hash_index = block_hash_index
+        self.max_batch_size = max_batch_size
+        self._last_finalized_block = None
+        self._block_hash_index_bound = False
         #self._substrate_client = substrate_client
         #self._runtime_versions = runtime_versions
 
@@ -91,8 +96,11 @@ class ChainReader:
             name = ev["event_id"]
             return module == "SubtensorModule" and name in target_events
 
+        block_numbers = list(block_numbers)
+        block_hashes = await self._get_block_hashes(block_numbers)
+
         async def events_task(block_number: int):
-            block_hash = await self.substrate.get_block_hash(block_number)
+            block_hash = block_hashes.get(block_number)
             events = await self.substrate.get_events(block_hash)
             return [self._make_chain_event_for_staking(block_number, event) for event in filter(is_staking_event, events)]
 
@@ -144,13 +152,56 @@ class ChainReader:
         return current_block["header"]["number"]
 
     async def _get_block_hash(self, block_number: int) -> tuple[int, str]: #, runtime_version: int) -> tuple[int, str]:
-        return block_number, await self.substrate.get_block_hash(block_number)
+        return block_number, (await self._get_block_hashes([block_number])).get(block_number)
         # return block_number, await self._substrate_client.query(
         #     "get_block_hash",
         #     runtime_version,
         #     block_number
         # )
 
+    async def _bind_block_hash_index(self):
+        """
+        Binds the block hash index to the chain read from, leaving the index unused when it holds the block
+        hashes of another chain.
+        """
+        try:
+            self.block_hash_index.bind(await self.substrate.get_block_hash(0))
+            self._block_hash_index_bound = True
+        except ChainMismatchError as e:
+            logger.warning("Not using the block hash index: %s", e)
+            self.block_hash_index = None
+
+    async def _get_block_hashes(self, block_numbers: list[int]) -> dict[int, str]:
+        """
+        Looks up block hashes, reading finalized blocks from the block hash index when one is configured and
+        fetching the rest with array-argument chain_getBlockHash calls of up to `max_batch_size` blocks each.
+        Finalized blocks are added to the index.
+        """
+        if self.block_hash_index is not None and not self._block_hash_index_bound:
+            await self._bind_block_hash_index()
+        block_hashes = self.block_hash_index.get_many(block_numbers) if self.block_hash_index else {}
+
+        missing = [n for n in block_numbers if n not in block_hashes]
+        if not missing:
+            return block_hashes
+
+        chunks = [missing[i:i + self.max_batch_size] for i in range(0, len(missing), self.max_batch_size)]
+        responses = await asyncio.gather(*(self.substrate.rpc_request("chain_getBlockHash", [chunk]) for chunk in chunks))
+        fetched = {
+            n: h
+            for chunk, response in zip(chunks, responses)
+            for n, h in zip(chunk, response["result"])
+            if h is not None
+        }
+        block_hashes.update(fetched)
+
+        if self.block_hash_index is not None and fetched:
+            if self._last_finalized_block is None or max(fetched) > self._last_finalized_block:
+                self._last_finalized_block = await self.get_last_finalized_block()
+            self.block_hash_index.put_many({n: h for n, h in fetched.items() if n <= self._last_finalized_block})
+
+        return block_hashes
+
     # async def _chain_events_for(self, raw_events: dict[str, list[tuple[dict]]], block_numbers: dict[str, int]):
     #
     #     def transform(event_tuple: tuple):
@@ -18,6 +18,7 @@ BITTENSOR_PATH = os.getenv('BITTENSOR_PATH')
 
 ENABLE_WEIGHT_SETTING = os.getenv('ENABLE_WEIGHT_SETTING', "1") == "1"
 ARCHIVE_SUBTENSOR = os.getenv('ARCHIVE_SUBTENSOR', "wss://archive.chain.opentensor.ai:443")
+BLOCK_HASH_INDEX_PATH = os.getenv('BLOCK_HASH_INDEX_PATH', "~/.patrol/block_hashes.bin")
 
 SCORING_INTERVAL_SECONDS = int(os.getenv('SCORING_INTERVAL_SECONDS', "60"))
 WEIGHT_SETTING_INTERVAL_SECONDS = int(os.getenv('WEIGHT_SETTING_INTERVAL_SECONDS', "60"))
@@ -12,6 +12,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from patrol.validation import Miner, hooks
 from patrol.validation.aws_rds import consume_db_engine
 from patrol.validation.chain.chain_reader import ChainReader
+from patrol_common.block_hash_index import BlockHashIndex
 from patrol.validation.hooks import HookType
 from patrol.validation.hotkey_ownership.hotkey_ownership_challenge import HotkeyOwnershipChallenge, \
     HotkeyOwnershipValidator
@@ -79,13 +80,14 @@ class HotkeyOwnershipBatch:
         return batch_id
 
 async def run_forever(wallet: Wallet, db_url: str, patrol_subtensor: AsyncSubtensor, patrol_metagraph: AsyncMetagraph, enable_dashboard_syndication: bool):
-    from patrol.validation.config import DASHBOARD_BASE_URL, NET_UID, BATCH_CONCURRENCY, ARCHIVE_SUBTENSOR
+    from patrol.validation.config import DASHBOARD_BASE_URL, NET_UID, BATCH_CONCURRENCY, ARCHIVE_SUBTENSOR, BLOCK_HASH_INDEX_PATH
 
     engine = create_async_engine(db_url)
     hooks.invoke(HookType.ON_CREATE_DB_ENGINE, engine)
 
     archive_subtensor = AsyncSubtensor(ARCHIVE_SUBTENSOR)
-    chain_reader = ChainReader(archive_subtensor.substrate)
+    block_hash_index = BlockHashIndex(BLOCK_HASH_INDEX_PATH) if BLOCK_HASH_INDEX_PATH else None
+    chain_reader = ChainReader(archive_subtensor.substrate, block_hash_index)
 
     dendrite = Dendrite(wallet)
     miner_client = HotkeyOwnershipMinerClient(dendrite)
@@ -13,6 +13,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from patrol.validation import TaskType, hooks
 from patrol.validation.aws_rds import consume_db_engine
 from patrol.validation.chain.chain_reader import ChainReader
+from patrol_common.block_hash_index import BlockHashIndex
 from patrol.validation.dashboard import DashboardClient
 from patrol.validation.hooks import HookType
 from patrol.validation.http_.HttpDashboardClient import HttpDashboardClient
@@ -172,7 +173,7 @@ def start_scoring(wallet: Wallet, db_url: str, enable_dashboard_syndication: boo
         hooks.add_on_create_db_engine(consume_db_engine)
 
     async def start_scoring_async():
-        from patrol.validation.config import DASHBOARD_BASE_URL, ARCHIVE_SUBTENSOR, SCORING_INTERVAL_SECONDS
+        from patrol.validation.config import DASHBOARD_BASE_URL, ARCHIVE_SUBTENSOR, SCORING_INTERVAL_SECONDS, BLOCK_HASH_INDEX_PATH
         engine = create_async_engine(db_url, pool_pre_ping=True)
         hooks.invoke(HookType.ON_CREATE_DB_ENGINE, engine)
 
@@ -184,7 +185,8 @@ def start_scoring(wallet: Wallet, db_url: str, enable_dashboard_syndication: boo
         transaction_helper = TransactionHelper(engine)
 
         async with AsyncSubstrateInterface(ARCHIVE_SUBTENSOR) as substrate:
-            chain_utils = ChainReader(substrate)
+            block_hash_index = BlockHashIndex(BLOCK_HASH_INDEX_PATH) if BLOCK_HASH_INDEX_PATH else None
+            chain_utils = ChainReader(substrate, block_hash_index)
             scoring = AlphaSellScoring(
                 challenge_repository,
                 miner_score_repository,
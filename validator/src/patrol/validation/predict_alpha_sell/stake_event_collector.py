@@ -7,6 +7,7 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from patrol.validation import hooks
 from patrol.validation.aws_rds import consume_db_engine
 from patrol.validation.chain.chain_reader import ChainReader
+from patrol_common.block_hash_index import BlockHashIndex
 from patrol.validation.hooks import HookType
 from patrol.validation.persistence.alpha_sell_challenge_repository import DatabaseAlphaSellChallengeRepository
 from patrol.validation.persistence.alpha_sell_event_repository import DataBaseAlphaSellEventRepository
@@ -80,7 +81,7 @@ class StakeEventCollector:
 
 
 async def start(db_url: str):
-    from patrol.validation.config import ARCHIVE_SUBTENSOR, ENABLE_AWS_RDS_IAM
+    from patrol.validation.config import ARCHIVE_SUBTENSOR, ENABLE_AWS_RDS_IAM, BLOCK_HASH_INDEX_PATH
 
     if ENABLE_AWS_RDS_IAM:
         hooks.add_on_create_db_engine(consume_db_engine)
@@ -89,7 +90,8 @@ async def start(db_url: str):
         engine = create_async_engine(db_url)
         hooks.invoke(HookType.ON_CREATE_DB_ENGINE, engine)
         event_repository = DataBaseAlphaSellEventRepository(engine)
-        chain_reader = ChainReader(substrate)
+        block_hash_index = BlockHashIndex(BLOCK_HASH_INDEX_PATH) if BLOCK_HASH_INDEX_PATH else None
+        chain_reader = ChainReader(substrate, block_hash_index)
 
         alpha_sell_challenge_repository = DatabaseAlphaSellChallengeRepository(engine)
 
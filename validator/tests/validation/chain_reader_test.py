@@ -185,3 +185,65 @@ async def test_get_current_block():
     chain_utils = ChainReader(mock_substrate)
     current_block = await chain_utils.get_current_block()
     assert current_block == 5649525
+
+
+GENESIS_HASH = "0x" + "12" * 32
+
+
+async def test_block_hashes_of_finalized_blocks_are_indexed(tmp_path):
+    from patrol_common.block_hash_index import BlockHashIndex
+
+    hashes = {n: f"0x{n:064x}" for n in (100, 101, 102)}
+
+    mock_substrate = AsyncMock(AsyncSubstrateInterface)
+    mock_substrate.rpc_request = AsyncMock(
+        side_effect=lambda method, params: {"result": [hashes[n] for n in params[0]]}
+    )
+    mock_substrate.get_chain_finalised_head = AsyncMock(return_value="0xhead")
+    mock_substrate.get_block_header = AsyncMock(return_value={"header": {"number": 101}})
+    mock_substrate.get_block_hash = AsyncMock(return_value=GENESIS_HASH)
+
+    with BlockHashIndex(str(tmp_path / "block_hashes.bin")) as index:
+        chain_reader = ChainReader(mock_substrate, index)
+
+        assert await chain_reader._get_block_hashes([100, 101, 102]) == hashes
+        assert index.genesis_hash == GENESIS_HASH
+        mock_substrate.rpc_request.assert_awaited_once_with("chain_getBlockHash", [[100, 101, 102]])
+        assert index.get_many([100, 101, 102]) == {100: hashes[100], 101: hashes[101]}
+
+        assert await chain_reader._get_block_hash(100) == (100, hashes[100])
+        assert mock_substrate.rpc_request.await_count == 1
+
+
+async def test_block_hash_index_of_another_chain_is_left_unused(tmp_path):
+    from patrol_common.block_hash_index import BlockHashIndex
+
+    mock_substrate = AsyncMock(AsyncSubstrateInterface)
+    mock_substrate.rpc_request = AsyncMock(return_value={"result": [f"0x{100:064x}"]})
+    mock_substrate.get_block_hash = AsyncMock(return_value=GENESIS_HASH)
+
+    with BlockHashIndex(str(tmp_path / "block_hashes.bin")) as index:
+        index.bind("0x" + "ab" * 32)
+        index.put(100, "0x" + "cd" * 32)
+        chain_reader = ChainReader(mock_substrate, index)
+
+        assert await chain_reader._get_block_hashes([100]) == {100: f"0x{100:064x}"}
+        assert chain_reader.block_hash_index is None
+
+
+async def test_block_hashes_are_fetched_in_chunks():
+    hashes = {n: f"0x{n:064x}" for n in range(100, 105)}
+
+    mock_substrate = AsyncMock(AsyncSubstrateInterface)
+    mock_substrate.rpc_request = AsyncMock(
+        side_effect=lambda method, params: {"result": [hashes[n] for n in params[0]]}
+    )
+
+    chain_reader = ChainReader(mock_substrate, max_batch_size=2)
+
+    assert await chain_reader._get_block_hashes(list(hashes)) == hashes
+    assert [call.args for call in mock_substrate.rpc_request.await_args_list] == [
+        ("chain_getBlockHash", [[100, 101]]),
+        ("chain_getBlockHash", [[102, 103]]),
+        ("chain_getBlockHash", [[104]]),
+    ]